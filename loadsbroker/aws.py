@@ -6,11 +6,13 @@ AWS instances and collections of instances easier and less error-prone.
 :class:`EC2Instance` is responsible for maintaining information about
 itself and updating its state when asked to. The executer passed in
 must be capable of running functions that may block, ie a Greenlet or
-ThreadPool executor.
+ThreadPool executor. Instances are tracked as compact
+:class:`InstanceRecord`'s rather than boto instance objects.
 
 :class:`EC2Collection` is a group of instances for a given allocation
 request. Collections should be passed back to the Pool when their use
-is no longer required.
+is no longer required. Allocations spread across several regions are
+returned as a :class:`MultiRegionCollection` of per-region collections.
 
 An EC2 Pool is responsible for allocating and dispersing
 :class:`EC2Instance's <EC2Instance>` and terminating idle instances.
@@ -22,24 +24,33 @@ instances by querying AWS for appropriate instance types.
 
 """
 import concurrent.futures
+import json
+import os
+import re
+import tempfile
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from functools import partial
+from typing import Dict, Optional, Sequence, Tuple
 
-from attr import attrib, attrs
+from attr import Factory, attrib, attrs
 from boto.ec2 import connect_to_region
-from boto.ec2.instance import Instance  # noqa
+from boto.exception import EC2ResponseError
 from tornado import gen
 from tornado.concurrent import Future
 from tornado.platform.asyncio import to_tornado_future
 import tornado.ioloop
+import tornado.locks
 
 from loadsbroker.exceptions import LoadsException
+from loadsbroker.ratelimit import DESCRIBE, MUTATE, RUN, RateLimiter
 from loadsbroker import logger
 
 
-_POPULATED = False
+# Regions whose AMI ID's have been populated
+_POPULATED = set()
 AWS_REGIONS = (
     # "ap-northeast-1", "ap-southeast-1", "ap-southeast-2",  # speeding up
     "eu-west-1",
@@ -54,6 +65,64 @@ AWS_REGIONS = (
 # virtualization type of the appropriate AMI to use
 AWS_AMI_IDS = {k: {} for k in AWS_REGIONS}
 
+# How long a cached AMI catalog is used before being refreshed, in seconds
+AMI_CATALOG_TTL = 24 * 60 * 60
+
+
+# Maximum instance ID's to describe in a single DescribeInstances call
+DESCRIBE_BATCH_SIZE = 200
+
+# Maximum resources to tag in a single CreateTags call
+TAG_BATCH_SIZE = 500
+# How many times instances AWS doesn't know of yet are re-tagged
+TAG_RETRIES = 6
+_INSTANCE_ID_RE = re.compile(r"i-[0-9a-f]+")
+
+# Maximum instances to terminate in a single TerminateInstances call
+TERMINATE_BATCH_SIZE = 1000
+# How many times a batch failing to terminate is retried
+TERMINATE_RETRIES = 3
+
+# Most instances requested by a single RunInstances call when partial
+# allocation is allowed
+ALLOCATION_CHUNK = 100
+# RunInstances errors meaning the instance type/zone is out of capacity
+CAPACITY_ERRORS = frozenset([
+    "InsufficientInstanceCapacity",
+    "InstanceLimitExceeded",
+    "Unsupported",
+])
+
+# How often spot requests are checked for fulfilment, and for how long,
+# in seconds
+SPOT_POLL_INTERVAL = 5
+SPOT_TIMEOUT = 300
+# Spot request status codes of instances AWS is reclaiming
+SPOT_INTERRUPTION_CODES = frozenset([
+    "marked-for-stop",
+    "marked-for-termination",
+    "instance-stopped-by-price",
+    "instance-stopped-no-capacity",
+    "instance-terminated-by-price",
+    "instance-terminated-capacity-oversubscribed",
+    "instance-terminated-no-capacity",
+])
+
+# How long a region's instance listing is served from the inventory, in
+# seconds
+INVENTORY_TTL = 10
+
+# Tags kept on the instance records
+TRACKED_TAGS = frozenset(["Name", "Project", "RunId", "Uuid", "Owner"])
+
+# Threads shared by the collections of a pool
+COLLECTION_THREADS = 100
+# Maximum blocking calls a single collection runs at once
+COLLECTION_CONCURRENCY = 50
+
+# How often the pool checks for instances idle beyond its max_idle, in
+# seconds
+IDLE_REAP_INTERVAL = 60
 
 # How long after est. run times to trigger the reaper
 REAPER_DELTA = timedelta(hours=5)
@@ -62,13 +131,15 @@ REAPER_FORCE = timedelta(hours=24)
 REAPER_STATE = 'ThirdState'
 
 
-def populate_ami_ids(aws_access_key_id=None, aws_secret_access_key=None,
-                     port=None, owner_id="595879546273", use_filters=True):
-    """Populate all the AMI ID's with the latest CoreOS stable info.
+def populate_region_ami_ids(region, aws_access_key_id=None,
+                            aws_secret_access_key=None, port=None,
+                            owner_id="595879546273", use_filters=True):
+    """Populate the AMI ID's of a single region with the latest CoreOS
+    stable info.
 
-    This is a longer blocking operation and should be done on startup.
+    This is a blocking operation and should be run in an executor.
     """
-    global _POPULATED
+    logger.debug("Working in %s" % region)
 
     # see https://github.com/boto/boto/issues/2617
     if port is not None:
@@ -76,31 +147,44 @@ def populate_ami_ids(aws_access_key_id=None, aws_secret_access_key=None,
     else:
         is_secure = True
 
+    conn = connect_to_region(
+        region,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        port=port, is_secure=is_secure)
+
+    filters = {}
+    if owner_id is not None and use_filters:
+        filters["owner-id"] = owner_id
+
+    images = conn.get_all_images(filters=filters)
+
+    # The last two highest sorted are the pvm and hvm instance id's
+    # what is this 899.4 ??? XXX
+    # images = sorted([x for x in images if "899.4" in x.name],
+    #                key=lambda x: x.name)[-2:]
+    images = sorted(images, key=lambda x: x.name)[-2:]
+    AWS_AMI_IDS[region] = {x.virtualization_type: x.id for x in images}
+    _POPULATED.add(region)
+    logger.debug("%s populated" % region)
+
+
+def populate_ami_ids(aws_access_key_id=None, aws_secret_access_key=None,
+                     port=None, owner_id="595879546273", use_filters=True):
+    """Populate all the AMI ID's with the latest CoreOS stable info.
+
+    This is a longer blocking operation, :class:`EC2Pool` instead
+    populates each region in the background via
+    :func:`populate_region_ami_ids`.
+    """
     # Spin up a temp thread pool to make this faster
     errors = []
 
     def get_amis(region):
-        logger.debug("Working in %s" % region)
         try:
-            conn = connect_to_region(
-                region,
-                aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key,
-                port=port, is_secure=is_secure)
-
-            filters = {}
-            if owner_id is not None and use_filters:
-                filters["owner-id"] = owner_id
-
-            images = conn.get_all_images(filters=filters)
-
-            # The last two highest sorted are the pvm and hvm instance id's
-            # what is this 899.4 ??? XXX
-            # images = sorted([x for x in images if "899.4" in x.name],
-            #                key=lambda x: x.name)[-2:]
-            images = sorted(images, key=lambda x: x.name)[-2:]
-            AWS_AMI_IDS[region] = {x.virtualization_type: x for x in images}
-            logger.debug("%s populated" % region)
+            populate_region_ami_ids(
+                region, aws_access_key_id, aws_secret_access_key,
+                port=port, owner_id=owner_id, use_filters=use_filters)
         except Exception as exc:
             logger.exception('Could not get all images in %s' % region)
             errors.append(exc)
@@ -112,8 +196,6 @@ def populate_ami_ids(aws_access_key_id=None, aws_secret_access_key=None,
     if len(errors) > 0:
         raise errors[0]
 
-    _POPULATED = True
-
 
 def get_ami(region, instance_type):
     """Returns the appropriate AMI to use for a given region + instance type
@@ -129,7 +211,7 @@ def get_ami(region, instance_type):
         AMI's.
 
     """
-    if not _POPULATED:
+    if region not in _POPULATED:
         raise KeyError('populate_ami_ids must be called first')
 
     instances = AWS_AMI_IDS[region]
@@ -142,17 +224,140 @@ def get_ami(region, instance_type):
         msg = "Could not find instance type %r in %s for region %s"
         raise KeyError(msg % (inst_type, list(instances.keys()), region))
 
-    return instances[inst_type].id
+    return instances[inst_type]
+
+
+class AMICatalog:
+    """On-disk catalog of the AMI ID's of every region.
+
+    Maps a region to the AMI ID's keyed by virtualization type along
+    with when they were fetched, so a restarted broker can use them
+    right away and refresh them in the background once they're older
+    than ``ttl`` seconds.
+
+    The catalog is copied with :meth:`snapshot` on the io loop, and the
+    copy written with :meth:`save` in an executor.
+
+    """
+    def __init__(self, path, ttl=AMI_CATALOG_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._fetched = {}
+        self._version = 0
+        self._saved_version = 0
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        """Load the catalog into :data:`AWS_AMI_IDS`.
+
+        :returns: Regions that were loaded from the catalog.
+
+        """
+        try:
+            with open(self.path) as f:
+                catalog = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable AMI catalog %s", self.path,
+                           exc_info=True)
+            return []
+
+        if not isinstance(catalog, dict):
+            logger.warning("Ignoring malformed AMI catalog %s", self.path)
+            return []
+
+        loaded = []
+        for region, entry in catalog.items():
+            if region not in AWS_AMI_IDS:
+                continue
+            try:
+                images = dict(entry["images"])
+                fetched_at = float(entry["fetched_at"])
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Ignoring malformed AMI catalog entry for "
+                               "%s in %s", region, self.path)
+                continue
+            AWS_AMI_IDS[region] = images
+            _POPULATED.add(region)
+            self._fetched[region] = fetched_at
+            loaded.append(region)
+        logger.debug("Loaded AMI catalog for %s from %s", loaded, self.path)
+        return loaded
+
+    def fetched_at(self, region):
+        """Returns when the region was fetched, if it's in the catalog."""
+        return self._fetched.get(region)
+
+    def expires_in(self, region):
+        """Seconds until the region should be refreshed."""
+        fetched_at = self.fetched_at(region)
+        if fetched_at is None:
+            return 0
+        return max(0, fetched_at + self.ttl - time.time())
+
+    def update(self, region):
+        """Record the region's current :data:`AWS_AMI_IDS` as fetched."""
+        self._fetched[region] = time.time()
+
+    def snapshot(self):
+        """Copy the catalog for :meth:`save`."""
+        self._version += 1
+        catalog = {region: {"fetched_at": fetched_at,
+                            "images": dict(AWS_AMI_IDS[region])}
+                   for region, fetched_at in self._fetched.items()}
+        return self._version, catalog
+
+    def save(self, snapshot=None):
+        """Write a snapshot of the catalog to disk, logging failures.
+        Blocks.
+
+        Saves are serialized, and snapshots older than the last one
+        written are skipped.
+
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        version, catalog = snapshot
+        with self._save_lock:
+            if version <= self._saved_version:
+                return
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(self.path)),
+                    prefix=os.path.basename(self.path) + ".",
+                    suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(catalog, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                logger.warning("Couldn't save the AMI catalog to %s",
+                               self.path, exc_info=True)
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._saved_version = version
 
 
-def available_instance(instance):
+def parse_launch_time(launch_time):
+    """Parse an instance's ``launch_time`` into a :class:`datetime`."""
+    try:
+        return datetime.strptime(launch_time, '%Y-%m-%dT%H:%M:%S.%fZ')
+    except ValueError:
+        # Trigger by moto tests as they don't include a timezone
+        return datetime.strptime(launch_time, '%Y-%m-%dT%H:%M:%S')
+
+
+def available_instance(instance, launched=None):
     """Returns True if an instance is usable for allocation.
 
     Instances are only usable if they're running, or have been
     "pending" for less than 2 minutes. Instances pending more than
     2 minutes are likely perpetually stalled and will be reaped.
 
-    :type instance: :class:`instance.Instance`
+    :type instance: :class:`InstanceRecord` or boto instance
+    :param launched: The instance's already parsed launch time
     :returns: Whether the instance should be used for allocation.
     :rtype: bool
 
@@ -162,19 +367,118 @@ def available_instance(instance):
 
     if instance.state == "pending":
         oldest = datetime.today() - timedelta(minutes=2)
-        try:
-            launched = datetime.strptime(instance.launch_time,
-                                         '%Y-%m-%dT%H:%M:%S.%fZ')
-        except ValueError:
-            # Trigger by moto tests as they don't include a timezone
-            launched = datetime.strptime(instance.launch_time,
-                                         '%Y-%m-%dT%H:%M:%S')
+        if launched is None:
+            launched = parse_launch_time(instance.launch_time)
         if oldest < launched:
             return True
 
     return False
 
 
+@attrs(slots=True)
+class InstanceRecord:
+    """The attributes of an EC2 instance the broker uses.
+
+    Records don't hold on to a connection, use :meth:`rehydrate` for
+    calls needing the boto instance object. The container images known
+    to be loaded on the instance are kept in :attr:`images`.
+
+    """
+    id = attrib()  # type: str
+    region = attrib()  # type: str
+    instance_type = attrib()  # type: str
+    state = attrib()  # type: str
+    ip_address = attrib()  # type: Optional[str]
+    private_ip_address = attrib()  # type: Optional[str]
+    launch_time = attrib()  # type: str
+    spot_instance_request_id = attrib(default=None)  # type: Optional[str]
+    tags = attrib(default=Factory(dict))  # type: Dict[str, str]
+    images = attrib(default=Factory(set))  # type: set
+
+    @classmethod
+    def from_instance(cls, instance):
+        """Make a record of a boto instance."""
+        return cls(instance.id, instance.region.name, instance.instance_type,
+                   instance.state, instance.ip_address,
+                   instance.private_ip_address, instance.launch_time,
+                   instance.spot_instance_request_id,
+                   {k: v for k, v in instance.tags.items()
+                    if k in TRACKED_TAGS})
+
+    def update_from(self, instance):
+        """Update the record with a freshly described boto instance."""
+        self.state = instance.state
+        self.ip_address = instance.ip_address
+        self.private_ip_address = instance.private_ip_address
+
+    def rehydrate(self, conn):
+        """Returns the boto instance of the record. Blocks."""
+        return conn.get_only_instances(instance_ids=[self.id])[0]
+
+
+def instance_record(instance):
+    """Returns the :class:`InstanceRecord` of an instance, making one
+    when given a boto instance."""
+    if isinstance(instance, InstanceRecord):
+        return instance
+    return InstanceRecord.from_instance(instance)
+
+
+def update_instances(conn, instances, batch_size=DESCRIBE_BATCH_SIZE):
+    """Refresh the state of instances of a region in place.
+
+    Rather than calling ``update()`` on every instance, the instances
+    are described in batches of ``batch_size`` and the results merged
+    back into the existing records. Blocks.
+
+    :type instances: list of :class:`InstanceRecord`
+
+    """
+    by_id = {inst.id: inst for inst in instances}
+    instance_ids = list(by_id)
+    for i in range(0, len(instance_ids), batch_size):
+        updates = _describe_batch(conn, instance_ids[i:i + batch_size])
+        for updated in updates:
+            inst = by_id.get(updated.id)
+            if inst is not None:
+                inst.update_from(updated)
+
+
+def _describe_batch(conn, instance_ids):
+    """Describe a batch of instances, leaving out the ones AWS reports
+    as not found rather than failing the whole batch. Blocks."""
+    while instance_ids:
+        try:
+            return conn.get_only_instances(instance_ids=instance_ids)
+        except EC2ResponseError as exc:
+            if exc.error_code != "InvalidInstanceID.NotFound":
+                raise
+            unknown = set(_INSTANCE_ID_RE.findall(
+                exc.error_message or exc.body or ""))
+            unknown.intersection_update(instance_ids)
+            if not unknown:
+                if len(instance_ids) == 1:
+                    return []
+                # Can't tell which were missing, describe them one by one
+                return [updated for instance_id in instance_ids
+                        for updated in _describe_batch(conn, [instance_id])]
+            instance_ids = [x for x in instance_ids if x not in unknown]
+    return []
+
+
+def split_count(count, weights):
+    """Split ``count`` proportionally to ``weights``, handing out the
+    remainder to the largest fractional shares first."""
+    total = sum(weights)
+    shares = [count * weight / total for weight in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(weights)),
+                          key=lambda i: counts[i] - shares[i])
+    for i in by_remainder[:count - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
 class ExtensionState:
     """A bare class that extensions can attach things to that will be
     retained on the instance."""
@@ -182,19 +486,236 @@ class ExtensionState:
 
 @attrs
 class EC2Instance:
-    """EC2Instance that holds the underlying EC2.Instance object and
-    configurable plugin state."""
-    instance = attrib()  # type: Instance
+    """EC2Instance that holds the record of the underlying EC2 instance
+    and configurable plugin state."""
+    instance = attrib()  # type: InstanceRecord
     state = attrib()  # type: ExtensionState
 
 
+@attrs(slots=True)
+class IdleInstance:
+    """An instance sitting in the idle pool."""
+    instance = attrib()  # type: InstanceRecord
+    launched = attrib()  # type: datetime
+    idle_since = attrib()  # type: float
+
+
+class IdleInstances:
+    """Unallocated instances of an :class:`EC2Pool`.
+
+    Instances are indexed by region and instance type, in the order
+    they were added, and by the container images they hold. Instances
+    found to be unusable for allocation are moved aside per region, and
+    are only handed back for reaping.
+
+    """
+    def __init__(self):
+        self._buckets = defaultdict(OrderedDict)
+        self._images = defaultdict(lambda: defaultdict(OrderedDict))
+        self._unusable = defaultdict(OrderedDict)
+
+    def __len__(self):
+        return (sum(len(x) for x in self._buckets.values()) +
+                sum(len(x) for x in self._unusable.values()))
+
+    def add(self, region, instance):
+        """Add an instance to the pool."""
+        instance = instance_record(instance)
+        record = IdleInstance(instance,
+                              parse_launch_time(instance.launch_time),
+                              time.time())
+        if available_instance(instance, record.launched):
+            key = region, instance.instance_type
+            self._buckets[key][instance.id] = record
+            for image in instance.images:
+                self._images[key][image][instance.id] = None
+        else:
+            self._unusable[region][instance.id] = record
+
+    def take(self, region, inst_type, count, image=None):
+        """Remove and return up to ``count`` usable instances of a type
+        from a region, oldest first.
+
+        Instances already holding the container ``image`` are taken
+        before any other.
+
+        """
+        key = region, inst_type
+        bucket = self._buckets.get(key)
+        if not bucket:
+            return []
+
+        preferred = []
+        if image is not None and key in self._images:
+            preferred = list(self._images[key].get(image, ()))
+
+        instances = []
+        for inst_id in preferred:
+            if len(instances) >= count:
+                break
+            record = bucket.pop(inst_id, None)
+            if record is not None:
+                self._claim(key, record, instances)
+        while bucket and len(instances) < count:
+            _, record = bucket.popitem(last=False)
+            self._claim(key, record, instances)
+        return instances
+
+    def _claim(self, key, record, instances):
+        inst_id = record.instance.id
+        self._unindex(key, record.instance)
+        if available_instance(record.instance, record.launched):
+            instances.append(record.instance)
+        else:
+            self._unusable[key[0]][inst_id] = record
+
+    def _unindex(self, key, instance):
+        images = self._images.get(key)
+        if not images:
+            return
+        for image in instance.images:
+            ids = images.get(image)
+            if ids is None:
+                continue
+            ids.pop(instance.id, None)
+            if not ids:
+                del images[image]
+        if not images:
+            del self._images[key]
+
+    def pop_expired(self, max_idle, keep=0, targets=None, now=None):
+        """Remove the instances idle for longer than ``max_idle``
+        seconds, returning them per region.
+
+        The ``keep`` most recently added instances of every region and
+        instance type are left in place regardless, or more when
+        ``targets`` maps the ``(region, instance_type)`` to a larger
+        count. Unusable instances are always removed.
+
+        """
+        if now is None:
+            now = time.time()
+        targets = targets or {}
+        cutoff = now - max_idle
+        instances = defaultdict(list)
+        for key, bucket in self._buckets.items():
+            region = key[0]
+            while len(bucket) > max(keep, targets.get(key, 0)):
+                inst_id = next(iter(bucket))
+                if bucket[inst_id].idle_since > cutoff:
+                    break
+                instance = bucket.pop(inst_id).instance
+                self._unindex(key, instance)
+                instances[region].append(instance)
+        for region, bucket in self._unusable.items():
+            instances[region].extend(x.instance for x in bucket.values())
+        self._unusable.clear()
+        return dict(instances)
+
+    def pop_all(self):
+        """Remove every instance from the pool, returning them per
+        region."""
+        instances = defaultdict(list)
+        for (region, _), bucket in self._buckets.items():
+            instances[region].extend(x.instance for x in bucket.values())
+        for region, bucket in self._unusable.items():
+            instances[region].extend(x.instance for x in bucket.values())
+        self._buckets.clear()
+        self._images.clear()
+        self._unusable.clear()
+        return instances
+
+    def count(self, region, inst_type=None):
+        """Returns the number of idle instances in a region, optionally
+        only of the given type. Unusable instances are only included
+        when no type is given."""
+        if inst_type is not None:
+            return len(self._buckets.get((region, inst_type), ()))
+        return (sum(len(bucket) for (reg, _), bucket in self._buckets.items()
+                    if reg == region) +
+                len(self._unusable.get(region, ())))
+
+    def counts(self):
+        """Returns the idle instance counts per region and instance
+        type, with unusable instances counted as ``unusable``."""
+        counts = defaultdict(dict)
+        for (region, inst_type), bucket in self._buckets.items():
+            if bucket:
+                counts[region][inst_type] = len(bucket)
+        for region, bucket in self._unusable.items():
+            if bucket:
+                counts[region]["unusable"] = len(bucket)
+        return dict(counts)
+
+
+class InstanceInventory:
+    """Cached listing of the instances of every region.
+
+    Listings are served for ``ttl`` seconds after being fetched with the
+    ``fetch`` coroutine, and concurrent requests for a region share a
+    single fetch in progress. Invalidating a region discards both its
+    listing and any fetch in progress.
+
+    """
+    def __init__(self, fetch, ttl=INVENTORY_TTL):
+        self.ttl = ttl
+        self._fetch = fetch
+        self._listings = {}
+        self._in_flight = {}
+        self._generations = defaultdict(int)
+
+    async def get(self, region):
+        """Returns the instances of a region."""
+        listing = self._listings.get(region)
+        if listing is not None and time.time() < listing[0] + self.ttl:
+            return listing[1]
+
+        future = self._in_flight.get(region)
+        if future is None or future.done():
+            future = gen.convert_yielded(
+                self._refresh(region, self._generations[region]))
+            self._in_flight[region] = future
+        return await future
+
+    async def get_all(self, regions=AWS_REGIONS):
+        """Returns the instances of every region, as a list per
+        region."""
+        return await gen.multi([self.get(region) for region in regions])
+
+    async def _refresh(self, region, generation):
+        try:
+            instances = await self._fetch(region)
+        finally:
+            if self._generations[region] == generation:
+                self._in_flight.pop(region, None)
+        if self._generations[region] == generation:
+            self._listings[region] = (time.time(), instances)
+        return instances
+
+    def invalidate(self, region=None):
+        """Discard the listing of a region, or of every region when none
+        is given."""
+        regions = [region] if region else list(AWS_REGIONS)
+        for region in regions:
+            self._listings.pop(region, None)
+            self._in_flight.pop(region, None)
+            self._generations[region] += 1
+
+
 class EC2Collection:
     """Create a collection to manage a set of instances.
 
-    :type instances: list of :class:`instance.Instance`
+    Blocking calls are run on ``executor``, with at most
+    ``max_concurrency`` of them at once. Without an executor, the
+    collection creates its own, which is shut down by :meth:`close`.
+
+    :type instances: list of :class:`InstanceRecord`, boto instances are
+        turned into records
 
     """
-    def __init__(self, run_id, uuid, conn, instances, io_loop=None):
+    def __init__(self, run_id, uuid, conn, instances, io_loop=None,
+                 executor=None, max_concurrency=COLLECTION_CONCURRENCY,
+                 limiter=None):
         self.run_id = run_id
         self.uuid = uuid
         self.started = False
@@ -203,12 +724,19 @@ class EC2Collection:
         self.local_dns = False
         self._env_data = None
         self._command_args = None
-        self._executer = concurrent.futures.ThreadPoolExecutor(len(instances))
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max(1, min(len(instances), max_concurrency)))
+        self._executor = executor
+        self._concurrency = tornado.locks.Semaphore(max_concurrency)
         self._loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self._limiter = limiter or RateLimiter(self._loop)
 
         self.instances = []
         for inst in instances:
-            self.instances.append(EC2Instance(inst, ExtensionState()))
+            self.instances.append(EC2Instance(instance_record(inst),
+                                              ExtensionState()))
 
     def debug(self, msg):
         logger.debug('[uuid:%s] %s' % (self.uuid, msg))
@@ -221,13 +749,14 @@ class EC2Collection:
         """Execute a blocking function, return a future that will be
         called in the io loop.
 
-        The blocking function will receive the underlying boto EC2
-        instance object first, with the other args trailing.
+        The blocking function will receive the :class:`EC2Instance`
+        first, with the other args trailing.
 
         """
         fut = Future()
 
         def set_fut(future):
+            self._concurrency.release()
             exc = future.exception()
             if exc:
                 fut.set_exception(exc)
@@ -237,10 +766,30 @@ class EC2Collection:
         def _throwback(fut):
             self._loop.add_callback(set_fut, fut)
 
-        exc_fut = self._executer.submit(func, *args, **kwargs)
-        exc_fut.add_done_callback(_throwback)
+        def submit(acquired):
+            try:
+                exc_fut = self._executor.submit(func, *args, **kwargs)
+            except Exception as exc:
+                self._concurrency.release()
+                fut.set_exception(exc)
+            else:
+                exc_fut.add_done_callback(_throwback)
+
+        self._loop.add_future(self._concurrency.acquire(), submit)
         return fut
 
+    def execute_aws(self, api_class, func, *args, **kwargs):
+        """Execute a blocking EC2 API call once the rate limiter of its
+        region and API class allows it."""
+        return self._limiter.call(self.conn.region.name, api_class,
+                                  partial(self.execute, func, *args, **kwargs))
+
+    def close(self):
+        """Release the collection's resources, once it's no longer
+        used."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
     async def map(self, func, delay=0, *args, **kwargs):
         """Execute a blocking func with args/kwargs across all instances."""
         futures = []
@@ -258,7 +807,8 @@ class EC2Collection:
     def dead_instances(self):
         return [i for i in self.instances
                 if i.instance.state not in ["pending", "running"] or
-                getattr(i.state, "nonresponsive", False)]
+                getattr(i.state, "nonresponsive", False) or
+                getattr(i.state, "interrupted", False)]
 
     def running_instances(self):
         return [i for i in self.instances if i.instance.state == "running"]
@@ -270,26 +820,45 @@ class EC2Collection:
             self.debug("Pruning %d non-responsive instances." % len(dead))
             await self.remove_instances(dead)
 
+    async def check_spot_interruptions(self):
+        """Prune the spot instances AWS is about to reclaim."""
+        by_request = {x.instance.spot_instance_request_id: x
+                      for x in self.instances
+                      if x.instance.spot_instance_request_id}
+        if not by_request:
+            return
+
+        requests = await self.execute_aws(
+            DESCRIBE, self.conn.get_all_spot_instance_requests,
+            request_ids=list(by_request))
+        for request in requests:
+            code = getattr(request.status, "code", None)
+            if code in SPOT_INTERRUPTION_CODES and request.id in by_request:
+                self.debug("Spot instance %s interrupted: %s" %
+                           (request.instance_id, code))
+                by_request[request.id].state.interrupted = True
+        await self.remove_dead_instances()
+
     async def wait_for_running(self, interval=5, timeout=600):
         """Wait for all the instances to be running. Instances unable
         to load will be removed."""
-        def update_state(inst):
-            try:
-                inst.instance.update()
-            except Exception:
-                # Updating state can fail, it happens
-                self.debug('Failed to update instance state: %s' %
-                           inst.instance.id)
-            return inst.instance.state
-
-        end_time = time.time() + 600
+        end_time = time.time() + timeout
         pending = self.pending_instances()
 
         while time.time() < end_time and pending:
             self.debug('%d pending instances.' % len(pending))
-            # Update the state of all the pending instances
-            await gen.multi(
-                [self.execute(update_state, inst) for inst in pending])
+            # Update the state of all the pending instances at once
+            try:
+                await self._limiter.call(
+                    self.conn.region.name, DESCRIBE,
+                    partial(self.execute, update_instances, self.conn,
+                            [x.instance for x in pending]),
+                    cost=-(-len(pending) // DESCRIBE_BATCH_SIZE))
+            except Exception:
+                # Updating state can fail, it happens (ie, AWS not
+                # knowing about freshly launched instances yet)
+                self.debug('Failed to update the state of %d instances' %
+                           len(pending))
             pending = self.pending_instances()
 
             # Wait if there's pending to check again
@@ -317,8 +886,8 @@ class EC2Collection:
 
         try:
             # Remove the tags
-            await self.execute(self.conn.create_tags, instance_ids,
-                               {"RunId": "", "Uuid": ""})
+            await self.execute_aws(MUTATE, self.conn.create_tags,
+                                   instance_ids, {"RunId": "", "Uuid": ""})
         except Exception:
             logger.debug("Error detagging instances, continuing.",
                          exc_info=True)
@@ -326,11 +895,100 @@ class EC2Collection:
         try:
             logger.debug("Terminating instances %s" % str(instance_ids))
             # Nuke them
-            await self.execute(self.conn.terminate_instances, instance_ids)
+            await self.execute_aws(MUTATE, self.conn.terminate_instances,
+                                   instance_ids)
         except Exception:
             logger.debug("Error terminating instances.", exc_info=True)
 
 
+class MultiRegionCollection:
+    """A collection of instances spread across several regions.
+
+    Wraps a :class:`EC2Collection` per region and exposes the same
+    interface, blocking calls on an instance are run by the collection
+    of its region.
+
+    """
+    def __init__(self, run_id, uuid, collections):
+        self.run_id = run_id
+        self.uuid = uuid
+        self.started = False
+        self.finished = False
+        self.local_dns = False
+        self.collections = list(collections)
+        self._owners = {id(inst): coll for coll in self.collections
+                        for inst in coll.instances}
+
+    @property
+    def instances(self):
+        return [inst for coll in self.collections for inst in coll.instances]
+
+    def debug(self, msg):
+        logger.debug('[uuid:%s] %s' % (self.uuid, msg))
+
+    def _owner(self, ec2_instance):
+        return self._owners.get(id(ec2_instance), self.collections[0])
+
+    async def wait(self, seconds):
+        """Waits for ``seconds`` before resuming."""
+        await self.collections[0].wait(seconds)
+
+    def execute(self, func, *args, **kwargs):
+        """Execute a blocking function on the collection of the
+        instance it's given first."""
+        coll = self._owner(args[0]) if args else self.collections[0]
+        return coll.execute(func, *args, **kwargs)
+
+    def close(self):
+        for coll in self.collections:
+            coll.close()
+
+    async def map(self, func, delay=0, *args, **kwargs):
+        """Execute a blocking func with args/kwargs across all instances."""
+        futures = []
+        for x in self.instances:
+            futures.append(self.execute(func, x, *args, **kwargs))
+            if delay:
+                await self.wait(delay)
+        return await gen.multi(futures)
+
+    def pending_instances(self):
+        return [i for coll in self.collections
+                for i in coll.pending_instances()]
+
+    def dead_instances(self):
+        return [i for coll in self.collections for i in coll.dead_instances()]
+
+    def running_instances(self):
+        return [i for coll in self.collections
+                for i in coll.running_instances()]
+
+    async def remove_dead_instances(self):
+        """Removes all dead instances of every region."""
+        await gen.multi([coll.remove_dead_instances()
+                         for coll in self.collections])
+
+    async def check_spot_interruptions(self):
+        """Prune the spot instances AWS is about to reclaim."""
+        await gen.multi([coll.check_spot_interruptions()
+                         for coll in self.collections])
+
+    async def wait_for_running(self, interval=5, timeout=600):
+        """Wait for the instances of every region to be running."""
+        await gen.multi([coll.wait_for_running(interval, timeout)
+                         for coll in self.collections])
+        return True
+
+    async def remove_instances(self, ec2_instances):
+        """Remove instances entirely, from whichever region they're
+        in."""
+        by_owner = defaultdict(list)
+        for inst in ec2_instances:
+            by_owner[self._owner(inst)].append(inst)
+        await gen.multi([coll.remove_instances(instances)
+                         for coll, instances in by_owner.items()])
+
+
 class EC2Pool:
     """Initialize a pool for instance allocation and recycling.
 
@@ -352,27 +1010,58 @@ class EC2Pool:
 
         This instance is **NOT SAFE FOR CONCURRENT USE BY THREADS**.
 
+    Instances returned to the pool that stay idle for more than
+    ``max_idle`` seconds are terminated, except for the ``min_idle``
+    most recently returned of every region and instance type. A
+    ``max_idle`` of ``None`` keeps idle instances until
+    :meth:`reap_instances` is called.
+
+    ``warm_pool`` maps ``(region, instance_type)`` to a number of idle
+    instances the pool keeps allocated ahead of time. Warmed instances
+    are waited on until running, and then handed to the
+    ``prepare_instances`` coroutine, if any, as an
+    :class:`EC2Collection` before being added to the pool.
+
     """
     def __init__(self, broker_id, access_key=None, secret_key=None,
                  key_pair="loads", security="loads", max_idle=600,
                  user_data=None, io_loop=None, port=None,
-                 owner_id="595879546273", use_filters=True):
+                 owner_id="595879546273", use_filters=True,
+                 ami_cache=None, ami_cache_ttl=AMI_CATALOG_TTL,
+                 min_idle=0, warm_pool=None, prepare_instances=None,
+                 collection_threads=COLLECTION_THREADS,
+                 collection_concurrency=COLLECTION_CONCURRENCY,
+                 inventory_ttl=INVENTORY_TTL):
         self.owner_id = owner_id
         self.use_filters = use_filters
         self.broker_id = broker_id
         self.access_key = access_key
         self.secret_key = secret_key
         self.max_idle = max_idle
+        self.min_idle = min_idle
+        self.warm_pool = dict(warm_pool or {})
+        self.prepare_instances = prepare_instances
+        self._warming = defaultdict(int)
+        self._warm_ups = defaultdict(set)
         self.key_pair = key_pair
         self.security = security
         self.user_data = user_data
-        self._instances = defaultdict(list)
+        self._instances = IdleInstances()
         self._tag_filters = {"tag:Name": "loads-%s*" % self.broker_id,
                              "tag:Project": "loads"}
         self._conns = {}
-        self._recovered = {}
+        self._recovered = defaultdict(list)
         self._executor = concurrent.futures.ThreadPoolExecutor(15)
+        # Every collection shares these threads
+        self._collection_executor = concurrent.futures.ThreadPoolExecutor(
+            collection_threads)
+        self.collection_concurrency = collection_concurrency
         self._loop = io_loop or tornado.ioloop.IOLoop.instance()
+        # EC2 API calls of the pool and its collections share the limits
+        self.limiter = RateLimiter(self._loop)
+        # Cached instance listings for the web API
+        self.inventory = InstanceInventory(self._recover_region,
+                                           ttl=inventory_ttl)
         self.port = port
         # see https://github.com/boto/boto/issues/2617
         if port is not None:
@@ -380,38 +1069,149 @@ class EC2Pool:
         else:
             self.is_secure = True
 
-        # Asynchronously initialize ourself when the pool runs
-        self._loop.add_future(
-            gen.convert_yielded(self.initialize()),
-            self._initialized
-        )
+        # Readiness of every region, requests for a region are queued
+        # until it's ready
+        self.ready = {region: Future() for region in AWS_REGIONS}
 
-        self.ready = Future()
+        # Cached AMI's are usable immediately, and refreshed on a timer
+        self._ami_catalog = None
+        self._ami_refreshes = {}
+        self._maintenance = None
+        self._shutdown = False
+        if ami_cache:
+            self._ami_catalog = AMICatalog(ami_cache, ami_cache_ttl)
+            self._ami_catalog.load()
+
+        # Asynchronously initialize ourself when the pool runs
+        self.initialize()
 
     def shutdown(self):
         """Make sure we shutdown the executor.
         """
+        self._shutdown = True
+        for handle in self._ami_refreshes.values():
+            self._loop.remove_timeout(handle)
+        self._ami_refreshes = {}
+        if self._maintenance is not None:
+            self._loop.remove_timeout(self._maintenance)
+            self._maintenance = None
         self._executor.shutdown()
+        self._collection_executor.shutdown()
 
     def _run_in_executor(self, func, *args, **kwargs):
         return to_tornado_future(self._executor.submit(func, *args, **kwargs))
 
+    def _call_aws(self, region, api_class, func, *args, **kwargs):
+        """Run a blocking EC2 API call through the rate limiter."""
+        return self.limiter.call(
+            region, api_class,
+            partial(self._run_in_executor, func, *args, **kwargs))
+
     def initialize(self):
-        """Fully initialize the AWS pool and dependencies, recover existing
+        """Initialize the AWS pool and dependencies, recover existing
         instances, etc.
 
-        :returns: A future that will require the loop running to retrieve.
+        Every region is initialized in the background independently of
+        the others, :attr:`ready` tracks their progress.
 
         """
-        logger.debug("Pulling CoreOS AMI info...")
-        populate_ami_ids(self.access_key, self.secret_key, port=self.port,
-                         owner_id=self.owner_id, use_filters=self.use_filters)
-        return self._recover()
+        for region in AWS_REGIONS:
+            self._loop.add_future(
+                gen.convert_yielded(self._initialize_region(region)),
+                partial(self._initialized, region)
+            )
+        self._schedule_maintenance()
+
+    async def _initialize_region(self, region):
+        catalog = self._ami_catalog
+        if catalog is not None and catalog.fetched_at(region) is not None:
+            logger.debug("Using cached CoreOS AMI info for %s.", region)
+        else:
+            await self._populate_amis(region)
+        await self._recover(region)
+
+        if catalog is not None:
+            self._schedule_ami_refresh(region)
+
+    async def _populate_amis(self, region):
+        logger.debug("Pulling CoreOS AMI info for %s...", region)
+        await self._call_aws(
+            region, DESCRIBE, populate_region_ami_ids, region,
+            self.access_key, self.secret_key, port=self.port,
+            owner_id=self.owner_id, use_filters=self.use_filters)
+
+        catalog = self._ami_catalog
+        if catalog is not None:
+            catalog.update(region)
+            await self._run_in_executor(catalog.save, catalog.snapshot())
+
+    def _schedule_ami_refresh(self, region, delay=None):
+        if self._shutdown:
+            return
+        if delay is None:
+            delay = self._ami_catalog.expires_in(region)
+        self._ami_refreshes[region] = self._loop.call_later(
+            delay, self._refresh_amis, region)
+
+    def _refresh_amis(self, region):
+        """Refresh the region's AMI's, the cached ones remain in use
+        until the refresh succeeds."""
+        def refreshed(future):
+            try:
+                future.result()
+            except Exception:
+                logger.error("Failed refreshing the AMI's of %s.", region,
+                             exc_info=True)
+                # Don't hammer AWS, retry once the TTL expires again
+                self._schedule_ami_refresh(region, self._ami_catalog.ttl)
+            else:
+                self._schedule_ami_refresh(region)
+
+        self._loop.add_future(
+            gen.convert_yielded(self._populate_amis(region)), refreshed)
 
-    def _initialized(self, future):
-        # Run the result to ensure we raise an exception if any occurred
-        logger.debug("Finished initializing: %s.", future.result())
-        self.ready.set_result(True)
+    def _schedule_maintenance(self):
+        if self._shutdown:
+            return
+        self._maintenance = self._loop.call_later(
+            IDLE_REAP_INTERVAL, self._run_maintenance)
+
+    def _run_maintenance(self):
+        def maintained(future):
+            try:
+                future.result()
+            except Exception:
+                logger.error("Failed maintaining the idle instances.",
+                             exc_info=True)
+            self._schedule_maintenance()
+
+        self._loop.add_future(
+            gen.convert_yielded(self._maintain()), maintained)
+
+    async def _maintain(self):
+        """Reap the expired idle instances, then top up the warm
+        pool."""
+        if self.max_idle is not None:
+            await self.reap_idle_instances()
+        await self.warm_up()
+
+    def _initialized(self, region, future):
+        try:
+            future.result()
+        except Exception as exc:
+            logger.error("Failed initializing %s.", region, exc_info=True)
+            self.ready[region].set_exception(exc)
+        else:
+            logger.debug("Finished initializing %s.", region)
+            self.ready[region].set_result(True)
+            gen.convert_yielded(self.warm_up(region))
+
+    def wait_ready(self, region=None):
+        """Returns a future resolving once the region, or every region
+        when none is given, has been initialized."""
+        if region is not None:
+            return self.ready[region]
+        return gen.multi(list(self.ready.values()))
 
     async def _region_conn(self, region=None):
         if region in self._conns:
@@ -436,98 +1236,220 @@ class EC2Pool:
         else:
             filters = {}
 
-        instances = await self._run_in_executor(
-            conn.get_only_instances,
-            filters=filters)
+        instances = await self._call_aws(
+            region, DESCRIBE, conn.get_only_instances, filters=filters)
 
         return instances
 
-    async def _recover(self):
-        """Recover allocated instances from EC2."""
-        recovered_instances = defaultdict(list)
+    async def _recover(self, region):
+        """Recover allocated instances of a region from EC2."""
+        instances = await self._recover_region(region)
 
-        # Recover every region at once
-        instancelist = await gen.multi(
-            [self._recover_region(x) for x in AWS_REGIONS])
-
-        logger.debug("Found %s instances to look at for recovery.",
-                     sum(map(len, instancelist)))
+        logger.debug("Found %s instances to look at for recovery in %s.",
+                     len(instances), region)
 
         allocated = 0
         not_used = 0
 
-        for instances in instancelist:
-            for instance in instances:
-                # skipping terminated instances
-                if instance.state == 'terminated':
-                    continue
-                tags = instance.tags
-                region = instance.region.name
-                logger.debug('- %s (%s)' % (instance.id, region))
-                # If this has been 'pending' too long, we put it in the main
-                # instance pool for later reaping
-                if not available_instance(instance):
-                    self._instances[region].append(instance)
-                    continue
-
-                if tags.get("RunId") and tags.get("Uuid"):
-                    # Put allocated instances into a recovery pool separate
-                    # from unallocated
-                    inst_key = (tags["RunId"], tags["Uuid"])
-                    recovered_instances[inst_key].append(instance)
-                    allocated += 1
-                else:
-                    self._instances[region].append(instance)
-                    not_used += 1
-
-        logger.debug("%d instances were allocated to a run" % allocated)
-        logger.debug("%d instances were not used" % not_used)
+        for instance in instances:
+            # skipping terminated instances
+            if instance.state == 'terminated':
+                continue
+            instance = InstanceRecord.from_instance(instance)
+            tags = instance.tags
+            logger.debug('- %s (%s)' % (instance.id, region))
+            # If this has been 'pending' too long, we put it in the main
+            # instance pool for later reaping
+            if not available_instance(instance):
+                self._instances.add(region, instance)
+                continue
+
+            if tags.get("RunId") and tags.get("Uuid"):
+                # Put allocated instances into a recovery pool separate
+                # from unallocated
+                inst_key = (tags["RunId"], tags["Uuid"])
+                self._recovered[inst_key].append(instance)
+                allocated += 1
+            else:
+                self._instances.add(region, instance)
+                not_used += 1
 
-        self._recovered = recovered_instances
+        logger.debug("%d instances were allocated to a run in %s" %
+                     (allocated, region))
+        logger.debug("%d instances were not used in %s" %
+                     (not_used, region))
 
-    def _locate_recovered_instances(self, run_id, uuid):
-        """Locates and removes existing allocated instances if any"""
+    def _locate_recovered_instances(self, run_id, uuid, region):
+        """Locates and removes existing allocated instances of a region
+        if any"""
         key = run_id, uuid
 
         if key not in self._recovered:
             # XXX do we want to raise here?
             return []
 
-        instances = self._recovered[key]
-        del self._recovered[key]
+        instances = [x for x in self._recovered[key] if x.region == region]
+        remaining = [x for x in self._recovered[key] if x.region != region]
+        if remaining:
+            self._recovered[key] = remaining
+        else:
+            del self._recovered[key]
+        return instances
+
+    def _locate_existing_instances(self, count, inst_type, region,
+                                   image=None):
+        """Locates and removes existing available instances if any,
+        preferring those already holding ``image``."""
+        instances = self._instances.take(region, inst_type, count,
+                                         image=image)
+
+        # Replace what was taken from the warm pool in the background
+        if (region, inst_type) in self.warm_pool:
+            self._warm(region, inst_type)
         return instances
 
-    def _locate_existing_instances(self, count, inst_type, region):
-        """Locates and removes existing available instances if any."""
-        region_instances = self._instances[region]
+    async def _allocate_instances(self, conn, count, inst_type, region,
+                                  min_count=None, fallback_types=(),
+                                  zones=(), image=None):
+        """Allocate a set of new instances and return them.
+
+        Without a ``min_count``, all the instances are launched at once
+        or none are. Otherwise, they're requested in chunks accepting
+        partial fulfilment, moving on to the ``fallback_types`` and other
+        ``zones`` as capacity runs out, and at least ``min_count`` of
+        them are returned. Idle instances of a fallback type, preferably
+        holding ``image``, are used before launching new ones of it.
+
+        """
+        if min_count is None:
+            return await self._run_instances(
+                conn, count, count, inst_type, region,
+                zones[0] if zones else None)
+
         instances = []
-        remaining = []
+        idle = []
+        try:
+            for alt_type in [inst_type] + list(fallback_types):
+                if alt_type != inst_type and len(instances) < count:
+                    existing = self._locate_existing_instances(
+                        count - len(instances), alt_type, region, image)
+                    idle.extend(existing)
+                    instances.extend(existing)
+                for zone in zones or [None]:
+                    while len(instances) < count:
+                        chunk = min(ALLOCATION_CHUNK, count - len(instances))
+                        try:
+                            new_instances = await self._run_instances(
+                                conn, 1, chunk, alt_type, region, zone)
+                        except EC2ResponseError as exc:
+                            if exc.error_code not in CAPACITY_ERRORS:
+                                raise
+                            new_instances = []
+                        instances.extend(new_instances)
+                        if len(new_instances) < chunk:
+                            logger.debug("Out of %s capacity in %s, got %d "
+                                         "of %d instances.", alt_type,
+                                         zone or region, len(instances),
+                                         count)
+                            break
+        except Exception:
+            await self._release_allocation(region, instances, idle)
+            raise
+
+        if len(instances) < min_count:
+            await self._release_allocation(region, instances, idle)
+            raise LoadsException(
+                "Only %d instances could be allocated in %s, %d required" %
+                (len(instances), region, min_count))
+        return instances
 
-        for inst in region_instances:
-            if available_instance(inst) and inst_type == inst.instance_type:
-                instances.append(inst)
-            else:
-                remaining.append(inst)
+    async def _release_allocation(self, region, instances, idle):
+        """Undo a failed allocation, putting the ``idle`` instances it
+        took back into the pool and terminating the launched ones."""
+        for instance in idle:
+            self._instances.add(region, instance)
+        idle_ids = {x.id for x in idle}
+        launched = [x for x in instances if x.id not in idle_ids]
+        if launched:
+            await self._terminate_instances(region, launched)
+
+    async def _allocate_spot_instances(self, conn, count, inst_type, region,
+                                       price, min_count=None, zones=()):
+        """Request a set of spot instances and return them.
+
+        Requests still unfulfilled after :data:`SPOT_TIMEOUT` are
+        cancelled, keeping the instances of those fulfilled meanwhile.
+        Fails unless ``min_count``, or all of them without one, were
+        fulfilled.
 
-            if len(instances) >= count:
+        """
+        ami_id = get_ami(region, inst_type)
+        requests = await self._call_aws(
+            region, RUN, conn.request_spot_instances,
+            price, ami_id, count=count,
+            key_name=self.key_pair, security_groups=[self.security],
+            user_data=self.user_data, instance_type=inst_type,
+            placement=zones[0] if zones else None)
+        request_ids = [x.id for x in requests]
+
+        end = time.time() + SPOT_TIMEOUT
+        while True:
+            requests = await self._call_aws(
+                region, DESCRIBE, conn.get_all_spot_instance_requests,
+                request_ids=request_ids)
+            waiting = [x for x in requests if x.state == "open"]
+            if not waiting or time.time() >= end:
                 break
-
-        # Determine how many were removed, and reconstruct the unallocated
-        # instance list with the instances not used
-        removed = len(instances) + len(remaining)
-        self._instances[region] = region_instances[removed:] + remaining
+            await gen.Task(self._loop.add_timeout,
+                           time.time() + SPOT_POLL_INTERVAL)
+
+        if waiting:
+            logger.debug("Cancelling %d unfulfilled spot requests in %s.",
+                         len(waiting), region)
+            cancelled_ids = [x.id for x in waiting]
+            await self._call_aws(region, MUTATE,
+                                 conn.cancel_spot_instance_requests,
+                                 cancelled_ids)
+
+            # A request fulfilled before the cancellation went through
+            # still launched its instance
+            cancelled = await self._call_aws(
+                region, DESCRIBE, conn.get_all_spot_instance_requests,
+                request_ids=cancelled_ids)
+            requests = [x for x in requests if x.id not in cancelled_ids]
+            requests.extend(cancelled)
+
+        instance_ids = [x.instance_id for x in requests
+                        if x.state in ("active", "cancelled") and
+                        x.instance_id]
+        instances = []
+        if instance_ids:
+            instances = await self._call_aws(
+                region, DESCRIBE, conn.get_only_instances,
+                instance_ids=instance_ids)
+            instances = [InstanceRecord.from_instance(x) for x in instances]
+
+        required = count if min_count is None else min_count
+        if len(instances) < required:
+            if instances:
+                await self._terminate_instances(region, instances)
+            raise LoadsException(
+                "Only %d spot instances were fulfilled in %s, %d required" %
+                (len(instances), region, required))
         return instances
 
-    async def _allocate_instances(self, conn, count, inst_type, region):
-        """Allocate a set of new instances and return them."""
+    async def _run_instances(self, conn, min_count, max_count, inst_type,
+                             region, zone=None):
         ami_id = get_ami(region, inst_type)
-        reservations = await self._run_in_executor(
-            conn.run_instances,
-            ami_id, min_count=count, max_count=count,
+        reservations = await self._call_aws(
+            region, RUN, conn.run_instances,
+            ami_id, min_count=min_count, max_count=max_count,
             key_name=self.key_pair, security_groups=[self.security],
-            user_data=self.user_data, instance_type=inst_type)
+            user_data=self.user_data, instance_type=inst_type,
+            placement=zone)
 
-        return reservations.instances
+        return [InstanceRecord.from_instance(x)
+                for x in reservations.instances]
 
     async def request_instances(self,
                                 run_id: str,
@@ -538,7 +1460,14 @@ class EC2Pool:
                                 allocate_missing=True,
                                 plan: Optional[str] = None,
                                 owner: Optional[str] = None,
-                                run_max_time: Optional[int] = None):
+                                run_max_time: Optional[int] = None,
+                                min_count: Optional[int] = None,
+                                fallback_types=(),
+                                zones=(),
+                                spot_price: Optional[str] = None,
+                                regions: Optional[
+                                    Sequence[Tuple[str, int]]] = None,
+                                image: Optional[str] = None):
         """Allocate a collection of instances.
 
         :param run_id: Run ID for these instances
@@ -554,34 +1483,71 @@ class EC2Pool:
         :param owner: Owner name of the instances
         :param run_max_time: Maximum expected run-time of instances in
             seconds
+        :param min_count: Fewest instances the collection may have,
+            allows partial allocation when given
+        :param fallback_types: Instance types to use instead once
+            ``inst_type`` runs out of capacity, with a ``min_count``.
+            Ignored for spot instances, which are only requested as
+            ``inst_type``
+        :param zones: Availability zones to allocate new instances in,
+            in order of preference
+        :param spot_price: Maximum hourly price of new instances, which
+            are requested as spot instances when given
+        :param regions: ``(region, weight)`` pairs to spread the
+            instances across instead of ``region``, the ``count`` and
+            ``min_count`` are split proportionally to the weights
+        :param image: Container image the instances will run, idle
+            instances already holding it are used first
         :returns: Collection of allocated instances
-        :rtype: :class:`EC2Collection`
+        :rtype: :class:`EC2Collection`, or
+            :class:`MultiRegionCollection` for several ``regions``
 
         """
+        if regions and len(regions) > 1:
+            return await self._request_regions(
+                regions, run_id, uuid, count=count, inst_type=inst_type,
+                allocate_missing=allocate_missing, plan=plan, owner=owner,
+                run_max_time=run_max_time, min_count=min_count,
+                fallback_types=fallback_types, zones=zones,
+                spot_price=spot_price, image=image)
+        if regions:
+            region = regions[0][0]
+
         if region not in AWS_REGIONS:
             raise LoadsException("Unknown region: %s" % region)
 
+        # Queue the request until the region has been initialized
+        await self.ready[region]
+
         # First attempt to recover instances for this run/uuid
-        instances = self._locate_recovered_instances(run_id, uuid)
-        remaining_count = count - len(instances)
+        instances = self._locate_recovered_instances(run_id, uuid, region)
 
         conn = await self._region_conn(region)
 
         # If existing/new are not being allocated, the recovered are
         # already tagged, so we're done.
         if not allocate_missing:
-            return EC2Collection(run_id, uuid, conn, instances, self._loop)
+            return self._collection(run_id, uuid, conn, instances)
 
-        # Add any more remaining that should be used
-        instances.extend(
-            self._locate_existing_instances(remaining_count, inst_type, region)
-        )
+        # Add any more remaining that should be used, idle instances of
+        # the fallback types only once new ones of inst_type fall short
+        existing = self._locate_existing_instances(
+            count - len(instances), inst_type, region, image=image)
+        instances.extend(existing)
 
         # Determine if we should allocate more instances
         num = count - len(instances)
         if num > 0:
-            new_instances = await self._allocate_instances(
-                conn, num, inst_type, region)
+            if min_count is not None:
+                min_count = max(0, min_count - (count - num))
+            if spot_price is not None:
+                new_instances = await self._allocate_spot_instances(
+                    conn, num, inst_type, region, spot_price,
+                    min_count=min_count, zones=zones)
+            else:
+                new_instances = await self._allocate_instances(
+                    conn, num, inst_type, region, min_count=min_count,
+                    fallback_types=fallback_types, zones=zones, image=image)
             logger.debug("Allocated instances%s: %s",
                          " (Owner: %s)" % owner if owner else "",
                          new_instances)
@@ -601,22 +1567,172 @@ class EC2Pool:
             if run_max_time is not None:
                 self._tag_for_reaping(tags, run_max_time)
 
-            # Sometimes, we can get instance data back before the AWS
-            # API fully recognizes it, so we wait as needed.
-            async def tag_instance(instance):
-                retries = 0
-                while True:
-                    try:
-                        await self._run_in_executor(
-                            conn.create_tags, [instance.id], tags)
-                        break
-                    except:
-                        if retries > 5:
-                            raise
-                    retries += 1
-                    await gen.Task(self._loop.add_timeout, time.time() + 1)
-            await gen.multi([tag_instance(x) for x in instances])
-        return EC2Collection(run_id, uuid, conn, instances, self._loop)
+            await self._tag_instances(conn, [x.id for x in instances], tags)
+        self.inventory.invalidate(region)
+        return self._collection(run_id, uuid, conn, instances)
+
+    async def _request_regions(self, regions, run_id, uuid, count,
+                               min_count=None, zones=(), **kwargs):
+        """Allocate the instances of every region in parallel, returning
+        them as a :class:`MultiRegionCollection`.
+
+        If any region fails, the instances allocated in the others are
+        released.
+
+        """
+        for region, _ in regions:
+            if region not in AWS_REGIONS:
+                raise LoadsException("Unknown region: %s" % region)
+
+        weights = [weight for _, weight in regions]
+        counts = split_count(count, weights)
+        if min_count is not None:
+            min_counts = split_count(min_count, weights)
+        else:
+            min_counts = [None] * len(regions)
+
+        async def request(region, region_count, region_min):
+            if region_min is not None:
+                region_min = min(region_min, region_count)
+            try:
+                return await self.request_instances(
+                    run_id, uuid, count=region_count, region=region,
+                    min_count=region_min,
+                    zones=[x for x in zones if x.startswith(region)],
+                    **kwargs)
+            except Exception as exc:
+                return exc
+
+        results = await gen.multi([
+            request(region, region_count, region_min)
+            for (region, _), region_count, region_min
+            in zip(regions, counts, min_counts)
+            if region_count > 0])
+
+        collections = [x for x in results if not isinstance(x, Exception)]
+        failures = [x for x in results if isinstance(x, Exception)]
+        if failures:
+            await gen.multi([self.release_instances(x) for x in collections])
+            raise failures[0]
+        return MultiRegionCollection(run_id, uuid, collections)
+
+    def _collection(self, run_id, uuid, conn, instances):
+        return EC2Collection(run_id, uuid, conn, instances, self._loop,
+                             executor=self._collection_executor,
+                             max_concurrency=self.collection_concurrency,
+                             limiter=self.limiter)
+
+    async def warm_up(self, region=None):
+        """Allocate the instances missing from the warm pool, of every
+        region or only of the given one. Returns once they, and any top
+        up already in progress, have been added to the pool."""
+        await gen.multi([self._warm(reg, inst_type)
+                         for reg, inst_type in self.warm_pool
+                         if region is None or reg == region])
+
+    def _warm(self, region, inst_type):
+        """Start topping up the warm pool of a region and instance type,
+        returning a future for every top up in progress."""
+        in_flight = self._warm_ups[region, inst_type]
+        pending = list(in_flight)
+        future = gen.convert_yielded(self._top_up(region, inst_type))
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+        return gen.multi(pending + [future])
+
+    async def _top_up(self, region, inst_type):
+        key = region, inst_type
+        needed = (self.warm_pool.get(key, 0) -
+                  self._instances.count(region, inst_type) -
+                  self._warming[key])
+        if needed <= 0:
+            return
+
+        # Count them as warming right away, so concurrent top ups
+        # don't allocate them twice
+        self._warming[key] += needed
+        try:
+            await self.ready[region]
+            conn = await self._region_conn(region)
+            instances = await self._allocate_instances(
+                conn, needed, inst_type, region)
+            logger.debug("Allocated %d warm %s instances in %s.",
+                         len(instances), inst_type, region)
+            if self.use_filters:
+                await self._tag_instances(
+                    conn, [x.id for x in instances],
+                    {"Name": "loads-%s" % self.broker_id,
+                     "Project": "loads"})
+
+            collection = self._collection("warm", "%s:%s" % key, conn,
+                                          instances)
+            await collection.wait_for_running()
+            if self.prepare_instances is not None:
+                try:
+                    await self.prepare_instances(collection)
+                except Exception:
+                    logger.error("Failed preparing warm instances in %s, "
+                                 "pooling them as is.", region,
+                                 exc_info=True)
+        except Exception:
+            logger.error("Failed warming %s instances in %s.", inst_type,
+                         region, exc_info=True)
+            return
+        finally:
+            self._warming[key] -= needed
+
+        collection.close()
+        for inst in collection.instances:
+            self._instances.add(region, inst.instance)
+
+    async def _tag_instances(self, conn, instance_ids, tags):
+        """Tag instances with as few CreateTags calls as possible.
+
+        Sometimes, we can get instance data back before the AWS API
+        fully recognizes it. Instance ID's reported as not found are
+        retried together, with an exponential backoff, until they're
+        all tagged.
+
+        """
+        remaining = list(instance_ids)
+        delay = 1
+        for attempt in range(TAG_RETRIES + 1):
+            if attempt:
+                await gen.Task(self._loop.add_timeout, time.time() + delay)
+                delay *= 2
+
+            missing = []
+            for i in range(0, len(remaining), TAG_BATCH_SIZE):
+                missing.extend(await self._tag_batch(
+                    conn, remaining[i:i + TAG_BATCH_SIZE], tags))
+            if not missing:
+                return
+            logger.debug("Instances not found for tagging, retrying: %s",
+                         missing)
+            remaining = missing
+        raise LoadsException("Unable to tag instances: %s" % remaining)
+
+    async def _tag_batch(self, conn, instance_ids, tags):
+        """Tag a single batch of instances, returning the instance ID's
+        AWS reported as not found."""
+        missing = []
+        while instance_ids:
+            try:
+                await self._call_aws(conn.region.name, MUTATE,
+                                     conn.create_tags, instance_ids, tags)
+                break
+            except EC2ResponseError as exc:
+                if exc.error_code != "InvalidInstanceID.NotFound":
+                    raise
+                unknown = set(_INSTANCE_ID_RE.findall(
+                    exc.error_message or exc.body or ""))
+                unknown.intersection_update(instance_ids)
+                if not unknown:
+                    # Can't tell which were missing, retry them all
+                    return missing + instance_ids
+                missing.extend(unknown)
+                instance_ids = [x for x in instance_ids if x not in unknown]
+        return missing
 
     def _tag_for_reaping(self,
                          tags: Dict[str, str],
@@ -639,38 +1755,150 @@ class EC2Pool:
         """Return a collection of instances to the pool.
 
         :param collection: Collection to return
-        :type collection: :class:`EC2Collection`
+        :type collection: :class:`EC2Collection` or
+            :class:`MultiRegionCollection`
 
         """
+        if isinstance(collection, MultiRegionCollection):
+            await gen.multi([self.release_instances(x)
+                             for x in collection.collections])
+            return
+
+        collection.close()
+
         # Sometimes a collection ends up with zero instances after pruning
         # dead ones
         if not collection.instances:
             return
 
-        region = collection.instances[0].instance.region.name
+        region = collection.instances[0].instance.region
         instances = [x.instance for x in collection.instances]
 
+        self.inventory.invalidate(region)
+
+        # Spot instances are only kept for the run they were requested for
+        spot = [x for x in instances if x.spot_instance_request_id]
+        if spot:
+            instances = [x for x in instances
+                         if not x.spot_instance_request_id]
+            await self._terminate_instances(region, spot)
+        if not instances:
+            return
+
         # De-tag the Run data on these instances
         conn = await self._region_conn(region)
 
         if self.use_filters:
-            await self._run_in_executor(
-                conn.create_tags,
-                [x.id for x in instances],
-                {"RunId": "", "Uuid": ""})
+            await self._tag_instances(
+                conn, [x.id for x in instances], {"RunId": "", "Uuid": ""})
 
-        self._instances[region].extend(instances)
+        for inst in instances:
+            self._instances.add(region, inst)
+
+    def idle_counts(self):
+        """Returns the idle instance counts per region and instance
+        type."""
+        return self._instances.counts()
+
+    async def reap_idle_instances(self):
+        """Terminate the instances idle for longer than :attr:`max_idle`,
+        keeping :attr:`min_idle`, or the :attr:`warm_pool` target, of
+        every region and instance type."""
+        expired = self._instances.pop_expired(self.max_idle,
+                                              keep=self.min_idle,
+                                              targets=self.warm_pool)
+        if not expired:
+            return
+
+        terminated = await self._reap(expired)
+        for region, instance_ids in terminated.items():
+            logger.debug("Reaped %d idle instances in %s.",
+                         len(instance_ids), region)
 
     async def reap_instances(self):
-        """Immediately reap all instances."""
+        """Immediately reap all instances.
+
+        :returns: The ID's of the instances terminated, per region
+
+        """
         # Remove all the instances before yielding actions
-        all_instances = self._instances
-        self._instances = defaultdict(list)
+        return await self._reap(self._instances.pop_all())
+
+    async def _reap(self, instances):
+        """Terminate instances of every region concurrently, putting the
+        ones that failed back in the pool for the next attempt."""
+        regions = list(instances)
+        results = await gen.multi([
+            self._terminate_instances(region, instances[region])
+            for region in regions])
+
+        terminated = {}
+        for region, (region_terminated, failed) in zip(regions, results):
+            terminated[region] = region_terminated
+            failed = set(failed)
+            for inst in instances[region]:
+                if inst.id in failed:
+                    self._instances.add(region, inst)
+        return terminated
+
+    async def _terminate_instances(self, region, instances):
+        """Terminate instances of a region in batches of
+        :data:`TERMINATE_BATCH_SIZE`.
+
+        :returns: The ID's of the instances terminated, and of those
+            that still couldn't be after :data:`TERMINATE_RETRIES`
+            retries. Instances AWS doesn't know of are in neither.
 
-        for region, instances in all_instances.items():
-            conn = await self._region_conn(region)
+        """
+        self.inventory.invalidate(region)
+        conn = await self._region_conn(region)
 
-            # submit these instances for termination
-            await self._run_in_executor(
-                conn.terminate_instances,
-                [x.id for x in instances])
+        instance_ids = [x.id for x in instances]
+        results = await gen.multi([
+            self._terminate_batch(conn,
+                                  instance_ids[i:i + TERMINATE_BATCH_SIZE])
+            for i in range(0, len(instance_ids), TERMINATE_BATCH_SIZE)])
+
+        terminated, failed = [], []
+        for batch_terminated, batch_failed in results:
+            terminated.extend(batch_terminated)
+            failed.extend(batch_failed)
+        if failed:
+            logger.error("Unable to terminate %d instances in %s: %s",
+                         len(failed), region, failed)
+        return terminated, failed
+
+    async def _terminate_batch(self, conn, instance_ids):
+        """Terminate a single batch of instances, retrying failures with
+        an exponential backoff."""
+        region = conn.region.name
+        attempts = 0
+        delay = 1
+        while instance_ids:
+            try:
+                terminated = await self._call_aws(
+                    region, MUTATE, conn.terminate_instances, instance_ids)
+                return [x.id for x in terminated], []
+            except EC2ResponseError as exc:
+                unknown = set()
+                if exc.error_code == "InvalidInstanceID.NotFound":
+                    unknown = set(_INSTANCE_ID_RE.findall(
+                        exc.error_message or exc.body or ""))
+                    unknown.intersection_update(instance_ids)
+                if unknown:
+                    # Already gone, terminate the others right away
+                    instance_ids = [x for x in instance_ids
+                                    if x not in unknown]
+                    continue
+                logger.debug("Error terminating instances in %s.", region,
+                             exc_info=True)
+            except Exception:
+                logger.debug("Error terminating instances in %s.", region,
+                             exc_info=True)
+
+            attempts += 1
+            if attempts > TERMINATE_RETRIES:
+                break
+            await gen.Task(self._loop.add_timeout, time.time() + delay)
+            delay *= 2
+        return [], instance_ids
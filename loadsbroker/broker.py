@@ -26,26 +26,31 @@ Complete name of environment variables available in a test container:
     Port of the statsd host.
 
 """
+import heapq
+import itertools
 import os
-import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
 
 from sqlalchemy.orm.exc import NoResultFound
 from tornado import gen
+import tornado.locks
 
 from loadsbroker import logger, aws, __version__
 from loadsbroker.db import (
     Database,
     Run,
     Project,
+    INITIALIZING,
     RUNNING,
     TERMINATING,
     COMPLETED,
     setup_database,
 )
+from loadsbroker.dockerctrl import EVENTS_WINDOW, WATCHER_THREADS
 from loadsbroker.exceptions import LoadsException
 from loadsbroker.extensions import (
+    MAX_CONCURRENT_CHECKS,
     DNSMasq,
     Docker,
     Grafana,
@@ -54,12 +59,14 @@ from loadsbroker.extensions import (
     Watcher,
     SSH,
 )
+from loadsbroker.imagecache import ImageCache
 from loadsbroker.lifetime import (
     DNSMASQ_INFO,
     GRAFANA_INFO,
     INFLUXDB_INFO,
     TELEGRAF_INFO,
-    WATCHER_INFO
+    WATCHER_INFO,
+    StepRecordLink,
 )
 from loadsbroker.options import InfluxDBOptions
 from loadsbroker.webapp.api import _DEFAULTS
@@ -71,6 +78,15 @@ BASE_ENV = dict(
     BROKER_VERSION=__version__,
 )
 
+# How often the containers of running steps are checked, in seconds
+CHECK_INTERVAL = 30
+# Assumed time to get a step's instances ready, in seconds, until some
+# provisioning has been observed
+PROVISION_LATENCY = 600
+# Steps are provisioned this many times their expected provisioning
+# time ahead of their start
+PROVISION_MARGIN = 1.5
+
 
 def log_threadid(msg):
     """Log a message, including the thread ID"""
@@ -86,7 +102,14 @@ class RunHelpers:
 class Broker:
     def __init__(self, name, io_loop, sqluri, ssh_key, aws_port=None,
                  aws_owner_id="595879546273", aws_use_filters=True,
-                 aws_access_key=None, aws_secret_key=None, initial_db=None):
+                 aws_access_key=None, aws_secret_key=None, initial_db=None,
+                 ami_cache=None, ami_cache_ttl=aws.AMI_CATALOG_TTL,
+                 max_idle=600, min_idle=0, warm_pool=None,
+                 collection_threads=aws.COLLECTION_THREADS,
+                 check_interval=CHECK_INTERVAL,
+                 max_concurrent_checks=MAX_CONCURRENT_CHECKS,
+                 watcher_threads=WATCHER_THREADS,
+                 image_cache_dir=None, image_cache_url=None):
         self.name = name
         logger.info("Starting loads-broker (%s)", self.name)
 
@@ -99,18 +122,38 @@ class Broker:
             with open(user_data) as f:
                 user_data = f.read()
 
+        # Every run is woken up by this scheduler
+        self.scheduler = RunScheduler(self.loop, check_interval)
+
         logger.debug('Initializing AWS EC2 Pool')
         self.pool = aws.EC2Pool(self.name, user_data=user_data,
                                 io_loop=self.loop, port=aws_port,
                                 owner_id=aws_owner_id,
                                 use_filters=aws_use_filters,
                                 access_key=aws_access_key,
-                                secret_key=aws_secret_key)
+                                secret_key=aws_secret_key,
+                                ami_cache=ami_cache,
+                                ami_cache_ttl=ami_cache_ttl,
+                                max_idle=max_idle,
+                                min_idle=min_idle,
+                                warm_pool=warm_pool,
+                                prepare_instances=self._prepare_instances,
+                                collection_threads=collection_threads)
+
+        # Container images served to the instances by the broker
+        self.image_cache = None
+        if image_cache_dir and image_cache_url:
+            self.image_cache = ImageCache(image_cache_dir, image_cache_url)
 
         # Utilities used by RunManager
         ssh = SSH(ssh_keyfile=ssh_key)
         self.run_helpers = run_helpers = RunHelpers()
-        run_helpers.docker = Docker(ssh)
+        # The events subscriptions outlast the check rounds renewing them
+        run_helpers.docker = Docker(
+            ssh, image_cache=self.image_cache,
+            max_concurrent_checks=max_concurrent_checks,
+            events_window=max(EVENTS_WINDOW, 2 * check_interval),
+            watcher_threads=watcher_threads)
         run_helpers.dns = DNSMasq(DNSMASQ_INFO, run_helpers.docker)
         run_helpers.watcher = Watcher(WATCHER_INFO, options=aws_creds)
         run_helpers.influxdb = InfluxDB(INFLUXDB_INFO, ssh,
@@ -128,9 +171,24 @@ class Broker:
         if initial_db:
             setup_database(self.db.session(), initial_db)
 
+        # Pick up the runs a previous broker left in progress
+        self.recover_runs()
+
     def shutdown(self):
         self.pool.shutdown()
 
+    async def _prepare_instances(self, collection):
+        """Wait for docker on warm instances and preload the base
+        containers, so they're ready as soon as they're handed out."""
+        docker = self.run_helpers.docker
+        await docker.setup_collection(collection)
+        await docker.wait(collection, timeout=360)
+        await gen.multi([
+            docker.load_containers(collection, container.name,
+                                   container.url)
+            for container in StepRecordLink.base_containers + [TELEGRAF_INFO]
+        ])
+
     def get_projects(self, fields=None):
         projects = self.db.session().query(Project).all()
         return [proj.json(fields) for proj in projects]
@@ -207,7 +265,8 @@ class Broker:
                 plan_uuid=strategy_id,
                 run_uuid=uuid,
                 additional_env=kwargs,
-                owner=owner)
+                owner=owner,
+                scheduler=self.scheduler)
         except NoResultFound as e:
             raise LoadsException(str(e))
 
@@ -216,6 +275,31 @@ class Broker:
         self._runs[mgr.run.uuid] = mgr
         return mgr.run.uuid
 
+    def recover_runs(self):
+        """Resume managing the runs left running by a previous broker.
+
+        :returns: The uuids of the recovered runs
+
+        """
+        query = self.db.session().query(Run.uuid).filter(
+            Run.state.in_([RUNNING, TERMINATING]))
+        uuids = [uuid for uuid, in query if uuid not in self._runs]
+
+        for uuid in uuids:
+            logger.info("Recovering run %s", uuid)
+            session = self.db.session()
+            mgr, future = RunManager.recover_run(
+                run_helpers=self.run_helpers,
+                db_session=session,
+                pool=self.pool,
+                io_loop=self.loop,
+                run_uuid=uuid,
+                scheduler=self.scheduler)
+            callback = partial(self._run_complete, session, mgr)
+            future.add_done_callback(callback)
+            self._runs[uuid] = mgr
+        return uuids
+
     def delete_run(self, run_id):
         run, session = self._get_run(run_id)
         session.delete(run)
@@ -223,22 +307,131 @@ class Broker:
         # delete grafana
 
 
+class RunScheduler:
+    """Wakes up the :class:`RunManager`'s of a broker.
+
+    Every run's step deadlines are kept in a single heap served by a
+    single timer. The step containers of every run are checked in
+    rounds every ``check_interval`` seconds.
+
+    It also keeps track of how long steps take to provision, so they
+    can be provisioned just in time for their start.
+
+    """
+    def __init__(self, io_loop, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.round = 0
+        self.managers = set()
+        self._loop = io_loop
+        self._deadlines = []
+        self._deadline_ids = itertools.count()
+        self._next_round = None
+        self._timeout = None
+        self._timeout_at = None
+        self._latencies = {}
+
+    def register(self, manager):
+        """Start waking up a run manager."""
+        if not self.managers:
+            self._next_round = datetime.utcnow() + timedelta(
+                seconds=self.check_interval)
+        self.managers.add(manager)
+        self._reschedule()
+
+    def unregister(self, manager):
+        """Stop waking up a run manager."""
+        self.managers.discard(manager)
+        if not self.managers:
+            self._deadlines = []
+            self._cancel()
+
+    def wake_at(self, manager, when):
+        """Wake a run manager up at the given UTC :class:`datetime`."""
+        heapq.heappush(self._deadlines,
+                       (when, next(self._deadline_ids), manager))
+        self._reschedule()
+
+    def _latency_key(self, step):
+        return step.instance_type, tuple(r for r, _ in step.regions)
+
+    def provision_lead(self, step) -> float:
+        """How many seconds before its start a step should be
+        provisioned."""
+        latency = self._latencies.get(self._latency_key(step),
+                                      PROVISION_LATENCY)
+        return latency * PROVISION_MARGIN
+
+    def observe_provisioning(self, step, seconds):
+        """Record how many seconds a step took to provision."""
+        key = self._latency_key(step)
+        latency = self._latencies.get(key)
+        if latency is None:
+            self._latencies[key] = seconds
+        else:
+            self._latencies[key] = latency + 0.3 * (seconds - latency)
+
+    def _cancel(self):
+        if self._timeout is not None:
+            self._loop.remove_timeout(self._timeout)
+            self._timeout = self._timeout_at = None
+
+    def _reschedule(self):
+        if not self.managers:
+            return
+        wake_at = self._next_round
+        if self._deadlines:
+            wake_at = min(wake_at, self._deadlines[0][0])
+        if self._timeout is not None and self._timeout_at <= wake_at:
+            return
+        self._cancel()
+        delay = max((wake_at - datetime.utcnow()).total_seconds(), 0)
+        self._timeout_at = wake_at
+        self._timeout = self._loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timeout = self._timeout_at = None
+        now = datetime.utcnow()
+        woken = set()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            woken.add(heapq.heappop(self._deadlines)[2])
+        if now >= self._next_round:
+            # Every run checks its containers in this round
+            self.round += 1
+            self._next_round = now + timedelta(seconds=self.check_interval)
+            woken = set(self.managers)
+        for manager in woken & self.managers:
+            manager.wake_up()
+        self._reschedule()
+
+
 class RunManager:
     """Manages the life-cycle of a load run.
 
+    Steps are started and stopped as their ``run_delay`` and
+    ``run_max_time`` deadlines come up, while their containers are only
+    checked in the rounds of the :class:`RunScheduler`.
+
+    The instances of a step are only provisioned ahead of its start by
+    the provisioning time the scheduler observed, and the step starts as
+    soon as its own instances are ready and its deadline came up.
+
     """
-    def __init__(self, run_helpers, db_session, pool, io_loop, run):
+    def __init__(self, run_helpers, db_session, pool, io_loop, run,
+                 scheduler=None):
         self.helpers = run_helpers
         self.run = run
         self._db_session = db_session
         self._pool = pool
         self._loop = io_loop
         self._set_links = []
+        self._pending = []
+        self._provision_wakeups = {}
+        self._provisioning = []
         self._dns_map = {}
+        self._wakeup = tornado.locks.Event()
+        self.scheduler = scheduler or RunScheduler(io_loop)
         self.abort = False
         self._state_description = ""
-        # XXX see what should be this time
-        self.sleep_time = 1.5
 
     def _set_state(self, state):
         self._state_description = state
@@ -250,9 +443,24 @@ class RunManager:
 
     state_description = property(_get_state, _set_state)
 
+    def _set_abort(self, abort):
+        self._abort = abort
+        if abort:
+            self.wake_up()
+
+    def _get_abort(self):
+        return self._abort
+
+    abort = property(_get_abort, _set_abort)
+
+    def wake_up(self):
+        """Have the run loop look at the steps again."""
+        self._wakeup.set()
+
     @classmethod
     def new_run(cls, run_helpers, db_session, pool, io_loop, plan_uuid,
-                run_uuid=None, additional_env=None, owner=None):
+                run_uuid=None, additional_env=None, owner=None,
+                scheduler=None):
         """Create a new run manager for the given strategy name
 
         This creates a new run for this strategy and initializes it.
@@ -264,6 +472,8 @@ class RunManager:
         :param run_uuid: Use the provided run_uuid instead of generating one
         :param additional_env: Additional env args to use in container set
                                interpolation
+        :param scheduler: The :class:`RunScheduler` waking the run up,
+                          defaults to one of its own
 
         :returns: New RunManager in the process of being initialized,
                   along with a future tracking the run.
@@ -285,14 +495,39 @@ class RunManager:
 
         log_threadid("Committed new session.")
 
-        run_manager = cls(run_helpers, db_session, pool, io_loop, run)
+        run_manager = cls(run_helpers, db_session, pool, io_loop, run,
+                          scheduler=scheduler)
         future = gen.convert_yielded(run_manager.start())
         return run_manager, future
 
     @classmethod
-    def recover_run(cls, run_uuid):
-        """Given a run uuid, fully reconstruct the run manager state"""
-        pass
+    def recover_run(cls, run_helpers, db_session, pool, io_loop, run_uuid,
+                    scheduler=None):
+        """Given a run uuid, fully reconstruct the run manager state
+
+        The run's collections are rebuilt from the instances the pool
+        recovered for it, and the docker daemons of its running steps
+        reattached. The run then carries on from where it was left,
+        without reprovisioning instances or restarting containers.
+
+        :param db_session: SQLAlchemy database session
+        :param pool: AWS EC2Pool instance the instances are recovered from
+        :param io_loop: A tornado io loop
+        :param run_uuid: The UUID of the run to recover
+        :param scheduler: The :class:`RunScheduler` waking the run up,
+                          defaults to one of its own
+
+        :returns: Recovered RunManager in the process of being
+                  reattached, along with a future tracking the run.
+
+        """
+        logger.debug('Recovering run %s', run_uuid)
+        run = db_session.query(Run).filter(Run.uuid == run_uuid).one()
+
+        run_manager = cls(run_helpers, db_session, pool, io_loop, run,
+                          scheduler=scheduler)
+        future = gen.convert_yielded(run_manager.start())
+        return run_manager, future
 
     @property
     def uuid(self):
@@ -317,26 +552,36 @@ class RunManager:
                 return InfluxDBOptions(
                     instance.ip_address, 8086, None, None, dbname, False)
 
-    async def _get_steps(self):
-        """Request all the step instances needed from the pool
-
-        This is a separate method as both the recover run and new run
-        will need to run this identically.
+    def _request_step(self, step, allocate_missing=True):
+        """Request the instances of a step from the pool"""
+        return self._pool.request_instances(
+            self.run.uuid,
+            step.uuid,
+            count=step.instance_count,
+            allocate_missing=allocate_missing,
+            inst_type=step.instance_type,
+            region=step.instance_region,
+            plan=self.run.plan.name,
+            owner=self.run.owner,
+            run_max_time=step.run_delay + step.run_max_time,
+            min_count=step.instance_min_count,
+            fallback_types=step.fallback_types,
+            zones=step.zones,
+            spot_price=step.spot_price,
+            regions=step.regions,
+            image=self.run.interpolate(step.container_name,
+                                       step.environment_data))
+
+    async def _get_steps(self, steps, allocate_missing=True):
+        """Request the step instances of a recovered run from the pool
+
+        Recovered runs don't allocate missing instances, they only get
+        back the ones they had.
 
         """
         logger.debug('Getting steps & collections')
-        steps = self.run.plan.steps
         collections = await gen.multi(
-            [self._pool.request_instances(
-                self.run.uuid,
-                s.uuid,
-                count=s.instance_count,
-                inst_type=s.instance_type,
-                region=s.instance_region,
-                plan=self.run.plan.name,
-                owner=self.run.owner,
-                run_max_time=s.run_delay + s.run_max_time)
-             for s in steps])
+            [self._request_step(s, allocate_missing) for s in steps])
 
         try:
             # First, setup some dicst, all keyed by step.uuid
@@ -394,24 +639,118 @@ class RunManager:
         return True
 
     async def _initialize(self):
-        # Initialize all the collections, this needs to always be done
-        # just in case we're recovering
-        await self._get_steps()
-
-        # Skip if we're running
-        if self.state == RUNNING:
+        # Steps are provisioned once they're close to starting, except
+        # the ones a recovered run already started
+        steps = self.run.plan.steps
+        started = {x.step.uuid for x in self.run.step_records
+                   if x.started_at}
+        self._pending = [s for s in steps if s.uuid not in started]
+
+        # Reattach to the started steps if we're recovering
+        if self.state != INITIALIZING:
+            await self._get_steps([s for s in steps if s.uuid in started],
+                                  allocate_missing=False)
+            await self._reattach()
             return
 
-        # Wait for the collections to come up
-        self.state_description = "Waiting for running docker instances."
-        await gen.multi([setlink.initialize(self.helpers.docker)
-                         for setlink in self._set_links])
-
         self.run.state = RUNNING
         self.run.started_at = datetime.utcnow()
         self._db_session.commit()
         log_threadid("Now running.")
 
+    async def _reattach(self):
+        """Restore the step state of a run started by a previous broker,
+        without restarting any of its containers."""
+        self.state_description = "Reattaching to running instances."
+        running = []
+
+        # Rebuild the DNS map in the order the steps were started
+        for setlink in sorted(self._set_links, key=lambda x: x.step.run_delay):
+            coll, record = setlink.ec2_collection, setlink.step_record
+            coll.started = record.started_at is not None
+            coll.finished = record.completed_at is not None
+            if not coll.started:
+                continue
+
+            coll.local_dns = bool(self._dns_map)
+            if setlink.step.dns_name:
+                ips = [x.instance.ip_address for x in coll.instances]
+                self._dns_map[setlink.step.dns_name] = ips
+            if not coll.finished:
+                running.append(setlink)
+
+        # The monitor's instances may not have survived the broker
+        monitor_step = self.run.get_monitor_step()
+        monitors = [x for x in self._set_links if x.step == monitor_step]
+        if running and monitors and not monitors[0].ec2_collection.instances:
+            logger.error("No monitor instances recovered, aborting run.")
+            monitors[0].ec2_collection.finished = True
+            self.abort = True
+            return
+
+        influxdb_options = self.influxdb_options if running else None
+        await gen.multi([
+            setlink.reattach(self.helpers.docker, influxdb_options)
+            for setlink in running])
+        for setlink in self._set_links:
+            setlink.ready = True
+        log_threadid("Reattached.")
+
+    def _provision_at(self, step):
+        """When the instances of a step should be requested"""
+        lead = self.scheduler.provision_lead(step)
+        return self.run.started_at + timedelta(
+            seconds=step.run_delay - lead)
+
+    def _provision_due(self):
+        """Start provisioning the steps starting soon enough"""
+        now = datetime.utcnow()
+        for step in list(self._pending):
+            if self._provision_at(step) <= now:
+                self._pending.remove(step)
+                self._provisioning.append(
+                    gen.convert_yielded(self._provision_step(step)))
+        self._schedule_provisioning()
+
+    def _schedule_provisioning(self):
+        """Wake up when the pending steps should be provisioned, again
+        whenever their expected provisioning time changes."""
+        for step in self._pending:
+            when = self._provision_at(step)
+            if self._provision_wakeups.get(step.uuid) != when:
+                self._provision_wakeups[step.uuid] = when
+                self.scheduler.wake_at(self, when)
+
+    async def _provision_step(self, step):
+        """Get the instances of a step ready to start, aborting the run
+        if they can't be had."""
+        began = datetime.utcnow()
+        record = [x for x in self.run.step_records if x.step == step][0]
+        try:
+            collection = await self._request_step(step)
+        except Exception:
+            logger.error("Error provisioning step, aborting run.",
+                         exc_info=True)
+            self.abort = True
+            return
+
+        setlink = step.link(record, collection)
+        self._set_links.append(setlink)
+        try:
+            await setlink.initialize(self.helpers.docker)
+        except Exception:
+            logger.error("Error preparing step, aborting run.",
+                         exc_info=True)
+            self.abort = True
+            return
+
+        setlink.ready = True
+        self.scheduler.observe_provisioning(
+            step, (datetime.utcnow() - began).total_seconds())
+        self._schedule_provisioning()
+        self._schedule_step(setlink)
+        self.wake_up()
+
     async def _shutdown(self):
         # If we aren't terminating, we shouldn't have been called
         if self.state != TERMINATING:
@@ -424,6 +763,9 @@ class RunManager:
         self._db_session.commit()
 
     async def _cleanup(self, exc=False):
+        # Wait on steps still being provisioned so they're released too
+        await gen.multi(self._provisioning)
+
         if exc:
             # Ensure we try and shut them down
             logger.debug("Exception occurred, ensure containers terminated.",
@@ -451,30 +793,63 @@ class RunManager:
         if self.state != RUNNING:
             return
 
+        # Schedule the provisioning and deadlines of the steps
+        scheduler = self.scheduler
+        scheduler.register(self)
+        self._schedule_provisioning()
+        for setlink in self._set_links:
+            self._schedule_step(setlink)
+
         # Main run loop
-        while True:
-            if self.abort:
-                logger.debug("Aborted, exiting run loop.")
-                break
+        checked_round = scheduler.round
+        liveness = False
+        try:
+            while True:
+                if self.abort:
+                    logger.debug("Aborted, exiting run loop.")
+                    break
 
-            stop = await self._check_steps()
-            if stop:
-                break
+                stop = await self._check_steps(liveness)
+                if stop:
+                    break
 
-            # Now we sleep for a bit
-            await gen.Task(self._loop.add_timeout, time.time() +
-                           self.sleep_time)
+                # Sleep until a deadline or check round, unless woken
+                # up by an abort or a step completing
+                await self._wakeup.wait()
+                self._wakeup.clear()
+
+                liveness = scheduler.round != checked_round
+                checked_round = scheduler.round
+        finally:
+            scheduler.unregister(self)
 
         # We're done running, time to terminate
         self.run.state = TERMINATING
         self.run.completed_at = datetime.utcnow()
         self._db_session.commit()
 
-    async def _check_steps(self):
+    def _schedule_step(self, setlink):
+        """Add the next deadline of a step: when it should start, or
+        stop once started."""
+        step, record = setlink.step, setlink.step_record
+        if setlink.ec2_collection.finished:
+            return
+        if not record.started_at:
+            when = self.run.started_at + timedelta(seconds=step.run_delay)
+        elif step.run_max_time:
+            when = record.started_at + timedelta(seconds=step.run_max_time)
+        else:
+            return
+        self.scheduler.wake_at(self, when)
+
+    async def _check_steps(self, liveness=True):
         """Checks steps for the plan to see if any existing steps
         have finished, or new ones need to start.
 
-        When all the steps have run and completed, returns False
+        Unless ``liveness`` is set, running steps are only stopped once
+        due, without checking their containers.
+
+        When all the steps have run and completed, returns True
         to indicate nothing remains for the plan.
 
         """
@@ -483,13 +858,22 @@ class RunManager:
         finished = [x.ec2_collection.finished for x in self._set_links]
 
         # If all steps were started and finished, the run is complete.
-        if all(started) and all(finished):
+        provisioned = len(self._set_links) == len(self.run.plan.steps)
+        if provisioned and all(started) and all(finished):
             return True
 
-        # Locate all steps that have completed
-        dones = await gen.multi([x.is_done(self.helpers.docker)
-                                 for x in self._set_links])
-        dones = zip(dones, self._set_links)
+        self._provision_due()
+
+        # Locate all running steps that have completed
+        running = [x for x in self._set_links
+                   if x.ec2_collection.started and
+                   not x.ec2_collection.finished]
+        if liveness:
+            dones = await gen.multi([
+                x.is_done(self.helpers.docker) for x in running])
+        else:
+            dones = [x.is_due() for x in running]
+        dones = list(zip(dones, running))
 
         # Send shutdown to steps that have completed, we can shut them all
         # down in any order so we run in parallel
@@ -503,6 +887,10 @@ class RunManager:
             self._db_session.commit()
         await gen.multi([shutdown(s) for done, s in dones if done])
 
+        # Steps waiting on others completing need another look
+        if any(done for done, _ in dones):
+            self.wake_up()
+
         # Start steps that should be started, ordered by delay
         starts = list(filter(self._should_start, self._set_links))
         starts.sort(key=lambda x: x.step.run_delay)
@@ -522,6 +910,7 @@ class RunManager:
 
             setlink.step_record.started_at = datetime.utcnow()
             self._db_session.commit()
+            self._schedule_step(setlink)
 
             # If this collection reg's a dns name, add this collections
             # ip's to the name
@@ -529,6 +918,10 @@ class RunManager:
                 ips = [x.instance.ip_address for x
                        in setlink.ec2_collection.instances]
                 self._dns_map[setlink.step.dns_name] = ips
+
+        # Later steps may have been waiting on these to start
+        if starts:
+            self.wake_up()
         return False
 
     async def _start_step(self, setlink):
@@ -543,5 +936,22 @@ class RunManager:
         await setlink.stop(self.helpers)
 
     def _should_start(self, setlink):
-        """Given a StepRecordLink, determine if the step should be started."""
-        return setlink.step_record.should_start()
+        """Given a StepRecordLink, determine if the step should be started.
+
+        Besides being due, its instances must be ready, and the steps
+        with a lower delay must have been started, as well as the
+        monitor step if it has the same delay.
+
+        """
+        if not setlink.ready or not setlink.step_record.should_start():
+            return False
+        step = setlink.step
+        monitor_step = self.run.get_monitor_step()
+        for record in self.run.step_records:
+            if record.started_at or record.step == step:
+                continue
+            delay = record.step.run_delay
+            if delay < step.run_delay or (record.step == monitor_step and
+                                          delay == step.run_delay):
+                return False
+        return True
@@ -5,7 +5,7 @@ import datetime
 import json
 from collections import OrderedDict
 from string import Template
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from sqlalchemy import (
@@ -27,7 +27,7 @@ from sqlalchemy.orm import (
 from sqlalchemy.pool import StaticPool
 from sqlalchemy.types import TypeDecorator
 
-from loadsbroker import logger
+from loadsbroker import aws, logger
 from loadsbroker.exceptions import LoadsException
 from loadsbroker.lifetime import (
     INFLUXDB_INFO,
@@ -40,6 +40,32 @@ def suuid4():
     return str(uuid4())
 
 
+def _split_list(value):
+    if not value:
+        return []
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def _parse_regions(value) -> List[Tuple[str, int]]:
+    """Parse comma separated ``region[:weight]`` entries, of the regions
+    the pool allocates instances in."""
+    regions = []
+    for entry in _split_list(value):
+        region, _, weight = entry.partition(":")
+        region = region.strip()
+        if region not in aws.AWS_REGIONS:
+            raise LoadsException("Unsupported region: %s" % region)
+        try:
+            weight = int(weight) if weight.strip() else 1
+        except ValueError:
+            weight = 0
+        if weight < 1:
+            raise LoadsException("Invalid weight for region %s: %s" %
+                                 (region, entry))
+        regions.append((region, weight))
+    return regions
+
+
 class JSONEncodedDict(TypeDecorator):
     """Represents an immutable structure as a JSON-encoded string."""
 
@@ -182,7 +208,8 @@ class Step(Base):
     - What Container to run ('bbangert/push-tester:latest')
     - How many of them to run (200 instances)
     - What instance type to run them on ('r3.large')
-    - What region the instances should be in ('us-west-2')
+    - What region the instances should be in ('us-west-2'), or how to
+      spread them across regions ('us-west-2:2,us-east-1:1')
     - Maximum amount of time the step should run (20 minutes)
     - Delay after the run has started before this step should be run
 
@@ -224,6 +251,42 @@ class Step(Base):
                            doc="Type of instance to use")
     instance_count = Column(Integer, default=1,
                             doc="How many instances to spin up")
+    instance_min_count = Column(
+        Integer,
+        nullable=True,
+        default=None,
+        doc="Fewest instances the step can run with, allows starting "
+            "with fewer than instance_count when capacity is short"
+    )
+    instance_fallback_types = Column(
+        String,
+        nullable=True,
+        default=None,
+        doc="Comma separated instance types to use once instance_type "
+            "runs out of capacity"
+    )
+    spot_price = Column(
+        String,
+        nullable=True,
+        default=None,
+        doc="Maximum hourly price to pay for spot instances, on-demand "
+            "instances are used when unset"
+    )
+    instance_zones = Column(
+        String,
+        nullable=True,
+        default=None,
+        doc="Comma separated availability zones to spin up instances in, "
+            "in order of preference"
+    )
+    instance_regions = Column(
+        String,
+        nullable=True,
+        default=None,
+        doc="Comma separated regions to spread the instances across, "
+            "each optionally weighted as region:weight, overrides "
+            "instance_region"
+    )
 
     # Test container run data
     container_name = Column(String, doc="Docker container name/tag to use, "
@@ -291,8 +354,38 @@ class Step(Base):
         if env_data and isinstance(env_data, list):
             json["environment_data"] = dict(
                 line.split('=', 1) for line in env_data)
+        regions = json.get("instance_regions")
+        if isinstance(regions, dict):
+            json["instance_regions"] = ",".join(
+                "%s:%s" % item for item in regions.items())
+        for key in ("instance_fallback_types", "instance_zones",
+                    "instance_regions"):
+            if isinstance(json.get(key), list):
+                json[key] = ",".join(json[key])
+        # Fail early on malformed regions
+        _parse_regions(json.get("instance_regions"))
+        if json.get("spot_price") is not None:
+            json["spot_price"] = str(json["spot_price"])
         return cls(**json)
 
+    @property
+    def fallback_types(self) -> List[str]:
+        """The instance fallback types as a list"""
+        return _split_list(self.instance_fallback_types)
+
+    @property
+    def zones(self) -> List[str]:
+        """The availability zones as a list"""
+        return _split_list(self.instance_zones)
+
+    @property
+    def regions(self) -> List[Tuple[str, int]]:
+        """The regions to spread the instances across, with their
+        weights"""
+        if self.instance_regions:
+            return _parse_regions(self.instance_regions)
+        return [(self.instance_region or "us-west-2", 1)]
+
     def should_stop(self, run: 'Run') -> bool:
         """Indicates if this step should be stopped.
 
@@ -325,6 +418,11 @@ class Step(Base):
                 'node_delay': self.node_delay,
                 'plan_id': self.plan_id,
                 'instance_count': self.instance_count,
+                'instance_min_count': self.instance_min_count,
+                'instance_fallback_types': self.instance_fallback_types,
+                'instance_zones': self.instance_zones,
+                'instance_regions': self.instance_regions,
+                'spot_price': self.spot_price,
                 'step_records': [rec.json(fields)
                                  for rec in self.step_records],
                 '_capture_output': self._capture_output}
@@ -1,22 +1,76 @@
 """ Interacts with a Docker Daemon on a remote instance"""
+import json
 import random
+import re
+import select
+import shlex
+import threading
+import time
 from typing import (
     Any,
+    Callable,
     Dict,
     List,
     Optional
 )
 
 import docker
+from attr import Factory, attrib, attrs
 from requests.exceptions import ConnectionError, Timeout
 
 from loadsbroker import logger
+from loadsbroker.exceptions import ImageImportException
 from loadsbroker.util import retry
 
 StrDict = Dict[str, str]
 
 DOCKER_RETRY_EXC = (ConnectionError, Timeout)
 
+# Label marking the containers run by the broker
+CONTAINER_LABEL = "loadsbroker"
+# How long an events subscription lasts before being renewed by default,
+# in seconds. Subscriptions are only renewed while the containers are
+# being queried, so the window has to outlast the time between queries.
+EVENTS_WINDOW = 60
+# Container events that leave no running container behind
+STOPPED_EVENTS = ("die", "destroy")
+# Most daemons whose events are watched at once by default, one thread
+# each. Beyond that, the containers of the other daemons are listed
+# instead.
+WATCHER_THREADS = 32
+# Image events adding the image named by the event
+ADDED_IMAGE_EVENTS = ("pull", "tag")
+
+# Downloads an image into docker load, reporting the bytes transferred.
+# Unreachable sources, like peers firewalled off, fail fast.
+IMPORT_COMMAND = ("curl -sSf --connect-timeout 10 %s | "
+                  "dd bs=1M status=progress | docker load")
+
+_DD_BYTES = re.compile(r"^(\d+) bytes")
+_LOADED_LAYER = re.compile(r"^(\w+): Loading layer")
+
+_watcher_slots = threading.BoundedSemaphore(WATCHER_THREADS)
+
+
+@attrs(slots=True)
+class ImportProgress:
+    """Progress of a container image import on an instance"""
+    url = attrib()  # type: str
+    bytes_transferred = attrib(default=0)  # type: int
+    layers_loaded = attrib(default=0)  # type: int
+    started_at = attrib(default=Factory(time.time))  # type: float
+    finished_at = attrib(default=None)  # type: Optional[float]
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds the import has taken so far"""
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Bytes transferred per second"""
+        return self.bytes_transferred / max(self.elapsed, 0.001)
+
 
 def split_container_name(container_name):
     """Pulls apart a container name from its tag"""
@@ -28,13 +82,150 @@ def split_container_name(container_name):
 
 
 class DockerDaemon:
+    """A Docker daemon client
+
+    The running containers are tracked from the daemon's ``/events``
+    stream by a background thread while :meth:`running` is queried, so
+    it doesn't have to list the containers every time. The daemons
+    sharing the ``watcher_slots`` semaphore, :data:`WATCHER_THREADS`
+    slots when not given, are watched at most that many at once. The
+    containers of the others are listed until a slot frees up.
+
+    The events are subscribed to ``events_window`` seconds at a time,
+    and the subscription ends once :meth:`running` wasn't queried for a
+    whole window.
 
-    def __init__(self, host, timeout=5):
+    The image tags held by the daemon are indexed once, and kept up to
+    date after pulls, loads and from the image events.
+
+    """
+    def __init__(self, host, timeout=5, events_window=EVENTS_WINDOW,
+                 watcher_slots: Optional[threading.BoundedSemaphore] = None):
         self.host = host
         self.timeout = timeout
+        self.events_window = events_window
         self.responded = False
         self._client = docker.Client(base_url=host, timeout=timeout)
 
+        # Image names of the running containers, and whether the broker
+        # labelled them, keyed by container id
+        self._containers = {}  # type: Dict[str, tuple]
+        self._lock = threading.Lock()
+        self._watcher = None  # type: Optional[threading.Thread]
+        if watcher_slots is None:
+            watcher_slots = _watcher_slots
+        self._watcher_slots = watcher_slots
+        self._polling = False
+        self._synced = False
+        self._queried_at = 0.0
+
+        # Repo tags of the daemon's images, None until listed
+        self._images = None  # type: Optional[set]
+
+    def running(self, container_name: str) -> Optional[bool]:
+        """Indicates whether a container of the given name is running
+        according to the daemon's events, without any network call.
+
+        Returns None when the events aren't being watched yet, watching
+        them from then on, or when the only matching containers weren't
+        labelled by the broker, such as those of a recovered run started
+        by an older broker.
+
+        """
+        self._queried_at = time.time()
+        if self._watcher is None:
+            self.watch()
+        if not self._synced:
+            return None
+        with self._lock:
+            labels = [labelled for image, labelled
+                      in self._containers.values() if container_name in image]
+        if any(labels):
+            return True
+        return None if labels else False
+
+    def watch(self):
+        """Start tracking the running containers from the events, unless
+        every watcher slot is taken"""
+        if self._watcher is not None:
+            return
+        if not self._watcher_slots.acquire(blocking=False):
+            if not self._polling:
+                logger.debug("No events watcher free for %s, listing its "
+                             "containers instead", self.host)
+                self._polling = True
+            return
+        self._polling = False
+        self._watcher = threading.Thread(
+            target=self._watch_slot, name="events-%s" % self.host,
+            daemon=True)
+        try:
+            self._watcher.start()
+        except Exception:
+            self._watcher = None
+            self._watcher_slots.release()
+            raise
+
+    def _watch_slot(self):
+        try:
+            self._watch()
+        finally:
+            self._watcher_slots.release()
+
+    def _watch(self):
+        # The stream is left by the daemon at the end of every window,
+        # so reads only time out when the daemon is lost
+        client = docker.Client(base_url=self.host,
+                               timeout=self.events_window + self.timeout)
+        filters = {"type": ["container", "image"]}
+        try:
+            while True:
+                since = int(time.time())
+                events = client.events(since=since,
+                                       until=since + self.events_window,
+                                       filters=filters, decode=True)
+                # Subscribed first, so no change is missed while listing
+                containers = {}
+                for cont in client.containers():
+                    labels = cont.get("Labels") or {}
+                    containers[cont["Id"]] = (cont["Image"],
+                                              CONTAINER_LABEL in labels)
+                with self._lock:
+                    self._containers = containers
+                self._synced = True
+
+                for event in events:
+                    self._apply_event(event)
+
+                if time.time() - self._queried_at > self.events_window:
+                    break
+        except Exception:
+            logger.debug("Lost the events of %s", self.host, exc_info=True)
+        finally:
+            self._synced = False
+            self._watcher = None
+
+    def _apply_event(self, event: Dict[str, Any]):
+        """Update the running containers or images from an event"""
+        status = event.get("status")
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        if event.get("Type") == "image":
+            # Pull events only name the repository in their attributes,
+            # their id is the pulled tag
+            if status == "pull":
+                name = event.get("id")
+            else:
+                name = attributes.get("name")
+            self._apply_image_event(status, name)
+            return
+
+        with self._lock:
+            if status == "start":
+                self._containers[event["id"]] = (
+                    event.get("from", ""), CONTAINER_LABEL in attributes)
+            elif status in STOPPED_EVENTS:
+                self._containers.pop(event["id"], None)
+
     def get_containers(self, all=False):
         """Returns a list of containers
 
@@ -44,6 +235,17 @@ class DockerDaemon:
         return {cont['Id']: cont
                 for cont in self._client.containers(all=all)}
 
+    def _apply_image_event(self, status: str, name: Optional[str]):
+        """Update the image index from an image event"""
+        with self._lock:
+            if self._images is None:
+                return
+            if status in ADDED_IMAGE_EVENTS and name:
+                self._images.add(name)
+            else:
+                # Untagged or deleted, have them listed again
+                self._images = None
+
     def _create_container(self, image, cmd=None):
         """creates a container
         """
@@ -84,25 +286,86 @@ class DockerDaemon:
 
     def pull_container(self, container_name):
         """Pulls a container image from the repo/tag for the provided
-        container name"""
-        result = self._client.pull(container_name, stream=True)
-        return list(result)
+        container name, raising an :exc:`ImageImportException` if the
+        pull failed"""
+        result = list(self._client.pull(container_name, stream=True))
+        for line in result:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", "replace")
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "error" in message:
+                raise ImageImportException("Pulling %s failed: %s" % (
+                    container_name, message["error"]))
+        return result
+
+    def import_container(self, client, container_url,
+                         progress: Optional[
+                             Callable[[ImportProgress], None]] = None,
+                         ) -> ImportProgress:
+        """Imports a container from a URL, until docker is done loading it.
+
+        :param client: SSH client of the instance
+        :param container_url: URL of the image
+        :param progress: Called with the :class:`ImportProgress` as
+            bytes are transferred and layers loaded
+        :raises ImageImportException: When the import failed
 
-    def import_container(self, client, container_url):
-        """Imports a container from a URL"""
+        """
+        command = IMPORT_COMMAND % shlex.quote(container_url)
         stdin, stdout, stderr = client.exec_command(
-            'curl %s | docker load' % container_url)
-        # Wait for termination
-        output = stdout.channel.recv(4096)
+            "bash -o pipefail -c %s" % shlex.quote(command))
         stdin.close()
+        channel = stdout.channel
+        result = ImportProgress(container_url)
+        layers = set()
+        out = err = ""
+        errors = []
+
+        while not (channel.exit_status_ready() and
+                   not channel.recv_ready() and
+                   not channel.recv_stderr_ready()):
+            select.select([channel], [], [], 1.0)
+            updated = False
+
+            if channel.recv_ready():
+                out += channel.recv(4096).decode("utf-8", "replace")
+                *lines, out = re.split(r"[\r\n]", out)
+                for line in lines:
+                    match = _LOADED_LAYER.match(line)
+                    if match:
+                        layers.add(match.group(1))
+                updated = len(layers) != result.layers_loaded
+                result.layers_loaded = len(layers)
+
+            if channel.recv_stderr_ready():
+                err += channel.recv_stderr(4096).decode("utf-8", "replace")
+                *lines, err = re.split(r"[\r\n]", err)
+                for line in lines:
+                    match = _DD_BYTES.match(line)
+                    if match:
+                        result.bytes_transferred = int(match.group(1))
+                        updated = True
+                    elif line.strip():
+                        errors.append(line.strip())
+
+            if updated and progress:
+                progress(result)
+
+        status = channel.recv_exit_status()
+        result.finished_at = time.time()
         stdout.close()
         stderr.close()
-        return output
+        if status != 0:
+            raise ImageImportException("Importing %s failed (%d): %s" % (
+                container_url, status, "; ".join(errors[-3:])))
+        return result
 
     @retry(on_exception=lambda exc: isinstance(exc, DOCKER_RETRY_EXC))
-    def has_image(self, container_name):
-        """Indicates whether this instance already has the desired
-        container name/tag loaded.
+    def refresh_images(self):
+        """Index the repo tags of the daemon's images.
 
         Example of what the images command output looks like:
 
@@ -114,9 +377,23 @@ class DockerDaemon:
               'VirtualSize': 1400958681}]
 
         """
-        name, tag = split_container_name(container_name)
         images = self._client.images(all=True)
-        return any(container_name in image["RepoTags"] for image in images)
+        tags = {tag for image in images for tag in image["RepoTags"] or ()}
+        with self._lock:
+            self._images = tags
+
+    def has_image(self, container_name, refresh=False):
+        """Indicates whether this instance already has the desired
+        container name/tag loaded.
+
+        The images are only listed when not indexed yet, or to
+        ``refresh`` the index.
+
+        """
+        if refresh or self._images is None:
+            self.refresh_images()
+        with self._lock:
+            return container_name in (self._images or ())
 
     def run_container(self,
                       name: str,
@@ -149,7 +426,8 @@ class DockerDaemon:
             name, command=command, environment=env,
             volumes=[volume['bind'] for volume in volumes.values()],
             ports=expose,
-            entrypoint=entrypoint)
+            entrypoint=entrypoint,
+            labels={CONTAINER_LABEL: ""})
 
         container = result["Id"]
         result = self._client.start(container, binds=volumes,
@@ -7,3 +7,7 @@ class LoadsException(Exception):
 
 class TimeoutException(LoadsException):
     """Raised when a timeout occurs"""
+
+
+class ImageImportException(LoadsException):
+    """Raised when loading a container image on an instance fails"""
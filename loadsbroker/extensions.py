@@ -8,8 +8,10 @@ the AWS instances as needed to retain their information.
 """
 import json
 import os
+import threading
 import time
 import urllib.parse
+from collections import defaultdict
 from datetime import date
 from string import Template
 from typing import Dict, Optional
@@ -17,13 +19,22 @@ from typing import Dict, Optional
 import paramiko.client as sshclient
 from influxdb import InfluxDBClient
 from tornado import gen
+import tornado.locks
 
 from loadsbroker import logger
 from loadsbroker.aws import EC2Collection, EC2Instance
-from loadsbroker.dockerctrl import DOCKER_RETRY_EXC, DockerDaemon
+from loadsbroker.dockerctrl import (
+    DOCKER_RETRY_EXC,
+    EVENTS_WINDOW,
+    WATCHER_THREADS,
+    DockerDaemon,
+    ImportProgress,
+)
+from loadsbroker.exceptions import ImageImportException
+from loadsbroker.imagecache import ImageCache
 from loadsbroker.options import InfluxDBOptions
 from loadsbroker.ssh import makedirs
-from loadsbroker.util import join_host_port, retry
+from loadsbroker.util import join_host_port
 
 SUPPORT_DIR = os.path.join(os.path.dirname(__file__), "support")
 
@@ -37,6 +48,16 @@ with open(os.path.join(SUPPORT_DIR, MONITOR_DASHBOARD_FN), "r") as f:
 
 UPLOAD2S3_PATH = os.path.join(SUPPORT_DIR, "upload2s3.sh")
 
+# Instances of a region loading a container image from its source, the
+# others load it from the instances that already have it
+FANOUT_SEEDS = 8
+# Instances each instance holding an image passes it on to
+FANOUT = 2
+# Seconds between the progress logs of an image import
+PROGRESS_INTERVAL = 10
+# Most instances whose containers are listed at once across every run
+MAX_CONCURRENT_CHECKS = 20
+
 
 class SSH:
     """SSH client to communicate with instances."""
@@ -88,9 +109,26 @@ class SSH:
 
 
 class Docker:
-    """Docker commands for AWS instances using :class:`DockerDaemon`"""
-    def __init__(self, ssh):
+    """Docker commands for AWS instances using :class:`DockerDaemon`
+
+    Container images are imported through the ``image_cache`` when
+    given, rather than by every instance from their URL. At most
+    ``max_concurrent_checks`` instances have their containers listed
+    at once.
+
+    The events of at most ``watcher_threads`` daemons are watched at
+    once, subscribed to ``events_window`` seconds at a time.
+
+    """
+    def __init__(self, ssh, image_cache: Optional[ImageCache] = None,
+                 max_concurrent_checks=MAX_CONCURRENT_CHECKS,
+                 events_window=EVENTS_WINDOW,
+                 watcher_threads=WATCHER_THREADS):
         self.sshclient = ssh
+        self.image_cache = image_cache
+        self.events_window = events_window
+        self._checks = tornado.locks.Semaphore(max_concurrent_checks)
+        self._watcher_slots = threading.BoundedSemaphore(watcher_threads)
 
     async def setup_collection(self, collection):
         def setup_docker(ec2_instance):
@@ -102,7 +140,9 @@ class Docker:
                 docker_host = "tcp://%s:2375" % instance.ip_address
 
             if not hasattr(state, "docker"):
-                state.docker = DockerDaemon(host=docker_host)
+                state.docker = DockerDaemon(
+                    host=docker_host, events_window=self.events_window,
+                    watcher_slots=self._watcher_slots)
         await collection.map(setup_docker)
 
     @staticmethod
@@ -121,6 +161,7 @@ class Docker:
             try:
                 inst.state.docker.get_containers()
                 inst.state.docker.responded = True
+                inst.state.docker.refresh_images()
             except DOCKER_RETRY_EXC:
                 logger.debug("Docker not ready yet on %s",
                              str(inst.instance.id))
@@ -146,7 +187,22 @@ class Docker:
 
     async def is_running(self, collection, container_name, prune=True):
         """Checks running instances in a collection to see if the provided
-        container_name is running on the instance."""
+        container_name is running on the instance.
+
+        The containers are only listed on instances whose docker events
+        aren't being tracked, or whose matching containers weren't
+        labelled by the broker.
+
+        """
+        results = []
+        unknown = []
+        for instance in collection.running_instances():
+            running = instance.state.docker.running(container_name)
+            if running is None:
+                unknown.append(instance)
+            else:
+                results.append(running)
+
         def has_container(instance):
             try:
                 all_containers = instance.state.docker.get_containers()
@@ -160,42 +216,131 @@ class Docker:
             return any(container_name in cont["Image"]
                        for cont in all_containers.values())
 
-        results = await gen.multi([collection.execute(has_container, x)
-                                   for x in collection.running_instances()])
+        async def check(instance):
+            await self._checks.acquire()
+            try:
+                return await collection.execute(has_container, instance)
+            finally:
+                self._checks.release()
+
+        results.extend(await gen.multi([check(x) for x in unknown]))
         return any(results)
 
     async def load_containers(self, collection, container_name, container_url):
-        """Loads's a container of the provided name to the instance."""
-        @retry(on_result=lambda res: not res)
-        def image_loaded(docker, container_name):
-            return docker.has_image(container_name)
+        """Loads's a container of the provided name to the instance.
 
-        def load(instance):
+        Only a few seed instances per region load it from its URL or
+        registry. The others load it from the docker daemon of an
+        instance already holding it, over the private network, so the
+        image spreads in a tree. This requires the instances' security
+        group to allow port 2375 between its members, without which
+        they load it from its URL or registry after all.
+
+        """
+        imported = {}
+
+        if container_url and self.image_cache:
+            try:
+                container_url = await self.image_cache.url_for(container_url)
+            except Exception:
+                logger.error("Couldn't cache %s, loading it from its URL.",
+                             container_url, exc_info=True)
+
+        def load(instance, source=None):
             def debug(msg):
                 logger.debug("[%s] %s" % (instance.instance.id, msg))
 
             docker = instance.state.docker
+            # Remembered by the pool, to reuse instances holding it
+            images = instance.instance.images
 
             has_container = docker.has_image(container_name)
-            if has_container and "latest" not in container_name:
-                return
-
-            if container_url:
-                debug("Importing %s" % container_url)
-                with self.sshclient.connect(instance.instance) as client:
-                    output = docker.import_container(client, container_url)
-                    if output:
-                        logger.debug(output)
-            else:
-                debug("Pulling %r" % container_name)
-                output = docker.pull_container(container_name)
+            if has_container:
+                images.add(container_name)
+                if "latest" not in container_name:
+                    return True
 
-            if not image_loaded(docker, container_name):
+            try:
+                if source is not None:
+                    debug("Importing %s from %s" % (container_name,
+                                                    source.instance.id))
+                    url = "http://%s:2375/images/%s/get" % (
+                        source.instance.private_ip_address,
+                        urllib.parse.quote(container_name))
+                    imported[instance.instance.id] = self._import(
+                        instance, container_name, url)
+                elif container_url:
+                    debug("Importing %s" % container_url)
+                    imported[instance.instance.id] = self._import(
+                        instance, container_name, container_url)
+                else:
+                    debug("Pulling %r" % container_name)
+                    docker.pull_container(container_name)
+                loaded = docker.has_image(container_name, refresh=True)
+            except ImageImportException as exc:
+                debug(str(exc))
+                loaded = False
+
+            if not loaded:
                 debug("Docker does not have %s" % container_name)
+                images.discard(container_name)
+                if source is not None:
+                    return load(instance)
                 return False
-            return output
+            images.add(container_name)
+            return True
+
+        async def load_tree(instances, index, source=None):
+            instance = instances[index]
+            loaded = await collection.execute(load, instance, source)
+            first = FANOUT_SEEDS + index * FANOUT
+            children = range(first, min(first + FANOUT, len(instances)))
+            await gen.multi([
+                load_tree(instances, child, instance if loaded else None)
+                for child in children])
+
+        # Private addresses are only reachable within a region
+        by_region = defaultdict(list)
+        for instance in collection.instances:
+            by_region[instance.instance.region].append(instance)
+        await gen.multi([
+            load_tree(instances, seed)
+            for instances in by_region.values()
+            for seed in range(min(FANOUT_SEEDS, len(instances)))])
+
+        if imported:
+            inst_id, slowest = min(imported.items(),
+                                   key=lambda x: x[1].throughput)
+            logger.info("Imported %s on %d instances, slowest: %s at "
+                        "%.1f MB/s", container_name, len(imported), inst_id,
+                        slowest.throughput / 1e6)
+
+    def _import(self, instance, container_name, url) -> ImportProgress:
+        """Import a container image on an instance, logging the
+        progress and keeping it in the instance state."""
+        if not hasattr(instance.state, "imports"):
+            instance.state.imports = {}
+        logged_at = [time.time()]
+
+        def progress(result):
+            instance.state.imports[container_name] = result
+            if time.time() - logged_at[0] < PROGRESS_INTERVAL:
+                return
+            logged_at[0] = time.time()
+            logger.debug("[%s] %s: %.1f MB, %d layers loaded, %.1f MB/s",
+                         instance.instance.id, container_name,
+                         result.bytes_transferred / 1e6,
+                         result.layers_loaded, result.throughput / 1e6)
 
-        await collection.map(load)
+        with self.sshclient.connect(instance.instance) as client:
+            result = instance.state.docker.import_container(
+                client, url, progress=progress)
+        instance.state.imports[container_name] = result
+        logger.debug("[%s] Imported %s: %.1f MB in %.1fs (%.1f MB/s)",
+                     instance.instance.id, container_name,
+                     result.bytes_transferred / 1e6, result.elapsed,
+                     result.throughput / 1e6)
+        return result
 
     async def run_containers(self,
                              collection: EC2Collection,
@@ -0,0 +1,229 @@
+"""Broker-hosted container image cache
+
+Instances used to download the container images of a step from their
+``container_url`` one by one. The :class:`ImageCache` instead fetches
+every image onto the broker, only again once changed at its URL, stores
+it under the SHA-256 of its content, and hands out the URL it's served
+at by the broker's
+``/images/`` route (with range requests support), so the instances load
+it from there.
+
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.platform.asyncio import to_tornado_future
+
+from loadsbroker import logger
+
+# Seconds a single image download may take
+FETCH_TIMEOUT = 3600
+# Largest image that may be cached, in bytes
+MAX_IMAGE_SIZE = 20 * 1024 ** 3
+# Bytes the stored images may take before the least recently used ones
+# are removed
+MAX_CACHE_SIZE = 100 * 1024 ** 3
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def is_digest(name: str) -> bool:
+    """Indicates whether the name is the digest of a cached image"""
+    return bool(_DIGEST.fullmatch(name))
+
+
+class _Download:
+    """Hashes and writes the chunks of a download in order on a thread
+    of its own, off the IOLoop."""
+    def __init__(self, path):
+        fd, self.tmp = tempfile.mkstemp(dir=path, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._sha = hashlib.sha256()
+        self._error = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def write(self, chunk):
+        self._executor.submit(self._write, chunk)
+
+    def _write(self, chunk):
+        if self._error is not None:
+            return
+        try:
+            self._sha.update(chunk)
+            self._file.write(chunk)
+        except Exception as exc:
+            self._error = exc
+
+    def _close(self):
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+        return self._sha.hexdigest()
+
+    async def close(self):
+        """Wait for the chunks to be written, returning their digest"""
+        try:
+            return await to_tornado_future(self._executor.submit(self._close))
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def discard(self):
+        try:
+            await self.close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+class ImageCache:
+    """Content-addressed store of container images
+
+    Stored images are revalidated with their URL before being reused, so
+    an image uploaded again under the same URL (like a ``latest`` tag)
+    is fetched again. The least recently used images are removed once
+    they take more than ``max_size`` bytes.
+
+    :param path: Directory the images are stored in
+    :param base_url: URL the instances reach the stored images at
+    :param max_size: Bytes the stored images may take
+
+    """
+    def __init__(self, path: str, base_url: str,
+                 max_size: int = MAX_CACHE_SIZE) -> None:
+        self.path = path
+        self.base_url = base_url.rstrip("/")
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+        self._index_file = os.path.join(path, "index.json")
+        self._index = self._load_index()  # type: dict
+        self._fetches = {}
+
+    def _load_index(self):
+        """Load the stored images, keyed by their URL"""
+        try:
+            with open(self._index_file) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(index, dict):
+            return {}
+        return {url: entry for url, entry in index.items()
+                if isinstance(entry, dict) and
+                is_digest(entry.get("digest", ""))}
+
+    def _save_index(self):
+        tmp = self._index_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_file)
+
+    def _blob(self, digest: str) -> str:
+        return os.path.join(self.path, digest)
+
+    async def url_for(self, container_url: str) -> str:
+        """Return the URL the instances should load an image from,
+        fetching it into the cache first if needed."""
+        digest = await self.fetch(container_url)
+        return "%s/%s" % (self.base_url, digest)
+
+    async def fetch(self, container_url: str) -> str:
+        """Store an image unless already stored and unchanged at its
+        URL, returning its digest.
+
+        Concurrent fetches of the same URL share a single request.
+
+        """
+        if container_url not in self._fetches:
+            future = gen.convert_yielded(self._fetch(container_url))
+            self._fetches[container_url] = future
+            future.add_done_callback(
+                lambda _: self._fetches.pop(container_url, None))
+        return await self._fetches[container_url]
+
+    async def _fetch(self, container_url):
+        entry = self._index.get(container_url)
+        if entry and not os.path.exists(self._blob(entry["digest"])):
+            entry = None
+
+        # Without validators, the stored image can't be trusted to still
+        # be the one at the URL
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        logger.debug("Caching image %s", container_url)
+        download = _Download(self.path)
+        client = AsyncHTTPClient(force_instance=True,
+                                 max_body_size=MAX_IMAGE_SIZE)
+        try:
+            try:
+                response = await client.fetch(
+                    container_url, headers=headers,
+                    streaming_callback=download.write,
+                    request_timeout=FETCH_TIMEOUT)
+            finally:
+                client.close()
+            digest = await download.close()
+            os.replace(download.tmp, self._blob(digest))
+        except Exception as exc:
+            await download.discard()
+            if entry is None:
+                raise
+            if not (isinstance(exc, HTTPError) and exc.code == 304):
+                logger.warning("Couldn't revalidate %s, using the stored "
+                               "image.", container_url, exc_info=True)
+            entry["used_at"] = time.time()
+            self._save_index()
+            return entry["digest"]
+
+        self._index[container_url] = {
+            "digest": digest,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "used_at": time.time(),
+        }
+        self._evict(keep=digest)
+        self._save_index()
+        logger.debug("Cached image %s as %s", container_url, digest)
+        return digest
+
+    def _evict(self, keep):
+        """Remove the images no URL is stored as anymore, then the least
+        recently used ones until they fit in :attr:`max_size`, except
+        for the ``keep`` digest."""
+        used_at = {}
+        for entry in self._index.values():
+            digest = entry["digest"]
+            used_at[digest] = max(used_at.get(digest, 0),
+                                  entry.get("used_at", 0))
+
+        sizes = {}
+        for name in os.listdir(self.path):
+            if not is_digest(name):
+                continue
+            if name not in used_at:
+                os.remove(self._blob(name))
+                continue
+            sizes[name] = os.path.getsize(self._blob(name))
+
+        total = sum(sizes.values())
+        for digest in sorted(sizes, key=used_at.get):
+            if total <= self.max_size:
+                break
+            if digest == keep:
+                continue
+            logger.debug("Evicting cached image %s", digest)
+            os.remove(self._blob(digest))
+            total -= sizes[digest]
+            self._index = {url: entry for url, entry in self._index.items()
+                           if entry["digest"] != digest}
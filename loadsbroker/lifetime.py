@@ -51,6 +51,7 @@ class StepRecordLink:
     step_record = attrib()  # type: db.StepRecord
     ec2_collection = attrib()  # type: EC2Collection
     state_description = attrib(default="")  # type: str
+    ready = attrib(default=False)  # type: bool
 
     base_containers = [DNSMASQ_INFO, WATCHER_INFO]
 
@@ -60,6 +61,13 @@ class StepRecordLink:
         await self.ec2_collection.wait_for_running()
         await self._start_docker(docker)
 
+    async def reattach(self, docker, influxdb_options):
+        """Reconnect to the docker daemons of a step already started by
+        a previous broker"""
+        self.state_description = "Reattaching to docker"
+        await docker.setup_collection(self.ec2_collection)
+        await docker.wait(self.ec2_collection, timeout=360)
+
     async def _start_docker(self, docker):
         self.state_description = "Waiting for docker"
         await docker.setup_collection(self.ec2_collection)
@@ -165,6 +173,17 @@ class StepRecordLink:
             if capture_stream:
                 capture_stream.close()
 
+    def is_due(self) -> bool:
+        """Determine if finished or due for termination, without
+        checking the containers"""
+        # If we haven't been started, we can't be done
+        if not self.step_record.started_at:
+            return False
+
+        if self.ec2_collection.finished:
+            return True
+        return self.step_record.should_stop()
+
     async def is_done(self, docker) -> bool:
         """Determine if finished or pending termination"""
         # If we haven't been started, we can't be done
@@ -175,6 +194,10 @@ class StepRecordLink:
         if self.ec2_collection.finished:
             return True
 
+        # Drop the spot instances being reclaimed
+        if self.step.spot_price is not None:
+            await self.ec2_collection.check_spot_interruptions()
+
         run = self.step_record.run
         container_name = run.interpolate(
             self.step.container_name, self.step.environment_data)
@@ -258,6 +281,10 @@ class MonitorStepRecordLink(StepRecordLink):
             self.step_record.run.uuid,
             influxdb_options)
 
+    async def reattach(self, docker, influxdb_options):
+        self.influxdb_options = influxdb_options
+        await super().reattach(docker, influxdb_options)
+
     async def stop(self, helpers):
         await helpers.grafana.stop(self.ec2_collection, helpers.docker)
         await helpers.influxdb.stop(
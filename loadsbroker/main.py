@@ -4,13 +4,26 @@ import argparse
 import os
 
 import tornado.ioloop
+from sqlalchemy.engine.url import make_url
 
+from loadsbroker.aws import AMI_CATALOG_TTL, COLLECTION_THREADS
 from loadsbroker.util import set_logger
-from loadsbroker.broker import Broker
+from loadsbroker.broker import CHECK_INTERVAL, MAX_CONCURRENT_CHECKS, Broker
+from loadsbroker.dockerctrl import WATCHER_THREADS
 from loadsbroker.webapp import application
 from loadsbroker import logger
 
 
+def _warm_pool_entry(value):
+    """Parses a REGION:INSTANCE_TYPE:COUNT warm pool target"""
+    try:
+        region, inst_type, count = value.split(':')
+        return (region, inst_type), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "%r isn't of the form REGION:INSTANCE_TYPE:COUNT" % value)
+
+
 def _parse(sysargs=None):
     if sysargs is None:
         sysargs = sys.argv[1:]
@@ -32,6 +45,41 @@ def _parse(sysargs=None):
                         default="595879546273")
     parser.add_argument('--aws-skip-filters', help='Use AWS filters',
                         action='store_true', default=False)
+    parser.add_argument('--ami-cache', help="AMI catalog cache file, "
+                        "defaults to next to a sqlite database", type=str,
+                        default=None)
+    parser.add_argument('--ami-cache-ttl', help="Seconds before the cached "
+                        "AMI catalog is refreshed", type=int,
+                        default=AMI_CATALOG_TTL)
+    parser.add_argument('--max-idle', help="Seconds an idle instance is "
+                        "kept before being terminated", type=int,
+                        default=600)
+    parser.add_argument('--min-idle', help="Idle instances always kept per "
+                        "region and instance type", type=int, default=0)
+    parser.add_argument('--warm-pool', help="Idle instances kept ready, "
+                        "as REGION:INSTANCE_TYPE:COUNT (repeatable)",
+                        type=_warm_pool_entry, action='append', default=[])
+    parser.add_argument('--collection-threads', help="Threads shared by "
+                        "all the instance collections", type=int,
+                        default=COLLECTION_THREADS)
+    parser.add_argument('--check-interval', help="Seconds between checks "
+                        "of the containers of running steps", type=int,
+                        default=CHECK_INTERVAL)
+    parser.add_argument('--max-concurrent-checks', help="Most "
+                        "instances whose containers are checked at once "
+                        "across all runs",
+                        type=int, default=MAX_CONCURRENT_CHECKS)
+    parser.add_argument('--watcher-threads', help="Most instances whose "
+                        "docker events are watched at once, the containers "
+                        "of the others are listed at every check", type=int,
+                        default=WATCHER_THREADS)
+    parser.add_argument('--image-cache-dir', help="Directory container "
+                        "images are cached in for the instances, requires "
+                        "--image-cache-url", type=str, default=None)
+    parser.add_argument('--image-cache-url', help="URL the instances reach "
+                        "this broker's /images route at, e.g. "
+                        "http://broker.example.com:8080/images, requires "
+                        "--image-cache-dir", type=str, default=None)
     # XXX: deprecate
     parser.add_argument('--no-influx', help='Deactivate Influx.',
                         action='store_true', default=False)
@@ -39,9 +87,22 @@ def _parse(sysargs=None):
                         type=str, default=os.path.join(
                             os.path.dirname(__file__), '..', 'pushgo.json'))
     args = parser.parse_args(sysargs)
+    if bool(args.image_cache_dir) != bool(args.image_cache_url):
+        parser.error("--image-cache-dir and --image-cache-url must be "
+                     "given together")
     return args, parser
 
 
+def _default_ami_cache(database):
+    """Returns the AMI catalog path next to a sqlite database file"""
+    url = make_url(database)
+    if not url.drivername.startswith('sqlite'):
+        return None
+    if not url.database or url.database == ':memory:':
+        return None
+    return os.path.splitext(url.database)[0] + '-amis.json'
+
+
 def main(sysargs=None):
     """Parses arguments and starts up the loads-broker.
 
@@ -60,6 +121,7 @@ def main(sysargs=None):
     aws_owner_id = args.aws_owner_id and args.aws_owner_id or None
     aws_access_key = os.environ.get('AWS_ACCESS_KEY_ID')
     aws_secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    ami_cache = args.ami_cache or _default_ami_cache(args.database)
 
     application.broker = Broker(args.name, loop, args.database, args.ssh_key,
                                 aws_port=args.aws_port,
@@ -67,7 +129,19 @@ def main(sysargs=None):
                                 aws_use_filters=not args.aws_skip_filters,
                                 aws_access_key=aws_access_key,
                                 aws_secret_key=aws_secret_key,
-                                initial_db=args.initial_db)
+                                initial_db=args.initial_db,
+                                ami_cache=ami_cache,
+                                ami_cache_ttl=args.ami_cache_ttl,
+                                max_idle=args.max_idle,
+                                min_idle=args.min_idle,
+                                warm_pool=dict(args.warm_pool),
+                                collection_threads=args.collection_threads,
+                                check_interval=args.check_interval,
+                                max_concurrent_checks=(
+                                    args.max_concurrent_checks),
+                                watcher_threads=args.watcher_threads,
+                                image_cache_dir=args.image_cache_dir,
+                                image_cache_url=args.image_cache_url)
 
     logger.info('Listening on port %d...' % args.port)
     application.listen(args.port)
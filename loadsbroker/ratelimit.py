@@ -0,0 +1,176 @@
+"""Rate limiting of EC2 API calls
+
+AWS throttles EC2 API calls per account and region, with separate
+token buckets for the different classes of actions. Every call made by
+an :class:`~loadsbroker.aws.EC2Pool` and its collections goes through a
+shared :class:`RateLimiter` mirroring those buckets, so a large run
+queues its calls instead of tripping ``RequestLimitExceeded`` for
+everything at once.
+
+When AWS throttles a call anyway, the bucket's rate is cut in half and
+all its calls are paused for a jittered exponential backoff. The rate
+then recovers additively with every successful call.
+
+"""
+import random
+import time
+from collections import defaultdict
+
+from tornado import gen
+import tornado.ioloop
+
+from loadsbroker import logger
+
+
+# API classes, throttled independently by AWS
+DESCRIBE = "describe"
+MUTATE = "mutate"
+RUN = "run"
+
+# Refill rate (calls per second) and burst of each API class
+API_LIMITS = {
+    DESCRIBE: (20, 100),
+    MUTATE: (5, 200),
+    RUN: (2, 50),
+}
+
+THROTTLING_CODES = frozenset([
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+])
+
+
+def is_throttling(exc):
+    """Returns True if the exception is AWS throttling a call."""
+    return getattr(exc, "error_code", None) in THROTTLING_CODES
+
+
+class TokenBucket:
+    """A token bucket with an adaptive refill rate.
+
+    Tokens are reserved ahead of time, callers wait until the tokens
+    they reserved have been refilled.
+
+    """
+    def __init__(self, rate, burst, min_rate=None, clock=time.time):
+        self.max_rate = self.rate = rate
+        self.min_rate = min_rate or rate / 20
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._paused_until = 0
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def reserve(self, cost=1):
+        """Reserve tokens, returning how many seconds to wait before
+        using them."""
+        now = self._clock()
+        self._refill(now)
+        self._tokens -= cost
+        return max(0, -self._tokens / self.rate, self._paused_until - now)
+
+    def throttled(self, pause):
+        """Halve the rate and pause the bucket for ``pause`` seconds."""
+        now = self._clock()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0)
+        self._paused_until = max(self._paused_until, now + pause)
+
+    def succeeded(self):
+        """Recover the rate a little after a successful call."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """Rate limits calls per region and API class.
+
+    :param limits: Maps API classes to their ``(rate, burst)``
+    :param retries: How many times a throttled call is retried
+    :param backoff: Base backoff in seconds after a throttled call,
+        doubled with every retry up to ``max_backoff``
+
+    """
+    def __init__(self, io_loop=None, limits=None, retries=5, backoff=1,
+                 max_backoff=30):
+        self.limits = dict(API_LIMITS, **(limits or {}))
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self._buckets = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def bucket(self, region, api_class):
+        """Returns the token bucket of a region and API class."""
+        key = region, api_class
+        if key not in self._buckets:
+            rate, burst = self.limits[api_class]
+            self._buckets[key] = TokenBucket(rate, burst)
+        return self._buckets[key]
+
+    async def call(self, region, api_class, run, cost=1):
+        """Call ``run`` once the bucket allows, retrying it while AWS
+        throttles it.
+
+        :param run: Callable returning a future of the API call
+        :param cost: Number of API calls ``run`` makes
+
+        """
+        bucket = self.bucket(region, api_class)
+        stats = self._stats[region, api_class]
+        attempt = 0
+        while True:
+            delay = bucket.reserve(cost)
+            if delay > 0:
+                stats["queued"] += 1
+                stats["delayed"] += 1
+                try:
+                    await gen.Task(self._loop.add_timeout,
+                                   time.time() + delay)
+                finally:
+                    stats["queued"] -= 1
+
+            stats["calls"] += cost
+            try:
+                result = await run()
+            except Exception as exc:
+                if not is_throttling(exc) or attempt >= self.retries:
+                    raise
+                stats["throttled"] += 1
+                pause = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                bucket.throttled(pause)
+                logger.debug("Throttled %s call in %s, backing off %.1fs.",
+                             api_class, region, pause)
+                attempt += 1
+            else:
+                bucket.succeeded()
+                return result
+
+    def metrics(self):
+        """Returns the call counters and current rate per region and API
+        class.
+
+        ``queued`` is the number of calls currently waiting on the
+        bucket, ``delayed`` and ``throttled`` count the calls that
+        waited, and the calls AWS throttled.
+
+        """
+        metrics = defaultdict(dict)
+        for (region, api_class), bucket in self._buckets.items():
+            stats = self._stats[region, api_class]
+            metrics[region][api_class] = dict(
+                calls=stats["calls"],
+                queued=stats["queued"],
+                delayed=stats["delayed"],
+                throttled=stats["throttled"],
+                rate=bucket.rate,
+            )
+        return dict(metrics)
@@ -30,3 +30,33 @@ class DatabaseTest(unittest.TestCase):
         plan.steps.append(cset)
 
         session.commit()
+
+    def test_step_allocation_lists(self):
+        step = Step.from_json(
+            name="Awesome load-tester",
+            instance_type="c4.large",
+            instance_min_count=50,
+            instance_fallback_types=["c4.xlarge", "m4.large"],
+            instance_zones="us-west-2a, us-west-2b")
+        self.assertEqual(step.instance_fallback_types, "c4.xlarge,m4.large")
+        self.assertEqual(step.fallback_types, ["c4.xlarge", "m4.large"])
+        self.assertEqual(step.zones, ["us-west-2a", "us-west-2b"])
+        self.assertEqual(Step().zones, [])
+
+    def test_step_regions(self):
+        from loadsbroker.exceptions import LoadsException
+        step = Step.from_json(
+            name="Awesome load-tester",
+            instance_regions=["us-west-2:3", "us-east-1"])
+        self.assertEqual(step.instance_regions, "us-west-2:3,us-east-1")
+        self.assertEqual(step.regions, [("us-west-2", 3), ("us-east-1", 1)])
+
+        step = Step.from_json(instance_regions={"eu-west-1": 2})
+        self.assertEqual(step.regions, [("eu-west-1", 2)])
+        self.assertEqual(Step(instance_region="us-east-1").regions,
+                         [("us-east-1", 1)])
+
+        self.assertRaises(LoadsException, Step.from_json,
+                          instance_regions=["us-west-2:0"])
+        self.assertRaises(LoadsException, Step.from_json,
+                          instance_regions=["moon-1"])
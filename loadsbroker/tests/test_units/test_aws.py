@@ -1,11 +1,19 @@
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from datetime import datetime, timedelta
 
+from tornado import gen
 from tornado.testing import AsyncTestCase, gen_test
+from mock import Mock, patch
 from moto import mock_ec2
 import boto
 
 from freezegun import freeze_time
+from loadsbroker.aws import AWS_REGIONS
 from loadsbroker.tests.util import (clear_boto_context, load_boto_context,
                                     create_image)
 
@@ -30,6 +38,10 @@ def nuke_backend():
         backend.reset()
 
 
+def ids(instances):
+    return [x.id for x in instances]
+
+
 class Test_populate_ami_ids(unittest.TestCase):
     def setUp(self):
         # Nuke the backend
@@ -87,7 +99,7 @@ class Test_get_ami(unittest.TestCase):
         image_id = conn.create_image(instance.id, "CoreOS stable")
         img = conn.get_all_images()[0]
 
-        loadsbroker.aws.AWS_AMI_IDS[first_region] = {"paravirtual": img}
+        loadsbroker.aws.AWS_AMI_IDS[first_region] = {"paravirtual": img.id}
 
         ami_id = loadsbroker.aws.get_ami(first_region, "m1.small")
         self.assertEqual(ami_id, image_id)
@@ -99,6 +111,85 @@ class Test_get_ami(unittest.TestCase):
                           "m1.small")
 
 
+class Test_ami_catalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "amis.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        import loadsbroker.aws
+        loadsbroker.aws.AWS_AMI_IDS = {k: {} for k in
+                                       loadsbroker.aws.AWS_REGIONS}
+
+    def _makeOne(self, ttl=60):
+        from loadsbroker.aws import AMICatalog
+        return AMICatalog(self.path, ttl)
+
+    def test_missing_catalog(self):
+        catalog = self._makeOne()
+        self.assertEqual(catalog.load(), [])
+        self.assertIsNone(catalog.fetched_at("us-west-2"))
+        self.assertEqual(catalog.expires_in("us-west-2"), 0)
+
+    def test_round_trip(self):
+        import loadsbroker.aws
+        catalog = self._makeOne()
+        loadsbroker.aws.AWS_AMI_IDS["us-west-2"] = {"hvm": "ami-1234abcd"}
+        catalog.update("us-west-2")
+        catalog.save()
+
+        loadsbroker.aws.AWS_AMI_IDS["us-west-2"] = {}
+        catalog = self._makeOne()
+        self.assertEqual(catalog.load(), ["us-west-2"])
+        self.assertEqual(loadsbroker.aws.AWS_AMI_IDS["us-west-2"],
+                         {"hvm": "ami-1234abcd"})
+        self.assertEqual(loadsbroker.aws.get_ami("us-west-2", "c4.large"),
+                         "ami-1234abcd")
+        self.assertTrue(0 < catalog.expires_in("us-west-2") <= 60)
+
+    def test_expired(self):
+        with open(self.path, "w") as f:
+            json.dump({"us-west-2": {"fetched_at": time.time() - 120,
+                                     "images": {"hvm": "ami-1234abcd"}}}, f)
+        catalog = self._makeOne()
+        catalog.load()
+        self.assertEqual(catalog.expires_in("us-west-2"), 0)
+
+    def test_malformed_entries(self):
+        with open(self.path, "w") as f:
+            json.dump({"us-west-2": {"images": {"hvm": "ami-1234abcd"}},
+                       "us-east-1": {"fetched_at": "soon", "images": {}},
+                       "eu-west-1": None,
+                       "us-west-1": {"fetched_at": time.time(),
+                                     "images": {"hvm": "ami-5678"}}},
+                      f)
+        catalog = self._makeOne()
+        self.assertEqual(catalog.load(), ["us-west-1"])
+
+    def test_stale_snapshot_skipped(self):
+        import loadsbroker.aws
+        catalog = self._makeOne()
+        loadsbroker.aws.AWS_AMI_IDS["us-west-2"] = {"hvm": "ami-old"}
+        catalog.update("us-west-2")
+        old = catalog.snapshot()
+        loadsbroker.aws.AWS_AMI_IDS["us-west-2"] = {"hvm": "ami-new"}
+        catalog.save(catalog.snapshot())
+        catalog.save(old)
+
+        with open(self.path) as f:
+            saved = json.load(f)
+        self.assertEqual(saved["us-west-2"]["images"], {"hvm": "ami-new"})
+        self.assertEqual(os.listdir(self.tmpdir), ["amis.json"])
+
+    def test_save_failure_logged(self):
+        catalog = self._makeOne()
+        catalog.path = os.path.join(self.tmpdir, "missing", "amis.json")
+        catalog.update("us-west-2")
+        catalog.save()
+        self.assertFalse(os.path.exists(catalog.path))
+
+
 class Test_available_instance(unittest.TestCase):
     def setUp(self):
         # Nuke the backend
@@ -138,15 +229,217 @@ class Test_available_instance(unittest.TestCase):
             self.assertFalse(self._callFUT(instance))
 
 
+class Test_instance_record(unittest.TestCase):
+    def setUp(self):
+        # Nuke the backend
+        nuke_backend()
+
+    def test_from_instance(self):
+        from loadsbroker.aws import InstanceRecord
+        conn = boto.connect_ec2()
+        instance = conn.run_instances("ami-1234abcd",
+                                      instance_type="m1.large").instances[0]
+        conn.create_tags([instance.id], {"RunId": "run_12", "Other": "x"})
+        instance.update()
+
+        record = InstanceRecord.from_instance(instance)
+        self.assertEqual(record.id, instance.id)
+        self.assertEqual(record.region, "us-east-1")
+        self.assertEqual(record.instance_type, "m1.large")
+        self.assertEqual(record.state, instance.state)
+        self.assertEqual(record.tags, {"RunId": "run_12"})
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def test_rehydrate(self):
+        from loadsbroker.aws import InstanceRecord
+        conn = boto.connect_ec2()
+        instance = conn.run_instances("ami-1234abcd").instances[0]
+        record = InstanceRecord.from_instance(instance)
+        conn.start_instances([instance.id])
+
+        rehydrated = record.rehydrate(conn)
+        self.assertEqual(rehydrated.id, record.id)
+        self.assertEqual(rehydrated.state, "running")
+
+
+class Test_idle_instances(unittest.TestCase):
+    def setUp(self):
+        # Nuke the backend
+        nuke_backend()
+
+    def _makeOne(self):
+        from loadsbroker.aws import IdleInstances
+        return IdleInstances()
+
+    def test_take_by_type(self):
+        conn = boto.connect_ec2()
+        small = conn.run_instances("ami-1234abcd", 3,
+                                   instance_type="m1.small").instances
+        large = conn.run_instances("ami-1234abcd", 2,
+                                   instance_type="m1.large").instances
+        idle = self._makeOne()
+        for inst in small + large:
+            idle.add("us-west-2", inst)
+
+        self.assertEqual(len(idle), 5)
+        self.assertEqual(idle.counts(),
+                         {"us-west-2": {"m1.small": 3, "m1.large": 2}})
+
+        taken = idle.take("us-west-2", "m1.large", 5)
+        self.assertEqual(ids(taken), ids(large))
+        self.assertEqual(idle.take("us-east-1", "m1.small", 1), [])
+        self.assertEqual(ids(idle.take("us-west-2", "m1.small", 2)),
+                         ids(small[:2]))
+        self.assertEqual(idle.count("us-west-2"), 1)
+        self.assertEqual(idle.count("us-west-2", "m1.large"), 0)
+
+    def test_take_prefers_image(self):
+        from loadsbroker.aws import InstanceRecord
+        conn = boto.connect_ec2()
+        instances = [InstanceRecord.from_instance(x) for x in
+                     conn.run_instances("ami-1234abcd", 4).instances]
+        instances[2].images.add("bbangert/simpletest:dev")
+        idle = self._makeOne()
+        for inst in instances:
+            idle.add("us-west-2", inst)
+
+        taken = idle.take("us-west-2", "m1.small", 2,
+                          image="bbangert/simpletest:dev")
+        self.assertEqual(ids(taken), ids([instances[2], instances[0]]))
+        self.assertEqual(ids(idle.take("us-west-2", "m1.small", 2,
+                                       image="bbangert/simpletest:dev")),
+                         ids([instances[1], instances[3]]))
+
+        # The image index only holds instances still in the pool
+        self.assertEqual(idle._images, {})
+
+    def test_image_index_follows_expiry(self):
+        from loadsbroker.aws import InstanceRecord
+        conn = boto.connect_ec2()
+        instances = [InstanceRecord.from_instance(x) for x in
+                     conn.run_instances("ami-1234abcd", 2).instances]
+        for inst in instances:
+            inst.images.add("bbangert/simpletest:dev")
+        idle = self._makeOne()
+        with freeze_time("2012-01-14 03:21:34"):
+            idle.add("us-west-2", instances[0])
+        with freeze_time("2012-01-14 03:30:34"):
+            idle.add("us-west-2", instances[1])
+            idle.pop_expired(300)
+
+        taken = idle.take("us-west-2", "m1.small", 2,
+                          image="bbangert/simpletest:dev")
+        self.assertEqual(ids(taken), ids(instances[1:]))
+
+    def test_stalled_instances_set_aside(self):
+        with freeze_time("2012-01-14 03:21:34"):
+            conn = boto.connect_ec2()
+            instances = conn.run_instances("ami-1234abcd", 2).instances
+            idle = self._makeOne()
+            for inst in instances:
+                idle.add("us-west-2", inst)
+
+        with freeze_time("2012-01-14 03:24:34"):
+            self.assertEqual(idle.take("us-west-2", "m1.small", 2), [])
+
+        self.assertEqual(idle.counts(), {"us-west-2": {"unusable": 2}})
+        expired = idle.pop_expired(600)
+        self.assertEqual(ids(expired["us-west-2"]), ids(instances))
+        self.assertEqual(len(idle), 0)
+
+    def test_pop_expired(self):
+        conn = boto.connect_ec2()
+        instances = conn.run_instances("ami-1234abcd", 4).instances
+        idle = self._makeOne()
+        with freeze_time("2012-01-14 03:21:34"):
+            for inst in instances[:3]:
+                idle.add("us-west-2", inst)
+        with freeze_time("2012-01-14 03:30:34"):
+            idle.add("us-west-2", instances[3])
+            expired = idle.pop_expired(300, keep=2)
+
+        self.assertEqual(list(expired), ["us-west-2"])
+        self.assertEqual(ids(expired["us-west-2"]), ids(instances[:2]))
+        self.assertEqual(idle.count("us-west-2"), 2)
+
+    def test_pop_all(self):
+        with freeze_time("2012-01-14 03:21:34"):
+            conn = boto.connect_ec2()
+            instances = conn.run_instances("ami-1234abcd", 2).instances
+            idle = self._makeOne()
+            for inst in instances:
+                idle.add("us-west-2", inst)
+
+        with freeze_time("2012-01-14 03:24:34"):
+            self.assertEqual(idle.take("us-west-2", "m1.small", 2), [])
+        self.assertEqual(ids(idle.pop_all()["us-west-2"]), ids(instances))
+        self.assertEqual(len(idle), 0)
+
+
+class Test_instance_inventory(AsyncTestCase):
+    def _makeOne(self, **kwargs):
+        from loadsbroker.aws import InstanceInventory
+        self.fetches = []
+        self.delay = 0
+
+        async def fetch(region):
+            self.fetches.append(region)
+            await gen.sleep(self.delay)
+            return [region + "-%d" % len(self.fetches)]
+
+        return InstanceInventory(fetch, **kwargs)
+
+    @gen_test
+    async def test_cached_listing(self):
+        inventory = self._makeOne()
+        self.assertEqual(await inventory.get("us-west-2"), ["us-west-2-1"])
+        self.assertEqual(await inventory.get("us-west-2"), ["us-west-2-1"])
+        self.assertEqual(self.fetches, ["us-west-2"])
+
+    @gen_test
+    async def test_expired_listing(self):
+        inventory = self._makeOne(ttl=0)
+        await inventory.get("us-west-2")
+        self.assertEqual(await inventory.get("us-west-2"), ["us-west-2-2"])
+        self.assertEqual(len(self.fetches), 2)
+
+    @gen_test
+    async def test_coalesced_fetches(self):
+        inventory = self._makeOne()
+        listings = await gen.multi([inventory.get_all() for _ in range(3)])
+        self.assertEqual(len(self.fetches), len(AWS_REGIONS))
+        self.assertEqual(listings[0], listings[2])
+
+    @gen_test
+    async def test_invalidate(self):
+        inventory = self._makeOne()
+        await inventory.get("us-west-2")
+        await inventory.get("us-east-1")
+        inventory.invalidate("us-west-2")
+        self.assertEqual(await inventory.get("us-west-2"), ["us-west-2-3"])
+        self.assertEqual(await inventory.get("us-east-1"), ["us-east-1-2"])
+
+    @gen_test
+    async def test_invalidate_discards_fetch_in_progress(self):
+        inventory = self._makeOne()
+        self.delay = 0.05
+        stale = gen.convert_yielded(inventory.get("us-west-2"))
+        await gen.moment
+        inventory.invalidate()
+        self.assertEqual(await stale, ["us-west-2-1"])
+        self.assertEqual(await inventory.get("us-west-2"), ["us-west-2-2"])
+
+
 class Test_ec2_collection(AsyncTestCase):
     def setUp(self):
         super().setUp()
         # Nuke the backend
         nuke_backend()
 
-    def _callFUT(self, run_id, uuid, conn, instances):
+    def _callFUT(self, run_id, uuid, conn, instances, **kwargs):
         from loadsbroker.aws import EC2Collection
-        return EC2Collection(run_id, uuid, conn, instances, self.io_loop)
+        return EC2Collection(run_id, uuid, conn, instances, self.io_loop,
+                             **kwargs)
 
     def test_collection_creation(self):
         # Get some instances
@@ -155,22 +448,85 @@ class Test_ec2_collection(AsyncTestCase):
         coll = self._callFUT("a", "b", conn, reservation.instances)
         self.assertEqual(len(coll.instances), len(reservation.instances))
 
+    @gen_test
+    async def test_concurrency_cap(self):
+        import concurrent.futures
+        import threading
+        executor = concurrent.futures.ThreadPoolExecutor(10)
+        self.addCleanup(executor.shutdown)
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 5)
+        coll = self._callFUT("a", "b", conn, reservation.instances,
+                             executor=executor, max_concurrency=2)
+
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def call(inst):
+            with lock:
+                running.append(inst)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(inst)
+
+        await coll.map(call)
+        self.assertEqual(len(peak), 5)
+        self.assertEqual(max(peak), 2)
+
+        # A shared executor outlives the collection
+        coll.close()
+        self.assertFalse(executor._shutdown)
+
+    def test_close_owned_executor(self):
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 5)
+        coll = self._callFUT("a", "b", conn, reservation.instances)
+        coll.close()
+        self.assertTrue(coll._executor._shutdown)
+
+    @gen_test
+    async def test_spot_interruptions(self):
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 3)
+        conn.start_instances([x.id for x in reservation.instances])
+        coll = self._callFUT("a", "b", conn, reservation.instances)
+        await coll.wait_for_running()
+        instances = [x.instance for x in coll.instances]
+        instances[0].spot_instance_request_id = "sir-1"
+        instances[1].spot_instance_request_id = "sir-2"
+
+        requests = [
+            Mock(id="sir-1", instance_id=instances[0].id,
+                 status=Mock(code="fulfilled")),
+            Mock(id="sir-2", instance_id=instances[1].id,
+                 status=Mock(code="marked-for-termination")),
+        ]
+        with patch.object(conn, "get_all_spot_instance_requests",
+                          return_value=requests) as describe:
+            await coll.check_spot_interruptions()
+        describe.assert_called_once_with(request_ids=["sir-1", "sir-2"])
+        self.assertEqual([x.instance for x in coll.instances],
+                         [instances[0], instances[2]])
+
     def test_instance_status_checks(self):
         conn = boto.connect_ec2()
         reservation = conn.run_instances("ami-1234abcd", 5)
         coll = self._callFUT("a", "b", conn, reservation.instances)
         self.assertEqual(len(coll.instances), len(coll.pending_instances()))
 
+        from loadsbroker.aws import update_instances
+        records = [x.instance for x in coll.instances]
+
         # Now with running instances
-        for inst in coll.instances:
-            inst.instance.start()
-            inst.instance.update()
+        conn.start_instances(ids(records))
+        update_instances(conn, records)
         self.assertEqual(len(coll.instances), len(coll.running_instances()))
 
         # Now the stopped instances
-        for inst in coll.instances:
-            inst.instance.stop()
-            inst.instance.update()
+        conn.stop_instances(ids(records))
+        update_instances(conn, records)
         self.assertEqual(len(coll.instances), len(coll.dead_instances()))
 
     @gen_test
@@ -195,13 +551,70 @@ class Test_ec2_collection(AsyncTestCase):
 
         for inst in coll.instances:
             self.assertEqual(inst.instance.state, "pending")
-        for inst in coll.instances:
-            inst.instance.start()
-            inst.instance.update()
+        conn.start_instances(ids(reservation.instances))
         await coll.wait_for_running()
         for inst in coll.instances:
             self.assertEqual(inst.instance.state, "running")
 
+    @gen_test
+    async def test_instance_waiting_batches_updates(self):
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 5)
+        coll = self._callFUT("a", "b", conn, reservation.instances)
+        conn.start_instances([x.id for x in reservation.instances])
+
+        with patch.object(conn, "get_only_instances",
+                          wraps=conn.get_only_instances) as describe:
+            await coll.wait_for_running()
+        self.assertEqual(describe.call_count, 1)
+        self.assertEqual(len(coll.running_instances()), 5)
+
+
+class Test_update_instances(unittest.TestCase):
+    def setUp(self):
+        # Nuke the backend
+        nuke_backend()
+
+    def test_batches(self):
+        from loadsbroker.aws import InstanceRecord, update_instances
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 5)
+        instances = [InstanceRecord.from_instance(x)
+                     for x in reservation.instances]
+        conn.start_instances([x.id for x in instances])
+
+        with patch.object(conn, "get_only_instances",
+                          wraps=conn.get_only_instances) as describe:
+            update_instances(conn, instances, batch_size=2)
+        self.assertEqual(describe.call_count, 3)
+        self.assertEqual({x.state for x in instances}, {"running"})
+
+    def test_missing_instance(self):
+        from loadsbroker.aws import InstanceRecord, update_instances
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 4)
+        instances = [InstanceRecord.from_instance(x)
+                     for x in reservation.instances]
+        conn.start_instances([x.id for x in instances])
+
+        # An instance AWS doesn't know of only leaves itself stale
+        instances[0].id = "i-0123abcd"
+        update_instances(conn, instances, batch_size=10)
+        self.assertEqual(instances[0].state, "pending")
+        self.assertEqual({x.state for x in instances[1:]}, {"running"})
+
+
+class Test_split_count(unittest.TestCase):
+    def _callFUT(self, count, weights):
+        from loadsbroker.aws import split_count
+        return split_count(count, weights)
+
+    def test_split(self):
+        self.assertEqual(self._callFUT(10, [1, 1]), [5, 5])
+        self.assertEqual(self._callFUT(10, [2, 1]), [7, 3])
+        self.assertEqual(self._callFUT(2, [1, 1, 1]), [1, 1, 0])
+        self.assertEqual(self._callFUT(0, [3, 1]), [0, 0])
+
 
 class Test_ec2_pool(AsyncTestCase):
     def setUp(self):
@@ -219,10 +632,49 @@ class Test_ec2_pool(AsyncTestCase):
     async def test_empty_pool(self):
         pool = self._callFUT("br12")
         # Wait for initialization to finish
-        await pool.ready
+        await pool.wait_ready()
         self.assertEqual(pool._recovered, {})
-        for _, val in pool._instances.items():
-            self.assertEqual(val, [])
+        self.assertEqual(len(pool._instances), 0)
+
+    @gen_test
+    async def test_request_waits_for_region(self):
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+
+        pool = self._callFUT("br12")
+        # Regions initialize in the background
+        self.assertEqual(set(pool.ready), set(AWS_REGIONS))
+        self.assertFalse(pool.ready[region].done())
+
+        # Requests for the region are queued until it's ready
+        coll = await pool.request_instances("run_12", "12423", 2,
+                                            inst_type="m1.small",
+                                            region=region)
+        self.assertTrue(pool.ready[region].done())
+        self.assertEqual(len(coll.instances), 2)
+
+    @gen_test
+    async def test_cached_amis(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "amis.json")
+        with open(path, "w") as f:
+            json.dump({region: {"fetched_at": time.time(),
+                                "images": {"hvm": "ami-1234abcd"}}
+                       for region in AWS_REGIONS}, f)
+
+        import loadsbroker.aws
+        self.addCleanup(setattr, loadsbroker.aws, "AWS_AMI_IDS",
+                        {k: {} for k in AWS_REGIONS})
+
+        with patch("loadsbroker.aws.populate_region_ami_ids") as populate:
+            pool = self._callFUT("br12", ami_cache=path)
+            await pool.wait_ready()
+            pool.shutdown()
+        self.assertFalse(populate.called)
 
     @gen_test(timeout=10)
     async def test_recovered_instances(self):
@@ -243,10 +695,10 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Get the pool
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
 
         # Verify 5 instances recovered
-        self.assertEqual(len(pool._instances[first_region]), 5)
+        self.assertEqual(pool._instances.count(first_region), 5)
 
     @gen_test
     async def test_allocates_instances_for_collection(self):
@@ -259,13 +711,253 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
 
         coll = await pool.request_instances("run_12", "12423", 5,
                                             inst_type="m1.small",
                                             region=region)
         self.assertEqual(len(coll.instances), 5)
 
+    def _capacity_limited(self, conn, available):
+        """Patch run_instances to only have ``available`` instances of
+        every type left."""
+        from boto.exception import EC2ResponseError
+        run_instances = conn.run_instances
+
+        def limited_run_instances(ami_id, min_count=1, max_count=1,
+                                  instance_type="m1.small", **kwargs):
+            left = available.get(instance_type, 0)
+            if left < min_count:
+                body = ("<Response><Errors><Error>"
+                        "<Code>InsufficientInstanceCapacity</Code>"
+                        "<Message>Insufficient capacity.</Message>"
+                        "</Error></Errors></Response>")
+                raise EC2ResponseError(500, "Server Error", body)
+            count = min(left, max_count)
+            available[instance_type] = left - count
+            return run_instances(ami_id, min_count=count, max_count=count,
+                                 instance_type=instance_type, **kwargs)
+        return patch.object(conn, "run_instances",
+                            side_effect=limited_run_instances)
+
+    @gen_test
+    async def test_multi_region_allocation(self):
+        from loadsbroker.aws import MultiRegionCollection
+        regions = ["us-west-2", "us-east-1"]
+        for region in regions:
+            conn = boto.ec2.connect_to_region(region)
+            reservation = conn.run_instances('ami-1234abcd')
+            instance = reservation.instances[0]
+            conn.create_image(instance.id, "CoreOS stable")
+            conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+
+        coll = await pool.request_instances(
+            "run_12", "12423", 6, inst_type="m1.small",
+            regions=[("us-west-2", 2), ("us-east-1", 1)])
+        self.assertIsInstance(coll, MultiRegionCollection)
+        self.assertEqual(len(coll.instances), 6)
+        self.assertEqual([len(x.instances) for x in coll.collections], [4, 2])
+        self.assertEqual({x.instance.region for x in coll.instances},
+                         set(regions))
+
+        await coll.wait_for_running()
+        await coll.remove_instances(
+            [x.instances[0] for x in coll.collections])
+        self.assertEqual(len(coll.running_instances()), 4)
+
+        await pool.release_instances(coll)
+        self.assertEqual(pool.idle_counts(),
+                         {"us-west-2": {"m1.small": 3},
+                          "us-east-1": {"m1.small": 1}})
+
+    @gen_test
+    async def test_partial_allocation(self):
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        conn = await pool._region_conn(region)
+
+        available = {"m1.small": 6}
+        with self._capacity_limited(conn, available):
+            coll = await pool.request_instances(
+                "run_12", "12423", 8, inst_type="m1.large", region=region,
+                min_count=5, fallback_types=["m1.small"])
+        self.assertEqual(len(coll.instances), 6)
+        self.assertEqual(
+            {x.instance.instance_type for x in coll.instances}, {"m1.small"})
+
+    @gen_test
+    async def test_partial_allocation_minimum(self):
+        from loadsbroker.exceptions import LoadsException
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        conn = await pool._region_conn(region)
+
+        available = {"m1.small": 3}
+        with self._capacity_limited(conn, available):
+            with self.assertRaises(LoadsException):
+                await pool.request_instances(
+                    "run_12", "12423", 8, inst_type="m1.small",
+                    region=region, min_count=5)
+
+        # What was allocated is given back
+        states = {x.state for x in conn.get_only_instances()}
+        self.assertEqual(states, {"terminated"})
+
+    @gen_test
+    async def test_partial_allocation_failed_chunk(self):
+        from boto.exception import EC2ResponseError
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        conn = await pool._region_conn(region)
+
+        run_instances = conn.run_instances
+        body = ("<Response><Errors><Error>"
+                "<Code>UnauthorizedOperation</Code>"
+                "<Message>Not authorized.</Message>"
+                "</Error></Errors></Response>")
+        calls = []
+
+        def run_then_fail(ami_id, min_count=1, max_count=1, **kwargs):
+            calls.append(max_count)
+            if len(calls) > 1:
+                raise EC2ResponseError(403, "Forbidden", body)
+            return run_instances(ami_id, min_count=max_count,
+                                 max_count=max_count, **kwargs)
+
+        with patch.object(conn, "run_instances", side_effect=run_then_fail), \
+                patch("loadsbroker.aws.ALLOCATION_CHUNK", 2):
+            with self.assertRaises(EC2ResponseError):
+                await pool.request_instances(
+                    "run_12", "12423", 4, inst_type="m1.small",
+                    region=region, min_count=3)
+
+        # The chunk launched before the failure isn't leaked
+        states = {x.state for x in conn.get_only_instances()}
+        self.assertEqual(states, {"terminated"})
+
+    @gen_test
+    async def test_fallback_idle_instances_used_last(self):
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        conn = await pool._region_conn(region)
+        for instance in conn.run_instances("ami-1234abcd", 3).instances:
+            pool._instances.add(region, instance)
+
+        available = {"m1.large": 4}
+        with self._capacity_limited(conn, available):
+            coll = await pool.request_instances(
+                "run_12", "12423", 4, inst_type="m1.large", region=region,
+                min_count=2, fallback_types=["m1.small"])
+        self.assertEqual(
+            {x.instance.instance_type for x in coll.instances}, {"m1.large"})
+        self.assertEqual(pool.idle_counts(), {region: {"m1.small": 3}})
+
+        # Once the requested type runs short, the idle ones make it up
+        with self._capacity_limited(conn, {"m1.large": 1}):
+            coll = await pool.request_instances(
+                "run_12", "12424", 4, inst_type="m1.large", region=region,
+                min_count=2, fallback_types=["m1.small"])
+        types = sorted(x.instance.instance_type for x in coll.instances)
+        self.assertEqual(types, ["m1.large"] + ["m1.small"] * 3)
+        self.assertEqual(pool.idle_counts(), {})
+
+    @gen_test
+    async def test_spot_allocation(self):
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        conn = await pool._region_conn(region)
+
+        fulfilled = conn.run_instances("ami-1234abcd", 3).instances
+        requests = [
+            Mock(id="sir-1", state="active", instance_id=fulfilled[0].id),
+            Mock(id="sir-2", state="active", instance_id=fulfilled[1].id),
+            Mock(id="sir-3", state="open", instance_id=None),
+            Mock(id="sir-4", state="open", instance_id=None),
+        ]
+        # sir-3 got fulfilled while it was being cancelled
+        cancelled = [
+            Mock(id="sir-3", state="cancelled", instance_id=fulfilled[2].id),
+            Mock(id="sir-4", state="cancelled", instance_id=None),
+        ]
+        request = patch.object(conn, "request_spot_instances",
+                               return_value=requests)
+        describe = patch.object(conn, "get_all_spot_instance_requests",
+                                side_effect=[requests, cancelled])
+        cancel = patch.object(conn, "cancel_spot_instance_requests")
+        with request as request, describe as describe, cancel as cancel, \
+                patch("loadsbroker.aws.SPOT_TIMEOUT", 0):
+            coll = await pool.request_instances(
+                "run_12", "12423", 4, inst_type="m1.small", region=region,
+                min_count=2, spot_price="0.05")
+
+        self.assertEqual(request.call_args[0][0], "0.05")
+        self.assertEqual(request.call_args[1]["count"], 4)
+        cancel.assert_called_once_with(["sir-3", "sir-4"])
+        self.assertEqual(describe.call_args[1]["request_ids"],
+                         ["sir-3", "sir-4"])
+        self.assertEqual({x.instance.id for x in coll.instances},
+                         {x.id for x in fulfilled})
+
+    @gen_test
+    async def test_spot_instances_not_pooled(self):
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+        conn.terminate_instances([instance.id])
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+
+        coll = await pool.request_instances("run_12", "12423", 3,
+                                            inst_type="m1.small",
+                                            region=region)
+        coll.instances[0].instance.spot_instance_request_id = "sir-1"
+        await pool.release_instances(coll)
+
+        self.assertEqual(pool._instances.count(region), 2)
+        spot = conn.get_only_instances([coll.instances[0].instance.id])
+        self.assertEqual(spot[0].state, "terminated")
+
     @gen_test
     async def test_tags(self):
         region = "us-west-2"
@@ -280,7 +972,7 @@ class Test_ec2_pool(AsyncTestCase):
 
         pool = self._callFUT(broker_id)
         pool.use_filters = True
-        await pool.ready
+        await pool.wait_ready()
 
         coll = await pool.request_instances("run_12", "12423", 5,
                                             inst_type="m1.small",
@@ -300,10 +992,41 @@ class Test_ec2_pool(AsyncTestCase):
                 tagged += 1
         self.assertEqual(tagged, len(ids))
 
+    @gen_test
+    async def test_tags_retry_missing_instances(self):
+        from boto.exception import EC2ResponseError
+        conn = boto.connect_ec2()
+        reservation = conn.run_instances("ami-1234abcd", 5)
+        ids = [x.id for x in reservation.instances]
+        create_tags = conn.create_tags
+        missing = [ids[0]]
+
+        def flaky_create_tags(instance_ids, tags):
+            if missing and missing[0] in instance_ids:
+                body = ("<Response><Errors><Error>"
+                        "<Code>InvalidInstanceID.NotFound</Code>"
+                        "<Message>The instance ID '%s' does not exist"
+                        "</Message></Error></Errors></Response>" % missing[0])
+                missing.pop()
+                raise EC2ResponseError(400, "Bad Request", body)
+            return create_tags(instance_ids, tags)
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        with patch.object(conn, "create_tags",
+                          side_effect=flaky_create_tags) as tag:
+            await pool._tag_instances(conn, ids, {"Project": "loads"})
+
+        # The found instances are tagged at once, the missing one retried
+        self.assertEqual([x[0][0] for x in tag.call_args_list],
+                         [ids, ids[1:], ids[:1]])
+        for instance in conn.get_only_instances(ids):
+            self.assertEqual(instance.tags["Project"], "loads")
+
     @gen_test
     async def test_reaper_tags(self):
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
 
         run_max_time = 64800
         now = datetime.utcnow().replace(second=0, microsecond=0)
@@ -342,15 +1065,15 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
 
-        self.assertEqual(len(pool._instances[region]), 5)
+        self.assertEqual(pool._instances.count(region), 5)
 
         coll = await pool.request_instances("run_12", "12423", 5,
                                             inst_type="m1.small",
                                             region=region)
         self.assertEqual(len(coll.instances), 5)
-        self.assertEqual(len(pool._instances[region]), 0)
+        self.assertEqual(pool._instances.count(region), 0)
 
     @gen_test
     async def test_allocate_ignores_already_assigned(self):
@@ -376,9 +1099,9 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
 
-        self.assertEqual(len(pool._instances[region]), 0)
+        self.assertEqual(pool._instances.count(region), 0)
         self.assertEqual(len(pool._recovered[("asdf", "hjkl")]), 5)
         coll = await pool.request_instances("run_12", "12423", 5,
                                             inst_type="m1.small",
@@ -409,7 +1132,7 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
         pool.use_filters = True
 
         self.assertEqual(len(pool._recovered[("asdf", "hjkl")]), 3)
@@ -421,6 +1144,30 @@ class Test_ec2_pool(AsyncTestCase):
         self.assertEqual(len(coll.instances), 3)
         self.assertEqual(len(pool._recovered[("asdf", "hjkl")]), 0)
 
+    @gen_test
+    async def test_collections_share_executor(self):
+        region = "us-west-2"
+        # Setup the AMI we need available to make instances
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+
+        pool = self._callFUT("br12", collection_threads=4)
+        await pool.wait_ready()
+
+        colls = await gen.multi([
+            pool.request_instances("run_12", uuid, 5, inst_type="m1.small",
+                                   region=region)
+            for uuid in ("12423", "42315")])
+        await gen.multi([coll.wait_for_running() for coll in colls])
+        for coll in colls:
+            self.assertIs(coll._executor, pool._collection_executor)
+        self.assertLessEqual(len(pool._collection_executor._threads), 4)
+
+        await gen.multi([pool.release_instances(coll) for coll in colls])
+        self.assertFalse(pool._collection_executor._shutdown)
+
     @gen_test
     async def test_returning_instances(self):
         region = "us-west-2"
@@ -432,7 +1179,7 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
         pool.use_filters = True
 
         coll = await pool.request_instances("run_12", "12423", 5,
@@ -443,14 +1190,74 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Return them
         await pool.release_instances(coll)
-        self.assertEqual(len(pool._instances[region]), 5)
+        self.assertEqual(pool._instances.count(region), 5)
 
         # Acquire 5 again
         coll = await pool.request_instances("run_12", "42315", 5,
                                             inst_type="m1.small",
                                             region=region)
         self.assertEqual(len(coll.instances), 5)
-        self.assertEqual(len(pool._instances[region]), 0)
+        self.assertEqual(pool._instances.count(region), 0)
+
+    @gen_test
+    async def test_reaping_idle_instances(self):
+        region = "us-west-2"
+        # Setup the AMI we need available to make instances
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+
+        pool = self._callFUT("br12", max_idle=0, min_idle=2)
+        await pool.wait_ready()
+
+        coll = await pool.request_instances("run_12", "12423", 5,
+                                            inst_type="m1.small",
+                                            region=region)
+        await coll.wait_for_running()
+        await pool.release_instances(coll)
+        self.assertEqual(pool.idle_counts(), {region: {"m1.small": 5}})
+
+        # Only the minimum of warm instances is kept
+        await pool.reap_idle_instances()
+        self.assertEqual(pool.idle_counts(), {region: {"m1.small": 2}})
+        ids = [x.instance.id for x in coll.instances]
+        states = {x.id: x.state for x in conn.get_only_instances(ids)}
+        self.assertEqual(sorted(states.values()),
+                         ["running"] * 2 + ["terminated"] * 3)
+
+    @gen_test(timeout=10)
+    async def test_warm_pool(self):
+        region = "us-west-2"
+        # Setup the AMI we need available to make instances
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+
+        prepared = []
+
+        async def prepare(collection):
+            prepared.append(len(collection.instances))
+
+        pool = self._callFUT("br12", warm_pool={(region, "m1.small"): 3},
+                             prepare_instances=prepare)
+        await pool.wait_ready()
+
+        # The instance made for the AMI is recovered into the pool, and
+        # concurrent top ups only allocate what's missing once
+        await gen.multi([pool.warm_up(), pool.warm_up(region)])
+        self.assertEqual(prepared, [2])
+        self.assertEqual(pool.idle_counts(), {region: {"m1.small": 3}})
+
+        coll = await pool.request_instances("run_12", "12423", 2,
+                                            inst_type="m1.small",
+                                            region=region)
+        self.assertEqual({x.instance.state for x in coll.instances},
+                         {"running"})
+        await pool.warm_up()
+        self.assertEqual(prepared, [2, 2])
+        self.assertEqual(pool.idle_counts(), {region: {"m1.small": 3}})
 
     @gen_test
     async def test_reaping_all_instances(self):
@@ -463,7 +1270,7 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Now run the test
         pool = self._callFUT("br12")
-        await pool.ready
+        await pool.wait_ready()
         pool.use_filters = True
 
         coll = await pool.request_instances("run_12", "12423", 5,
@@ -474,8 +1281,48 @@ class Test_ec2_pool(AsyncTestCase):
 
         # Return them
         await pool.release_instances(coll)
-        self.assertEqual(len(pool._instances[region]), 5)
+        self.assertEqual(pool._instances.count(region), 5)
 
         # Now, reap them
-        await pool.reap_instances()
-        self.assertEqual(len(pool._instances[region]), 0)
+        terminated = await pool.reap_instances()
+        self.assertEqual(pool._instances.count(region), 0)
+        self.assertEqual(sorted(terminated[region]),
+                         sorted(x.instance.id for x in coll.instances))
+
+    @gen_test
+    async def test_reaping_retries_failures(self):
+        from boto.exception import EC2ResponseError
+        region = "us-west-2"
+        conn = boto.ec2.connect_to_region(region)
+        reservation = conn.run_instances('ami-1234abcd')
+        instance = reservation.instances[0]
+        conn.create_image(instance.id, "CoreOS stable")
+
+        pool = self._callFUT("br12")
+        await pool.wait_ready()
+        coll = await pool.request_instances("run_12", "12423", 5,
+                                            inst_type="m1.small",
+                                            region=region)
+        await pool.release_instances(coll)
+        ids = sorted(x.instance.id for x in coll.instances)
+
+        conn = await pool._region_conn(region)
+        terminate = conn.terminate_instances
+        failures = []
+
+        def flaky_terminate(instance_ids):
+            if not failures:
+                failures.append(instance_ids)
+                raise EC2ResponseError(500, "Server Error", "")
+            return terminate(instance_ids)
+
+        with patch.object(conn, "terminate_instances",
+                          side_effect=flaky_terminate) as term, \
+                patch("loadsbroker.aws.TERMINATE_BATCH_SIZE", 2):
+            terminated = await pool.reap_instances()
+
+        # Batches are terminated separately, the failed one retried
+        self.assertEqual(sorted(len(x[0][0]) for x in term.call_args_list),
+                         [1, 2, 2, 2])
+        self.assertEqual(sorted(terminated[region]), ids)
+        self.assertEqual(pool.idle_counts(), {})
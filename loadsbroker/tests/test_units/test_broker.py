@@ -1,4 +1,5 @@
 import os
+import time
 
 import boto
 from mock import Mock, PropertyMock, patch
@@ -87,7 +88,7 @@ class Test_run_manager(AsyncTestCase):
     async def _createFUT(self, plan_uuid=None, run_uuid=None):
         from loadsbroker.broker import RunManager, RunHelpers
         from loadsbroker.extensions import (
-            Docker, DNSMasq, InfluxDB, SSH, Telegraf, Watcher)
+            Docker, DNSMasq, Grafana, InfluxDB, SSH, Telegraf, Watcher)
         from loadsbroker.aws import EC2Pool
         from loadsbroker.db import Plan, Run
 
@@ -106,11 +107,12 @@ class Test_run_manager(AsyncTestCase):
         kwargs["io_loop"] = self.io_loop
         kwargs["use_filters"] = False
         pool = EC2Pool("broker_1234", **kwargs)
-        await pool.ready
+        await pool.wait_ready()
 
         helpers = RunHelpers()
         helpers.docker = Mock(spec=Docker)
         helpers.dns = Mock(spec=DNSMasq)
+        helpers.grafana = Mock(spec=Grafana)
         helpers.influxdb = Mock(spec=InfluxDB)
         helpers.telegraf = Mock(spec=Telegraf)
         helpers.ssh = Mock(spec=SSH)
@@ -121,6 +123,8 @@ class Test_run_manager(AsyncTestCase):
         helpers.docker.setup_collection = return_none
         helpers.docker.wait = return_none
         helpers.docker.load_containers = return_none
+        helpers.grafana.start = return_none
+        helpers.grafana.stop = return_none
         self.helpers = helpers
 
         run = Run.new_run(self.db_session, plan_uuid)
@@ -154,7 +158,7 @@ class Test_run_manager(AsyncTestCase):
         self.assertEqual(rm.state, INITIALIZING)
         await rm._initialize()
         self.assertEqual(rm.state, RUNNING)
-        rm.sleep_time = 0.5
+        rm.scheduler.check_interval = 0.5
 
         run_j = rm.run.json()
         self.assertEqual(run_j['plan_id'], 1)
@@ -188,6 +192,40 @@ class Test_run_manager(AsyncTestCase):
         self.assertEqual(rm.state, COMPLETED)
         self.assertEqual(result, None)
 
+    @gen_test(timeout=10)
+    async def test_run_deadlines(self):
+        from loadsbroker.db import TERMINATING
+        rm = await self._createFUT()
+        await rm._initialize()
+        rm.scheduler.check_interval = 60
+        for step in rm.run.plan.steps:
+            if step.run_max_time:
+                step.run_max_time = 1
+
+        async def zero_out(*args, **kwargs):
+            return None
+        for helper in ("ssh", "dns", "watcher", "influxdb", "telegraf"):
+            for name in ("start", "stop", "reload_sysctl"):
+                setattr(getattr(self.helpers, helper), name, zero_out)
+        self.helpers.docker.run_containers = zero_out
+        self.helpers.docker.stop_containers = zero_out
+        checks = []
+
+        async def is_running(*args, **kwargs):
+            checks.append(args)
+            return True
+        self.helpers.docker.is_running = is_running
+
+        # Steps stop on their deadline, and the monitor once they're
+        # done, without waiting on a container check
+        start = time.time()
+        await rm._run()
+        self.assertEqual(rm.state, TERMINATING)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(checks, [])
+        self.assertEqual([s.ec2_collection.finished for s in rm._set_links],
+                         [True, True, True])
+
     @gen_test(timeout=20)
     async def test_abort(self):
         from loadsbroker.db import (
@@ -197,7 +235,7 @@ class Test_run_manager(AsyncTestCase):
         self.assertEqual(rm.state, INITIALIZING)
         await rm._initialize()
         self.assertEqual(rm.state, RUNNING)
-        rm.sleep_time = 0.5
+        rm.scheduler.check_interval = 0.5
 
         # Zero out extra calls
         async def zero_out(*args, **kwargs):
@@ -229,3 +267,166 @@ class Test_run_manager(AsyncTestCase):
         self.assertEqual(result, None)
         self.assertEqual([s.ec2_collection.finished for s in rm._set_links],
                          [False, False, False])
+
+    @gen_test(timeout=10)
+    async def test_provision_just_in_time(self):
+        from tornado import gen
+        rm = await self._createFUT()
+        await rm._initialize()
+        self.assertEqual(rm._set_links, [])
+
+        # Only the steps starting soon are provisioned
+        late = [s for s in rm.run.plan.steps
+                if s != rm.run.get_monitor_step()][0]
+        late.run_delay = 3600
+        rm._provision_due()
+        self.assertEqual(rm._pending, [late])
+        await gen.multi(rm._provisioning)
+        self.assertEqual(len(rm._set_links), 2)
+        self.assertTrue(all(s.ready for s in rm._set_links))
+        self.assertNotIn(late, [s.step for s in rm._set_links])
+
+        # Provisioning was quick, so the late step is provisioned closer
+        # to its start than assumed at first
+        self.assertLess(rm.scheduler.provision_lead(late), 3600)
+        self.assertGreater(rm._provision_at(late), rm.run.started_at)
+
+        # And the run is woken up for it at that time
+        deadlines = [when for when, _, _ in rm.scheduler._deadlines]
+        self.assertIn(rm._provision_at(late), deadlines)
+
+    @gen_test(timeout=10)
+    async def test_recover_run(self):
+        from datetime import datetime
+        from tornado import gen
+        from loadsbroker.broker import RunManager, RunScheduler
+        from loadsbroker.db import RUNNING, COMPLETED
+        rm = await self._createFUT()
+        await rm._initialize()
+        self.assertEqual(rm.state, RUNNING)
+        rm._provision_due()
+        await gen.multi(rm._provisioning)
+
+        # Every step was started before the broker went away, and its
+        # instances are recovered by the new broker's pool
+        pool = rm._pool
+        for setlink in rm._set_links:
+            setlink.step_record.started_at = datetime.utcnow()
+            coll = setlink.ec2_collection
+            pool._recovered[(rm.run.uuid, coll.uuid)] = [
+                x.instance for x in coll.instances]
+        self.db_session.commit()
+        conn = boto.ec2.connect_to_region("us-west-2")
+        instance_count = len(conn.get_only_instances())
+
+        async def zero_out(*args, **kwargs):
+            return None
+        for helper in ("ssh", "dns", "watcher", "influxdb", "telegraf"):
+            for name in ("start", "stop", "reload_sysctl"):
+                setattr(getattr(self.helpers, helper), name, zero_out)
+        self.helpers.docker.stop_containers = zero_out
+        starts = []
+
+        async def run_containers(*args, **kwargs):
+            starts.append(args)
+        self.helpers.docker.run_containers = run_containers
+
+        async def is_running(*args, **kwargs):
+            return False
+        self.helpers.docker.is_running = is_running
+
+        # The run finishes on the same instances, without any container
+        # being started again
+        scheduler = RunScheduler(self.io_loop, check_interval=0.5)
+        mgr, future = RunManager.recover_run(
+            self.helpers, self.db_session, pool, self.io_loop,
+            rm.run.uuid, scheduler=scheduler)
+        await future
+        self.assertEqual(mgr.state, COMPLETED)
+        self.assertEqual(starts, [])
+        self.assertEqual(len(conn.get_only_instances()), instance_count)
+
+    @gen_test(timeout=10)
+    async def test_recover_run_without_monitor(self):
+        from datetime import datetime
+        from tornado import gen
+        from loadsbroker.broker import RunManager, RunScheduler
+        from loadsbroker.db import RUNNING, COMPLETED
+        rm = await self._createFUT()
+        await rm._initialize()
+        self.assertEqual(rm.state, RUNNING)
+        rm._provision_due()
+        await gen.multi(rm._provisioning)
+
+        # None of the monitor's instances survived the broker
+        pool = rm._pool
+        monitor_step = rm.run.get_monitor_step()
+        for setlink in rm._set_links:
+            setlink.step_record.started_at = datetime.utcnow()
+            if setlink.step == monitor_step:
+                continue
+            coll = setlink.ec2_collection
+            pool._recovered[(rm.run.uuid, coll.uuid)] = [
+                x.instance for x in coll.instances]
+        self.db_session.commit()
+
+        async def zero_out(*args, **kwargs):
+            return None
+        for helper in ("ssh", "dns", "watcher", "influxdb", "telegraf"):
+            for name in ("start", "stop", "reload_sysctl"):
+                setattr(getattr(self.helpers, helper), name, zero_out)
+        self.helpers.docker.stop_containers = zero_out
+        self.helpers.docker.run_containers = zero_out
+
+        # The run is aborted rather than failing to reattach
+        scheduler = RunScheduler(self.io_loop, check_interval=0.5)
+        mgr, future = RunManager.recover_run(
+            self.helpers, self.db_session, pool, self.io_loop,
+            rm.run.uuid, scheduler=scheduler)
+        await future
+        self.assertEqual(mgr.state, COMPLETED)
+        self.assertTrue(mgr.run.aborted)
+
+
+class Test_run_scheduler(AsyncTestCase):
+    def _makeOne(self, **kwargs):
+        from loadsbroker.broker import RunScheduler
+        return RunScheduler(self.io_loop, **kwargs)
+
+    def _manager(self, woken, name):
+        return Mock(wake_up=lambda: woken.append(name))
+
+    @gen_test
+    async def test_merged_deadlines(self):
+        from datetime import datetime, timedelta
+        from tornado import gen
+        scheduler = self._makeOne(check_interval=60)
+        woken = []
+        first = self._manager(woken, "first")
+        second = self._manager(woken, "second")
+        scheduler.register(first)
+        scheduler.register(second)
+
+        now = datetime.utcnow()
+        scheduler.wake_at(first, now + timedelta(seconds=0.2))
+        scheduler.wake_at(second, now + timedelta(seconds=0.1))
+        await gen.sleep(0.3)
+        self.assertEqual(woken, ["second", "first"])
+        self.assertEqual(scheduler.round, 0)
+
+        # Runs that are done aren't woken up anymore
+        scheduler.unregister(first)
+        scheduler.wake_at(first, datetime.utcnow())
+        await gen.sleep(0.05)
+        self.assertEqual(woken, ["second", "first"])
+
+    @gen_test
+    async def test_check_rounds(self):
+        from tornado import gen
+        scheduler = self._makeOne(check_interval=0.1)
+        woken = []
+        scheduler.register(self._manager(woken, "first"))
+        scheduler.register(self._manager(woken, "second"))
+        await gen.sleep(0.15)
+        self.assertEqual(scheduler.round, 1)
+        self.assertEqual(sorted(woken), ["first", "second"])
@@ -0,0 +1,178 @@
+import threading
+import unittest
+
+from mock import Mock, patch
+
+
+def container_event(status, cid, image=None, labelled=True):
+    from loadsbroker.dockerctrl import CONTAINER_LABEL
+    attributes = {CONTAINER_LABEL: ""} if labelled else {}
+    return {"Type": "container", "status": status, "id": cid,
+            "from": image, "Actor": {"Attributes": attributes}}
+
+
+def image_event(status, name, image_id="sha256:4bd0a1ff"):
+    # As sent by docker, which only names the repository of pulls
+    if status == "pull":
+        event_id, attributes = name, {"name": name.split(":")[0]}
+    else:
+        event_id, attributes = image_id, {"name": name}
+    return {"Type": "image", "status": status, "id": event_id,
+            "Actor": {"ID": event_id, "Attributes": attributes}}
+
+
+class Test_docker_daemon(unittest.TestCase):
+    def _makeOne(self, **kwargs):
+        from loadsbroker.dockerctrl import DockerDaemon
+        return DockerDaemon("tcp://0.0.0.0:7890", **kwargs)
+
+    def test_running_unwatched(self):
+        daemon = self._makeOne()
+        with patch.object(daemon, "watch") as watch:
+            self.assertIsNone(daemon.running("bbangert/simpletest"))
+        watch.assert_called_once_with()
+
+    def test_running_from_events(self):
+        daemon = self._makeOne()
+        daemon._watcher = Mock()
+        daemon._synced = True
+        daemon._apply_event(
+            container_event("start", "c1", "bbangert/simpletest:dev"))
+        daemon._apply_event(
+            container_event("start", "c2", "kitcambridge/dnsmasq:latest"))
+        daemon._apply_event(
+            container_event("start", "c3", "redis:3", labelled=False))
+        self.assertTrue(daemon.running("bbangert/simpletest"))
+        self.assertFalse(daemon.running("influxdb"))
+
+        # Unlabelled containers are left to a listing of the containers
+        self.assertIsNone(daemon.running("redis"))
+
+        daemon._apply_event(container_event("die", "c1"))
+        self.assertFalse(daemon.running("bbangert/simpletest"))
+        self.assertTrue(daemon.running("kitcambridge/dnsmasq"))
+
+    def test_watch_syncs_then_follows_events(self):
+        from loadsbroker.dockerctrl import CONTAINER_LABEL
+        daemon = self._makeOne(events_window=120)
+        client = Mock()
+        client.containers.return_value = [
+            {"Id": "c1", "Image": "bbangert/simpletest:dev",
+             "Labels": {CONTAINER_LABEL: ""}},
+            {"Id": "c3", "Image": "redis:3", "Labels": None}]
+        client.events.return_value = iter([
+            container_event("start", "c2", "influxdb:1.1"),
+            container_event("destroy", "c1"),
+        ])
+        with patch("loadsbroker.dockerctrl.docker.Client",
+                   return_value=client):
+            daemon._watch()
+
+        # Not queried during the window, so the watch ended after it
+        self.assertEqual(client.events.call_count, 1)
+        _, kwargs = client.events.call_args
+        self.assertEqual(kwargs["until"] - kwargs["since"], 120)
+        self.assertEqual(daemon._containers, {"c2": ("influxdb:1.1", True),
+                                              "c3": ("redis:3", False)})
+        self.assertFalse(daemon._synced)
+        self.assertIsNone(daemon._watcher)
+
+    def test_watchers_bounded(self):
+        from loadsbroker.dockerctrl import DockerDaemon
+        slots = threading.BoundedSemaphore(2)
+        daemons = [self._makeOne(watcher_slots=slots) for _ in range(3)]
+        released = threading.Event()
+        with patch.object(DockerDaemon, "_watch",
+                          side_effect=released.wait), \
+                patch("loadsbroker.dockerctrl.logger") as logger:
+            for daemon in daemons:
+                self.assertIsNone(daemon.running("bbangert/simpletest"))
+            watchers = [x._watcher for x in daemons]
+            self.assertIsNone(watchers[2])
+
+            # The daemon left over is polled, which is logged once
+            daemons[2].running("bbangert/simpletest")
+            self.assertEqual(logger.debug.call_count, 1)
+
+            # Slots are handed to the next daemons queried once free
+            released.set()
+            for watcher in watchers[:2]:
+                watcher.join()
+            daemons[2].running("bbangert/simpletest")
+            self.assertIsNotNone(daemons[2]._watcher)
+            daemons[2]._watcher.join()
+
+    def test_has_image_indexed(self):
+        daemon = self._makeOne()
+        client = daemon._client = Mock()
+        client.images.return_value = [
+            {"RepoTags": ["bbangert/simpletest:dev", "simpletest:latest"]},
+            {"RepoTags": None},
+        ]
+        self.assertTrue(daemon.has_image("simpletest:latest"))
+        self.assertFalse(daemon.has_image("influxdb:1.1"))
+        self.assertEqual(client.images.call_count, 1)
+
+        # Loaded images are seen once the index is refreshed
+        client.images.return_value = [{"RepoTags": ["influxdb:1.1"]}]
+        self.assertTrue(daemon.has_image("influxdb:1.1", refresh=True))
+        self.assertEqual(client.images.call_count, 2)
+
+    def test_image_events(self):
+        daemon = self._makeOne()
+        daemon._images = {"bbangert/simpletest:dev"}
+        daemon._apply_event(image_event("pull", "influxdb:1.1"))
+        self.assertTrue(daemon.has_image("influxdb:1.1"))
+        daemon._apply_event(image_event("tag", "simpletest:latest"))
+        self.assertTrue(daemon.has_image("simpletest:latest"))
+        self.assertFalse(daemon.has_image("influxdb"))
+
+        # Removed images have the index listed again
+        daemon._apply_event(image_event("untag", "influxdb:1.1"))
+        self.assertIsNone(daemon._images)
+
+    def _client(self, out=(), err=(), status=0):
+        channel = Mock()
+        out, err = list(out), list(err)
+        channel.recv_ready = lambda: bool(out)
+        channel.recv = lambda size: out.pop(0)
+        channel.recv_stderr_ready = lambda: bool(err)
+        channel.recv_stderr = lambda size: err.pop(0)
+        channel.exit_status_ready = lambda: not out and not err
+        channel.recv_exit_status.return_value = status
+        client = Mock()
+        client.exec_command.return_value = (Mock(), Mock(channel=channel),
+                                            Mock())
+        return client
+
+    @patch("loadsbroker.dockerctrl.select.select")
+    def test_import_container(self, select):
+        daemon = self._makeOne()
+        client = self._client(
+            out=[b"5f70bf18a086: Loading layer 1 MB\r5f70bf18a086: Loading",
+                 b" layer 2 MB\nd1f8a6f2e1b1: Loading layer 1 MB\n",
+                 b"Loaded image: bbangert/simpletest:dev\n"],
+            err=[b"1048576 bytes (1.0 MB, 1.0 MiB) copied, 1 s, 1 MB/s\r",
+                 b"3145728 bytes (3.1 MB, 3.0 MiB) copied, 2 s, 1.5 MB/s\n"])
+        updates = []
+        result = daemon.import_container(
+            client, "http://broker/images/abc",
+            progress=lambda p: updates.append(p.bytes_transferred))
+
+        self.assertEqual(result.bytes_transferred, 3145728)
+        self.assertEqual(result.layers_loaded, 2)
+        self.assertIsNotNone(result.finished_at)
+        self.assertEqual(updates[-1], 3145728)
+        command = client.exec_command.call_args[0][0]
+        self.assertTrue(command.startswith("bash -o pipefail -c "))
+
+    @patch("loadsbroker.dockerctrl.select.select")
+    def test_import_container_failed(self, select):
+        from loadsbroker.exceptions import ImageImportException
+        daemon = self._makeOne()
+        client = self._client(
+            err=[b"curl: (22) The requested URL returned error: 404\n"],
+            status=22)
+        with self.assertRaises(ImageImportException) as cm:
+            daemon.import_container(client, "http://broker/images/abc")
+        self.assertIn("error: 404", str(cm.exception))
@@ -0,0 +1,168 @@
+from tornado.testing import AsyncTestCase, gen_test
+from mock import Mock
+
+SOURCE_URL = "https://s3.amazonaws.com/loads-images/simpletest-dev.tar.bz2"
+
+
+class FakeCollection:
+    def __init__(self, instances):
+        self.instances = instances
+
+    async def execute(self, func, *args):
+        return func(*args)
+
+
+def fake_instance(index, region="us-west-2"):
+    instance = Mock()
+    instance.instance = Mock(id="i-%d" % index, region=region,
+                             private_ip_address="10.0.0.%d" % index,
+                             images=set())
+    images = set()
+    instance.state.docker.has_image = lambda name, refresh=False: (
+        name in images)
+    instance.state.images = images
+    return instance
+
+
+class Test_load_containers(AsyncTestCase):
+    def _makeOne(self, failing=()):
+        from loadsbroker.exceptions import ImageImportException
+        from loadsbroker.extensions import Docker
+        docker = Docker(Mock())
+        self.sources = {}
+
+        def _import(instance, name, url):
+            self.sources.setdefault(instance.instance.id, []).append(url)
+            if instance.instance.id in failing:
+                raise ImageImportException("Importing %s failed" % url)
+            instance.state.images.add(name)
+            return Mock(throughput=1e6)
+        docker._import = _import
+        return docker
+
+    def _parent(self, instances, inst_id):
+        """The instance an instance loaded the image from, if any"""
+        url = self.sources[inst_id][0]
+        if url == SOURCE_URL:
+            return None
+        ip = url.split("//")[1].split(":")[0]
+        return [x for x in instances
+                if x.instance.private_ip_address == ip][0]
+
+    @gen_test
+    async def test_single_parent(self):
+        from loadsbroker.extensions import FANOUT, FANOUT_SEEDS
+        instances = [fake_instance(x) for x in range(30)]
+        docker = self._makeOne()
+        await docker.load_containers(FakeCollection(instances),
+                                     "bbangert/simpletest:dev", SOURCE_URL)
+
+        for index, instance in enumerate(instances):
+            inst_id = instance.instance.id
+            self.assertEqual(len(self.sources[inst_id]), 1)
+            self.assertIn("bbangert/simpletest:dev",
+                          instance.instance.images)
+            parent = self._parent(instances, inst_id)
+            if index < FANOUT_SEEDS:
+                self.assertIsNone(parent)
+            else:
+                self.assertIs(parent,
+                              instances[(index - FANOUT_SEEDS) // FANOUT])
+
+    @gen_test
+    async def test_failed_parent(self):
+        from loadsbroker.extensions import FANOUT, FANOUT_SEEDS
+        instances = [fake_instance(x) for x in range(30)]
+        docker = self._makeOne(failing={"i-0"})
+        await docker.load_containers(FakeCollection(instances),
+                                     "bbangert/simpletest:dev", SOURCE_URL)
+
+        # The children of the failed seed load it from the source
+        children = range(FANOUT_SEEDS, FANOUT_SEEDS + FANOUT)
+        for index in children:
+            inst_id = instances[index].instance.id
+            self.assertEqual(self.sources[inst_id], [SOURCE_URL])
+            self.assertIn("bbangert/simpletest:dev",
+                          instances[index].instance.images)
+        self.assertNotIn("bbangert/simpletest:dev",
+                         instances[0].instance.images)
+
+        # And pass it on as usual
+        grandchild = instances[FANOUT_SEEDS + children[0] * FANOUT]
+        self.assertIs(self._parent(instances, grandchild.instance.id),
+                      instances[children[0]])
+
+    @gen_test
+    async def test_regions_apart(self):
+        from loadsbroker.extensions import FANOUT_SEEDS
+        regions = ["us-west-2", "eu-west-1"]
+        instances = [fake_instance(x, regions[x % 2]) for x in range(40)]
+        docker = self._makeOne()
+        await docker.load_containers(FakeCollection(instances),
+                                     "bbangert/simpletest:dev", SOURCE_URL)
+
+        seeds = {region: 0 for region in regions}
+        for instance in instances:
+            parent = self._parent(instances, instance.instance.id)
+            region = instance.instance.region
+            if parent is None:
+                seeds[region] += 1
+            else:
+                self.assertEqual(parent.instance.region, region)
+        self.assertEqual(seeds, {region: FANOUT_SEEDS for region in regions})
+
+
+class Test_is_running(AsyncTestCase):
+    def _makeOne(self, **kwargs):
+        from loadsbroker.extensions import Docker
+        return Docker(Mock(), **kwargs)
+
+    @gen_test
+    async def test_checks_bounded(self):
+        from tornado import gen
+        instances = [fake_instance(x) for x in range(10)]
+        for instance in instances:
+            instance.state.docker.running = lambda name: None
+            instance.state.docker.get_containers = lambda: {}
+        listing = []
+        peak = []
+
+        class SlowCollection(FakeCollection):
+            def running_instances(self):
+                return self.instances
+
+            async def execute(self, func, *args):
+                listing.append(1)
+                peak.append(len(listing))
+                await gen.sleep(0.01)
+                listing.pop()
+                return func(*args)
+
+        docker = self._makeOne(max_concurrent_checks=3)
+        running = await docker.is_running(SlowCollection(instances),
+                                          "bbangert/simpletest:dev")
+        self.assertFalse(running)
+        self.assertEqual(len(peak), 10)
+        self.assertEqual(max(peak), 3)
+
+
+class Test_setup_collection(AsyncTestCase):
+    @gen_test
+    async def test_daemons_share_watchers(self):
+        from loadsbroker.extensions import Docker
+
+        class MapCollection(FakeCollection):
+            async def map(self, func):
+                return [func(x) for x in self.instances]
+
+        instances = [Mock(spec=["instance", "state"]) for _ in range(3)]
+        for index, instance in enumerate(instances):
+            instance.instance.ip_address = "10.0.1.%d" % index
+            instance.state = Mock(spec=[])
+        docker = Docker(Mock(), events_window=120, watcher_threads=2)
+        await docker.setup_collection(MapCollection(instances))
+
+        daemons = [x.state.docker for x in instances]
+        self.assertEqual({x.events_window for x in daemons}, {120})
+        self.assertEqual({id(x._watcher_slots) for x in daemons},
+                         {id(docker._watcher_slots)})
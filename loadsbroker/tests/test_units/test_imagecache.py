@@ -0,0 +1,113 @@
+import hashlib
+import shutil
+import tempfile
+
+import tornado.web
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+IMAGE = b"not really a bzip2 tarball" * 1000
+
+
+class ImageHandler(tornado.web.RequestHandler):
+    def get(self):
+        if self.application.fail:
+            raise tornado.web.HTTPError(503)
+        self.write(self.application.images[self.request.path])
+
+    def on_finish(self):
+        # Revalidated images are answered with a 304 by finish
+        if self.get_status() == 200:
+            self.application.downloads += 1
+
+
+class Test_image_cache(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super().tearDown()
+
+    def get_app(self):
+        app = tornado.web.Application([(r"/.*\.tar\.bz2", ImageHandler)])
+        app.images = {"/simpletest.tar.bz2": IMAGE}
+        app.downloads = 0
+        app.fail = False
+        return app
+
+    def _makeOne(self, **kwargs):
+        from loadsbroker.imagecache import ImageCache
+        return ImageCache(self.path, "http://broker:8080/images/", **kwargs)
+
+    @gen_test
+    async def test_fetched_once(self):
+        cache = self._makeOne()
+        url = self.get_url("/simpletest.tar.bz2")
+        urls = await gen.multi([cache.url_for(url), cache.url_for(url)])
+
+        digest = hashlib.sha256(IMAGE).hexdigest()
+        self.assertEqual(urls, ["http://broker:8080/images/" + digest] * 2)
+        self.assertEqual(self._app.downloads, 1)
+        with open(cache._blob(digest), "rb") as f:
+            self.assertEqual(f.read(), IMAGE)
+
+        # The index outlives the broker, the image is only revalidated
+        self.assertEqual(await self._makeOne().fetch(url), digest)
+        self.assertEqual(self._app.downloads, 1)
+
+    @gen_test
+    async def test_changed_image_fetched_again(self):
+        import os
+        cache = self._makeOne()
+        url = self.get_url("/simpletest.tar.bz2")
+        old = await cache.fetch(url)
+
+        # Uploaded again, like a new latest tag
+        image = IMAGE + b"with a fix"
+        self._app.images["/simpletest.tar.bz2"] = image
+        digest = await cache.fetch(url)
+        self.assertEqual(digest, hashlib.sha256(image).hexdigest())
+        self.assertEqual(self._app.downloads, 2)
+        self.assertFalse(os.path.exists(cache._blob(old)))
+
+    @gen_test
+    async def test_stored_image_used_when_unreachable(self):
+        cache = self._makeOne()
+        url = self.get_url("/simpletest.tar.bz2")
+        digest = await cache.fetch(url)
+
+        self._app.fail = True
+        self.assertEqual(await cache.fetch(url), digest)
+
+    @gen_test
+    async def test_least_recently_used_evicted(self):
+        import os
+        cache = self._makeOne(max_size=len(IMAGE) * 2 + 10)
+        self._app.images.update({"/dnsmasq.tar.bz2": IMAGE + b"1",
+                                 "/influxdb.tar.bz2": IMAGE + b"2"})
+        first = await cache.fetch(self.get_url("/simpletest.tar.bz2"))
+        second = await cache.fetch(self.get_url("/dnsmasq.tar.bz2"))
+        third = await cache.fetch(self.get_url("/influxdb.tar.bz2"))
+
+        self.assertFalse(os.path.exists(cache._blob(first)))
+        self.assertTrue(os.path.exists(cache._blob(second)))
+        self.assertTrue(os.path.exists(cache._blob(third)))
+        self.assertEqual(sorted(x["digest"] for x in cache._index.values()),
+                         sorted([second, third]))
+
+    @gen_test
+    async def test_failed_fetch(self):
+        import os
+        cache = self._makeOne()
+        with self.assertRaises(Exception):
+            await cache.fetch(self.get_url("/missing.tar.bz2"))
+        self.assertEqual(cache._index, {})
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_is_digest(self):
+        from loadsbroker.imagecache import is_digest
+        self.assertTrue(is_digest(hashlib.sha256(IMAGE).hexdigest()))
+        self.assertFalse(is_digest("index.json"))
+        self.assertFalse(is_digest("../" + "a" * 64))
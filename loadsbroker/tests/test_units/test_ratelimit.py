@@ -0,0 +1,113 @@
+import unittest
+
+from boto.exception import EC2ResponseError
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from loadsbroker.ratelimit import DESCRIBE, MUTATE, RateLimiter, TokenBucket
+
+
+def _throttled():
+    body = ("<Response><Errors><Error>"
+            "<Code>RequestLimitExceeded</Code>"
+            "<Message>Request limit exceeded.</Message>"
+            "</Error></Errors></Response>")
+    return EC2ResponseError(503, "Service Unavailable", body)
+
+
+def _done(result=None, exc=None):
+    fut = Future()
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+    return fut
+
+
+class Test_token_bucket(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+    def _makeOne(self, rate=2, burst=2):
+        return TokenBucket(rate, burst, clock=lambda: self.now)
+
+    def test_burst_then_rate(self):
+        bucket = self._makeOne()
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.assertEqual(bucket.reserve(), 1)
+
+        self.now += 1
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_throttled(self):
+        bucket = self._makeOne()
+        bucket.throttled(3)
+        self.assertEqual(bucket.rate, 1)
+        # Paused, even with tokens left
+        self.assertEqual(bucket.reserve(), 3)
+
+        for _ in range(20):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 2)
+
+
+class Test_rate_limiter(AsyncTestCase):
+    def _makeOne(self, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        return RateLimiter(self.io_loop, **kwargs)
+
+    @gen_test
+    async def test_call(self):
+        limiter = self._makeOne()
+        result = await limiter.call("us-west-2", DESCRIBE,
+                                    lambda: _done("instances"))
+        self.assertEqual(result, "instances")
+        metrics = limiter.metrics()["us-west-2"][DESCRIBE]
+        self.assertEqual(metrics["calls"], 1)
+        self.assertEqual(metrics["throttled"], 0)
+
+    @gen_test
+    async def test_queues_over_limit(self):
+        limiter = self._makeOne(limits={MUTATE: (100, 1)})
+        for _ in range(3):
+            await limiter.call("us-west-2", MUTATE, _done)
+        metrics = limiter.metrics()["us-west-2"][MUTATE]
+        self.assertEqual(metrics["calls"], 3)
+        self.assertEqual(metrics["delayed"], 2)
+        self.assertEqual(metrics["queued"], 0)
+
+    @gen_test
+    async def test_retries_throttled(self):
+        limiter = self._makeOne()
+        attempts = []
+
+        def run():
+            attempts.append(None)
+            if len(attempts) < 3:
+                return _done(exc=_throttled())
+            return _done("tagged")
+
+        result = await limiter.call("us-west-2", MUTATE, run)
+        self.assertEqual(result, "tagged")
+        self.assertEqual(len(attempts), 3)
+        metrics = limiter.metrics()["us-west-2"][MUTATE]
+        self.assertEqual(metrics["throttled"], 2)
+        self.assertLess(metrics["rate"], 5)
+
+    @gen_test
+    async def test_gives_up(self):
+        limiter = self._makeOne(retries=1)
+        with self.assertRaises(EC2ResponseError):
+            await limiter.call("us-west-2", MUTATE,
+                               lambda: _done(exc=_throttled()))
+        self.assertEqual(limiter.metrics()["us-west-2"][MUTATE]["calls"], 2)
+
+    @gen_test
+    async def test_other_errors_raise(self):
+        limiter = self._makeOne()
+        with self.assertRaises(ValueError):
+            await limiter.call("us-west-2", MUTATE,
+                               lambda: _done(exc=ValueError()))
+        self.assertEqual(limiter.metrics()["us-west-2"][MUTATE]["calls"], 1)
@@ -9,7 +9,7 @@ from loadsbroker.webapp.api import (
     ProjectHandler,
     OrchestrateHandler
 )
-from loadsbroker.webapp.views import GrafanaHandler
+from loadsbroker.webapp.views import GrafanaHandler, ImageCacheHandler
 
 
 _GRAFANA = os.path.join(os.path.dirname(__file__), 'grafana')
@@ -24,5 +24,6 @@ application = tornado.web.Application([
     (r"/api/project/(.*)", ProjectHandler),
     (r"/api/orchestrate/(.*)", OrchestrateHandler),
     (r"/dashboards/run/([^\/]+)/(.*)", GrafanaHandler,
-     {"path": _GRAFANA, "default_filename": "index.html"})
+     {"path": _GRAFANA, "default_filename": "index.html"}),
+    (r"/images/(.*)", ImageCacheHandler),
 ])
@@ -19,18 +19,18 @@ URL layout:
 
 ``/api/instances/*`` -> :class:`~InstanceHandler`
 
+``/images/DIGEST`` -> :class:`~loadsbroker.webapp.views.ImageCacheHandler`
+
 """
 import json
 import os
 
 import tornado.web
-from tornado import gen
 from sqlalchemy.orm.exc import NoResultFound
 
 from loadsbroker import __version__, logger
 from loadsbroker.db import Run, COMPLETED, Project, Plan
 from loadsbroker.exceptions import LoadsException
-from loadsbroker.aws import AWS_REGIONS
 
 
 _DEFAULTS = {'user_data': os.path.join(os.path.dirname(__file__), 'aws.yml')}
@@ -93,7 +93,8 @@ class BaseHandler(tornado.web.RequestHandler):
 class RootHandler(BaseHandler):
     """Root API handler"""
     def get(self):
-        """Returns the version, and current runs in progress."""
+        """Returns the version, current runs in progress, the idle
+        instance counts and the EC2 API call metrics."""
         self.response['version'] = __version__
         # XXX filtering...
         limit = self.get_query_argument('limit', None)
@@ -104,6 +105,8 @@ class RootHandler(BaseHandler):
             offset = int(offset)
         self.response['runs'] = self.broker.get_runs(limit=limit,
                                                      offset=offset)
+        self.response['idle_instances'] = self.broker.pool.idle_counts()
+        self.response['aws_api'] = self.broker.pool.limiter.metrics()
         self.write_json()
 
 
@@ -148,12 +151,12 @@ class ProjectHandler(BaseHandler):
 class InstancesHandler(BaseHandler):
     """Instances handler"""
 
-    async def prepare(self):
-        super().prepare()
-        pool = self.broker.pool
-        instancelist = await gen.multi(
-            [pool._recover_region(x) for x in AWS_REGIONS])
-        self.instancelist = instancelist
+    async def _get_instancelist(self):
+        return await self.broker.pool.inventory.get_all()
+
+    def _terminate(self, instance):
+        instance.terminate()
+        self.broker.pool.inventory.invalidate(instance.region.name)
 
     def _instance_to_dict(self, instance):
         res = {}
@@ -165,20 +168,20 @@ class InstancesHandler(BaseHandler):
         res['placement'] = instance.placement
         return res
 
-    def get(self):
+    async def get(self):
         """Returns a list of instances"""
         res = {}
-        for instances in self.instancelist:
+        for instances in await self._get_instancelist():
             for instance in instances:
                 res[instance.id] = self._instance_to_dict(instance)
         self.response['instances'] = res
         self.write_json()
 
-    def delete(self):
+    async def delete(self):
         terminated = []
-        for instances in self.instancelist:
+        for instances in await self._get_instancelist():
             for instance in instances:
-                instance.terminate()
+                self._terminate(instance)
                 terminated.append(instance.id)
 
         self.response['terminated'] = terminated
@@ -187,33 +190,33 @@ class InstancesHandler(BaseHandler):
 
 class InstanceHandler(InstancesHandler):
     """Instance handler"""
-    def _get_instance(self, id):
-        for instances in self.instancelist:
+    async def _get_instance(self, id):
+        for instances in await self._get_instancelist():
             for instance in instances:
                 if instance.id == id:
                     return instance
 
-    def get(self, id):
+    async def get(self, id):
         """Returns a list of instances"""
-        instance = self._get_instance(id)
+        instance = await self._get_instance(id)
         self.response['instance'] = self._instance_to_dict(instance)
         self.write_json()
 
-    def delete(self, id):
+    async def delete(self, id):
         """Terminate an instance"""
-        instance = self._get_instance(id)
-        instance.terminate()
+        instance = await self._get_instance(id)
+        self._terminate(instance)
         self.write_json()
 
 
 class RunHandler(BaseHandler):
     """Run API handler"""
-    async def prepare(self):
-        super().prepare()
-        pool = self.broker.pool
-        instancelist = await gen.multi(
-            [pool._recover_region(x) for x in AWS_REGIONS])
-        self.instancelist = instancelist
+    async def _get_instancelist(self):
+        return await self.broker.pool.inventory.get_all()
+
+    def _terminate(self, instance):
+        instance.terminate()
+        self.broker.pool.inventory.invalidate(instance.region.name)
 
     def _instance_to_dict(self, instance):
         res = {}
@@ -225,7 +228,7 @@ class RunHandler(BaseHandler):
         res['placement'] = instance.placement
         return res
 
-    def delete(self, run_id, **kwargs):
+    async def delete(self, run_id, **kwargs):
         """Deleting a run does the following:
             - stops everything running
             - move the status to TERMINATED
@@ -258,10 +261,10 @@ class RunHandler(BaseHandler):
         # 3. kill instances if asked
         if 'terminate' in self.request.arguments:
             terminated = []
-            for instances in self.instancelist:
+            for instances in await self._get_instancelist():
                 for instance in instances:
                     if instance.tags.get('RunId') == run_id:
-                        instance.terminate()
+                        self._terminate(instance)
                         terminated.append(instance.id)
 
             self.response['terminated'] = terminated
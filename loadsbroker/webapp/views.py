@@ -1,6 +1,8 @@
 from string import Template
 
-from tornado.web import StaticFileHandler
+from tornado.web import HTTPError, StaticFileHandler
+
+from loadsbroker.imagecache import is_digest
 
 
 class GrafanaHandler(StaticFileHandler):
@@ -48,3 +50,20 @@ class GrafanaHandler(StaticFileHandler):
             await self.flush()
         else:
             await StaticFileHandler.get(self, path, include_body)
+
+
+class ImageCacheHandler(StaticFileHandler):
+    """Serves the container images of the broker's image cache"""
+    def initialize(self):
+        self.image_cache = self.application.broker.image_cache
+        path = self.image_cache.path if self.image_cache else ""
+        super(ImageCacheHandler, self).initialize(path)
+
+    def prepare(self):
+        # Only the stored images are served
+        if self.image_cache is None or not is_digest(self.path_args[0]):
+            raise HTTPError(404)
+
+    def get_cache_time(self, path, modified, mime_type):
+        # Content-addressed, so they never change
+        return self.CACHE_MAX_AGE